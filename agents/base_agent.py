@@ -1,23 +1,37 @@
 import json
 import os
+import copy
 import logging
-from dotenv import load_dotenv
+from functools import lru_cache
+from services.metrics import span
 
 logger = logging.getLogger('kidsbook')
 
-# Ensure environment variables from .env are loaded
-load_dotenv()
+@lru_cache(maxsize=None)
+def _read_config(config_path: str):
+    with span('config_load'), open(config_path) as f:
+        return json.load(f)
+
+
+def load_config(config_path: str):
+    """
+    Returns the parsed JSON configuration, reading the file only once per process.
+    A deep copy is returned so callers can mutate their section freely.
+    """
+    return copy.deepcopy(_read_config(config_path))
+
 
 class BaseAgent:
-    def __init__(self, config_path: str, agent_key: str):
+    def __init__(self, config_path: str, agent_key: str, http_client=None):
         """
         Initializes an agent from a JSON configuration file.
         The configuration for the specific agent is loaded from the provided key.
         Azure credentials are injected from environment variables.
+        An optional shared httpx client can be supplied so the agent reuses a
+        pooled keep-alive connection instead of opening its own.
         """
         try:
-            with open(config_path) as f:
-                config_json = json.load(f)
+            config_json = load_config(config_path)
             self.config = config_json.get(agent_key)
             if self.config is None:
                 raise KeyError(f"Agent key '{agent_key}' not found in the configuration")
@@ -30,7 +44,8 @@ class BaseAgent:
                 'api_key': azure_api_key,
                 'endpoint': azure_endpoint
             }
+            self.http_client = http_client
             logger.info(f"Initialized agent '{agent_key}' successfully.")
         except Exception as e:
             logger.exception(f"Error initializing BaseAgent: {str(e)}")
-            raise
\ No newline at end of file
+            raise
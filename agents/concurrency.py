@@ -0,0 +1,60 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger('kidsbook')
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds how many calls of one kind run at once in this process and keeps
+    queue-depth counters so saturation is visible.
+    """
+
+    def __init__(self, name: str, limit: int):
+        if limit < 1:
+            raise ValueError(f"Concurrency limit for '{name}' must be at least 1")
+        self.name = name
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.total_wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Waits for a free slot, then holds it for the duration of the block."""
+        queued = self._semaphore.locked()
+        if queued:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        started = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            if queued:
+                self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.total_wait_seconds += waited
+        if waited > 1.0:
+            logger.debug(f"{self.name}: waited {waited:.2f}s for a slot ({self.waiting} still queued)")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "completed": self.completed,
+            "total_wait_seconds": round(self.total_wait_seconds, 3)
+        }
@@ -1,31 +1,55 @@
+import os
+import math
 import logging
-from openai import OpenAI  # Changed from AsyncAzureOpenAI
+from openai import AsyncAzureOpenAI
 from .base_agent import BaseAgent
-import re
-import asyncio
+from .concurrency import ConcurrencyLimiter
+from .ratelimit import DeploymentRateLimiter
+from .moderation import get_content_filter
+from .resilience import Resilience
+from .prompting import EditorPrompt, StoryReader, TokenBudget, TruncatedCompletion
+from services.cache import make_key, normalize_text
+from services.metrics import span, record_token_usage
+from services.coordination import worker_count
 
 logger = logging.getLogger('kidsbook')
 
+DEFAULT_MAX_CONCURRENCY = 32
+
 class EditorAgent(BaseAgent):
-    def __init__(self, config_path='azure_config.json'):
+    def __init__(self, config_path='azure_config.json', http_client=None, cache=None, coordination=None):
         """
         Initialize the EditorAgent using Azure OpenAI (GPT-4o) and configure the OpenAI SDK.
+        An optional ResultCache short-circuits repeat submissions. An optional `rate_limit`
+        section adds per-deployment token buckets, shared across workers through `coordination`.
+        The prompt and JSON response format are assembled once here; `max_tokens` is sized
+        per story by the token budget.
         """
-        super().__init__(config_path, 'editor_agent')
+        super().__init__(config_path, 'editor_agent', http_client=http_client)
+        self.config_path = config_path
         self.client = self._configure_openai()
+        self.cache = cache
+        self.prompt = EditorPrompt(self.config['prompt'])
+        self.budget = TokenBudget.from_config(self.config, self.prompt)
+        max_concurrency = int(os.environ.get(
+            'EDITOR_MAX_CONCURRENCY',
+            self.config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+        ))
+        # The limit is for the whole deployment, so each worker process gets its share
+        self.limiter = ConcurrencyLimiter('editor', max(1, math.ceil(max_concurrency / worker_count())))
+        self.rate_limiter = DeploymentRateLimiter.from_config('editor', self.config, backend=coordination)
+        self.resilience = Resilience.from_config('editor', self.config)
 
     def _configure_openai(self):
         """Configure Azure OpenAI client."""
         try:
-            # Format the base_url correctly for Azure OpenAI
-            azure_endpoint = self.config['azure_ai']['endpoint'].rstrip('/')
-            deployment_name = self.config['deployment_name']
-            base_url = f"{azure_endpoint}/openai/deployments/{deployment_name}"
-            
-            client = OpenAI(
+            client = AsyncAzureOpenAI(
                 api_key=self.config['azure_ai']['api_key'],
-                base_url=base_url,
-                default_query={'api-version': '2025-01-01-preview'}  # API version as default query parameter
+                api_version=self.config.get('api_version', '2025-01-01-preview'),
+                azure_endpoint=self.config['azure_ai']['endpoint'],
+                http_client=self.http_client,
+                # Retries, hedging and fallback are handled by self.resilience
+                max_retries=0
             )
             logger.info("Azure OpenAI client configured successfully.")
             return client
@@ -33,31 +57,156 @@ class EditorAgent(BaseAgent):
             logger.exception(f"Error configuring Azure OpenAI client: {str(e)}")
             raise
 
-    async def edit_story(self, story: str):
+    def _messages(self, story: str):
+        return self.prompt.messages(story)
+
+    def _request(self, plan: dict):
+        """Chat completion arguments for a budget plan, including `model_config` sampling params."""
+        params = {
+            "messages": plan['messages'],
+            "temperature": self.config['temperature'],
+            "max_tokens": plan['max_tokens'],
+            **self.config.get('model_config', {})
+        }
+        if self.prompt.response_format is not None:
+            params["response_format"] = self.prompt.response_format
+        return params
+
+    def output_reader(self):
+        """A StoryReader for one completion, streamed or whole."""
+        return StoryReader(self.prompt)
+
+    def build_result(self, content: str):
+        """Shapes a completion (JSON or plain text) into the result used by the illustrator and the pipeline."""
+        reader = self.output_reader()
+        reader.feed(content)
+        return reader.result()
+
+    async def _admit(self, deployment: str):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(deployment)
+
+    def cache_key(self, story: str, max_tokens: int = None):
+        """
+        Keys a completion on the normalized story, prompt, deployment and generation params,
+        including a `max_tokens` override in place of the configured ceiling.
+        """
+        return make_key(
+            'editor',
+            story=normalize_text(story),
+            prompt=self.prompt.fingerprint,
+            deployment=self.config['deployment_name'],
+            temperature=self.config['temperature'],
+            max_tokens=self.config['max_tokens'] if max_tokens is None else max_tokens,
+            model_config=self.config.get('model_config', {}),
+            budget=self.config.get('budget', {})
+        )
+
+    async def edit_story(self, story: str, max_tokens: int = None):
         """
         Edit and enhance the story using Azure OpenAI.
+        At most `max_concurrency` completions run at once; further calls queue.
+        A completion cut off by the token budget is retried once at the configured
+        `max_tokens`; one cut off at that ceiling raises TruncatedCompletion and is not
+        cached. `max_tokens` replaces the budget's size for the first attempt.
         """
         try:
-            # Create completion synchronously since OpenAI v1.x client is not async
-            response = self.client.chat.completions.create(
-                model=self.config['deployment_name'],
-                messages=[
-                    {"role": "system", "content": self.config['prompt']['system']},
-                    {"role": "user", "content": story}
-                ],
-                temperature=self.config['temperature'],
-                max_tokens=self.config['max_tokens']
-            )
-            
-            edited_story = response.choices[0].message.content
-            return {
-                "final_story": edited_story,
-                "illustrator_prompt": "Create illustrations for: " + edited_story[:200]
-            }
+            if self.cache is not None:
+                key = self.cache_key(story, max_tokens)
+                cached = await self.cache.get(key)
+                if cached is not None:
+                    logger.info("Editor result served from cache.")
+                    return cached
+
+            try:
+                result = await self._complete(story, max_tokens)
+            except TruncatedCompletion as e:
+                if not self.budget.can_retry(e):
+                    raise
+                result = await self._complete(story, self.budget.ceiling)
+            if self.cache is not None and result:
+                await self.cache.set(key, 'editor', result)
+            return result
         except Exception as e:
             logger.exception(f"Error editing story: {str(e)}")
             raise
 
+    async def _complete(self, story: str, max_tokens: int = None):
+        """One non-streamed completion, shaped by `build_result`."""
+        async with self.limiter.slot():
+            plan = self.budget.plan(self.prompt, story, max_tokens)
+            with span('editor_call'):
+                response = await self.resilience.call(
+                    lambda deployment: self.client.chat.completions.create(
+                        model=deployment,
+                        **self._request(plan)
+                    ),
+                    admit=self._admit
+                )
+        record_token_usage('editor', response.usage)
+        finish_reason = response.choices[0].finish_reason
+        self.budget.record(plan, response.usage, finish_reason)
+        if finish_reason == 'length':
+            raise TruncatedCompletion(plan['max_tokens'])
+        return self.build_result(response.choices[0].message.content or '')
+
+    async def stream_edit_story(self, story: str):
+        """
+        Edit the story like `edit_story`, yielding completion deltas as the model produces them.
+        The caller feeds them to an `output_reader()`, which returns the readable story text
+        as it arrives and the editor result once the stream ends. A stream cut off at
+        `max_tokens` raises TruncatedCompletion after its last delta and is not cached.
+        """
+        try:
+            if self.cache is not None:
+                key = self.cache_key(story)
+                cached = await self.cache.get(key)
+                if cached is not None:
+                    logger.info("Editor result served from cache.")
+                    yield self.prompt.replay(cached)
+                    return
+
+            parts = []
+            usage = finish_reason = None
+            async with self.limiter.slot():
+                plan = self.budget.plan(self.prompt, story)
+                with span('editor_call'):
+                    # Retries and hedging cover opening the stream; once tokens flow it is not retried
+                    stream = await self.resilience.call(
+                        lambda deployment: self.client.chat.completions.create(
+                            model=deployment,
+                            stream=True,
+                            # Usage arrives in a final chunk with no choices
+                            stream_options={"include_usage": True},
+                            **self._request(plan)
+                        ),
+                        admit=self._admit,
+                        # Only opening the stream is timed, so it gets its own hedge threshold
+                        kind='stream'
+                    )
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                            record_token_usage('editor', chunk.usage)
+                        if not chunk.choices:
+                            continue
+                        if chunk.choices[0].finish_reason:
+                            finish_reason = chunk.choices[0].finish_reason
+                        if chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+            self.budget.record(plan, usage, finish_reason)
+            if finish_reason == 'length':
+                raise TruncatedCompletion(plan['max_tokens'])
+
+            if self.cache is not None and parts:
+                result = self.build_result(''.join(parts))
+                if result:
+                    await self.cache.set(key, 'editor', result)
+        except Exception as e:
+            logger.exception(f"Error streaming story edit: {str(e)}")
+            raise
+
     def _extract_interesting_points(self, story: str):
         """
         Extracts interesting points from the story.
@@ -70,23 +219,11 @@ class EditorAgent(BaseAgent):
         """
         Applies content filtering ensuring story appropriateness.
         """
-        banned_keywords = [
-            'violence', 'murder', 'anger', 'hate',
-            'explicit', 'adult', 'sexual', 'scary',
-            'blood', 'curse', 'profanity'
-        ]
-        sentences = re.split(r'(?<=[.!?])\s+', story)
-        filtered_sentences = []
-        for sentence in sentences:
-            if not any(re.search(r'\b' + re.escape(keyword) + r'\b', sentence, flags=re.IGNORECASE)
-                       for keyword in banned_keywords):
-                filtered_sentences.append(sentence)
-        return ' '.join(filtered_sentences)
+        return get_content_filter(self.config_path).filter(story)
 
     async def process_story(self, story: str):
         """
         Filters and then starts asynchronous editing of the story.
         """
         filtered_story = self.filter_content(story)
-        # Run the synchronous OpenAI call in a thread pool
-        return await asyncio.to_thread(self.edit_story, filtered_story)
\ No newline at end of file
+        return await self.edit_story(filtered_story)
\ No newline at end of file
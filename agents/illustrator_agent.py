@@ -5,14 +5,32 @@ import logging
 from openai import AsyncAzureOpenAI  # Changed to AsyncAzureOpenAI
 from httpx import AsyncClient, Request, Response, AsyncHTTPTransport
 from .base_agent import BaseAgent
+from .ratelimit import DeploymentRateLimiter
+from .resilience import Resilience
+from services.cache import make_key
+from services.metrics import span
 
 logger = logging.getLogger('kidsbook')
 
 class IllustratorAgent(BaseAgent):
-    def __init__(self, config_path='azure_config.json'):
-        """Initialize the IllustratorAgent with configuration for DALL-E 3."""
-        super().__init__(config_path, 'illustrator_agent')
+    def __init__(self, config_path='azure_config.json', http_client=None, cache=None, image_store=None,
+                 coordination=None):
+        """
+        Initialize the IllustratorAgent with configuration for DALL-E 3. With a coordination
+        backend the per-deployment rate limits are shared by every worker process.
+        """
+        super().__init__(config_path, 'illustrator_agent', http_client=http_client)
         self.client = self._configure_openai()
+        self.cache = cache
+        self.image_store = image_store
+        rate_limit = self.config.get('rate_limit', {})
+        self.rate_limiter = DeploymentRateLimiter(
+            'illustrator',
+            float(rate_limit.get('requests_per_minute', 20)),
+            burst=rate_limit.get('burst'),
+            backend=coordination
+        )
+        self.resilience = Resilience.from_config('illustrator', self.config)
 
     def _configure_openai(self):
         """Configure Azure OpenAI client."""
@@ -20,7 +38,10 @@ class IllustratorAgent(BaseAgent):
             client = AsyncAzureOpenAI(  # Using AsyncAzureOpenAI
                 api_key=self.config['azure_ai']['api_key'],
                 api_version="2024-02-01",
-                azure_endpoint=self.config['azure_ai']['endpoint']
+                azure_endpoint=self.config['azure_ai']['endpoint'],
+                http_client=self.http_client,
+                # Retries, hedging and fallback are handled by self.resilience
+                max_retries=0
             )
             logger.info("Azure OpenAI client configured successfully.")
             return client
@@ -37,30 +58,120 @@ class IllustratorAgent(BaseAgent):
         Returns:
             str: URL of the generated cover image.
         """
+        cover = await self.generate_cover(final_story)
+        return cover['url']
+
+    async def generate_cover(self, final_story: str, summary: str = None):
+        """
+        Generate a cover image and persist it through the image store when one is configured.
+        `summary` is the editor's illustrator prompt; without it the story opening is used.
+
+        Returns:
+            dict: {"url", "source_url", "variants"}; `url` is the persistent copy when stored.
+        """
+        return await self._generate_image(self._create_cover_prompt(final_story, summary))
+
+    async def _generate_image(self, prompt: str):
         try:
-            prompt = self._create_cover_prompt(final_story)
-            
-            response = await self.client.images.generate(
-                model=self.config['deployment_name'],
-                prompt=prompt,
-                n=self.config['generation_params']['n'],
-                size=self.config['image_size'],
-                quality="standard"
-            )
-            
-            logger.info("Cover image generated successfully.")
-            return response.data[0].url
+            if self.cache is not None:
+                key = self.cache_key(prompt)
+                cached = await self.cache.get(key)
+                if cached is not None:
+                    logger.info("Image served from cache.")
+                    return cached
+
+            response = await self._request_image(prompt)
+            logger.info("Image generated successfully.")
+            source_url = response.data[0].url
+            image = {"url": source_url, "source_url": source_url, "variants": {}}
+            if self.image_store is not None:
+                try:
+                    image = await self.image_store.store(source_url)
+                except Exception as e:
+                    # The temporary URL still works for a while, so the book is not lost
+                    logger.warning(f"Could not persist generated image, using its temporary URL: {str(e)}")
+
+            if self.cache is not None and source_url:
+                # Temporary DALL-E URLs expire within hours, persisted copies do not
+                kind = 'illustrator' if image['url'] != source_url else 'illustrator_remote'
+                await self.cache.set(key, kind, image)
+            return image
             
         except Exception as e:
-            logger.exception(f"Cover image generation failed: {str(e)}")
+            logger.exception(f"Image generation failed: {str(e)}")
             raise
 
-    def _create_cover_prompt(self, final_story: str):
+    async def _request_image(self, prompt: str):
+        """Calls DALL-E within the deployment's rate limit through the resilience layer."""
+        async def request(deployment: str):
+            with span('image_call'):
+                return await self.client.images.generate(
+                    model=deployment,
+                    prompt=prompt,
+                    n=self.config['generation_params']['n'],
+                    size=self.config['image_size'],
+                    quality="standard"
+                )
+        # Every attempt, including hedges and fallbacks, spends a rate-limit token
+        return await self.resilience.call(request, admit=self.rate_limiter.acquire)
+
+    async def generate_illustrations(self, pages: list):
+        """
+        Generate one illustration per page concurrently.
+
+        Args:
+            pages (list): Page texts, in reading order.
+        Returns:
+            list: One dict per page with "page", "text", "url" and "variants". Pages whose
+            image failed after retries have "url" set to None and an "error", so the
+            rest of the book is still returned.
+        """
+        async def illustrate(number: int, text: str):
+            try:
+                image = await self._generate_image(self._create_page_prompt(text, number, len(pages)))
+                return {"page": number, "text": text, "url": image['url'], "variants": image.get('variants', {})}
+            except Exception as e:
+                logger.warning(f"Illustration for page {number} failed: {str(e)}")
+                return {"page": number, "text": text, "url": None, "variants": {}, "error": str(e)}
+
+        illustrations = await asyncio.gather(*(
+            illustrate(number, text) for number, text in enumerate(pages, start=1)
+        ))
+        failed = sum(1 for item in illustrations if item['url'] is None)
+        logger.info(f"Generated {len(pages) - failed}/{len(pages)} page illustrations.")
+        return list(illustrations)
+
+    def cache_key(self, prompt: str):
+        """Keys an image on the exact prompt, deployment and generation params."""
+        return make_key(
+            'illustrator',
+            prompt=prompt,
+            deployment=self.config['deployment_name'],
+            size=self.config['image_size'],
+            quality="standard",
+            n=self.config['generation_params']['n']
+        )
+
+    def _create_cover_prompt(self, final_story: str, summary: str = None):
         """Create a prompt for the cover image."""
-        story_summary = final_story[:200]
+        story_summary = summary or final_story[:200]
         cover_instructions = (
             "Create a captivating and colorful cover image for a children's book based on the following narrative. "
             "The cover should be engaging, playful, and visually reflect the story's themes."
         )
         full_prompt = f"{cover_instructions}\n\nStory Summary: {story_summary}"
-        return full_prompt
\ No newline at end of file
+        return full_prompt
+
+    def _create_page_prompt(self, page_text: str, page_number: int, page_count: int):
+        """Create a prompt for one page illustration in the configured house style."""
+        prompt_config = self.config.get('prompt_config', {})
+        style_guide = prompt_config.get('style_guide', {})
+        style = ", ".join(
+            str(style_guide[key]) for key in ('art_style', 'color_palette', 'character_design')
+            if style_guide.get(key)
+        )
+        page_instructions = (
+            f"{prompt_config.get('system', '')} "
+            f"Illustrate page {page_number} of {page_count} of a children's book. Style: {style}."
+        ).strip()
+        return f"{page_instructions}\n\nPage text: {page_text[:600]}"
\ No newline at end of file
@@ -0,0 +1,113 @@
+import re
+import logging
+from bisect import bisect_right
+from functools import lru_cache
+from .base_agent import load_config
+
+logger = logging.getLogger('kidsbook')
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+DEFAULT_BANNED_KEYWORDS = [
+    'violence', 'murder', 'anger', 'hate',
+    'explicit', 'adult', 'sexual', 'scary',
+    'blood', 'curse', 'profanity'
+]
+
+
+def _trie_pattern(node: dict) -> str:
+    """Turns a character trie into a regex that shares common prefixes between keywords."""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    optional = '' in node
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+
+def compile_keywords(keywords) -> re.Pattern:
+    """
+    Compiles the keyword list into one case-insensitive, whole-word pattern.
+    Keywords are merged into a prefix trie first, so the regex engine follows a
+    single branch per character instead of retrying every keyword at each position.
+    """
+    trie = {}
+    for keyword in keywords:
+        keyword = keyword.strip().lower()
+        if not keyword:
+            continue
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if not trie:
+        return None
+    return re.compile(r'\b' + _trie_pattern(trie) + r'\b', flags=re.IGNORECASE)
+
+
+class ContentFilter:
+    """
+    Keyword moderation shared by the editor and the story processor.
+
+    The whole text is scanned once with a precompiled pattern and each hit is mapped
+    back to the sentence it falls in, so cost grows with the length of the story rather
+    than with sentences × keywords.
+    """
+
+    def __init__(self, keywords=None, enabled: bool = True):
+        self.keywords = list(keywords if keywords is not None else DEFAULT_BANNED_KEYWORDS)
+        self.enabled = enabled
+        self.pattern = compile_keywords(self.keywords)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Reads the `azure_ai.content_filter` section of azure_config.json."""
+        return cls(config.get('banned_keywords'), enabled=config.get('enabled', True))
+
+    def sentence_spans(self, text: str):
+        """(start, end) offsets of each sentence, split the same way as `filter`."""
+        spans = []
+        start = 0
+        for match in SENTENCE_BREAK.finditer(text):
+            spans.append((start, match.start()))
+            start = match.end()
+        spans.append((start, len(text)))
+        return spans
+
+    def scan(self, text: str, spans=None):
+        """Returns every keyword hit as {"keyword", "start", "end", "sentence"}."""
+        if not self.enabled or self.pattern is None or not text:
+            return []
+        starts = [start for start, _ in (spans or self.sentence_spans(text))]
+        return [
+            {
+                "keyword": match.group(0).lower(),
+                "start": match.start(),
+                "end": match.end(),
+                "sentence": bisect_right(starts, match.start()) - 1
+            }
+            for match in self.pattern.finditer(text)
+        ]
+
+    def is_clean(self, text: str) -> bool:
+        if not self.enabled or self.pattern is None:
+            return True
+        return self.pattern.search(text or '') is None
+
+    def filter(self, text: str) -> str:
+        """Drops every sentence that contains a banned keyword."""
+        if not self.enabled or self.pattern is None or not text:
+            return text
+        spans = self.sentence_spans(text)
+        flagged = {hit["sentence"] for hit in self.scan(text, spans)}
+        if flagged:
+            logger.info(f"Content filter removed {len(flagged)} of {len(spans)} sentence(s)")
+        return ' '.join(text[start:end] for i, (start, end) in enumerate(spans) if i not in flagged)
+
+
+@lru_cache(maxsize=None)
+def get_content_filter(config_path: str = 'azure_config.json') -> ContentFilter:
+    """Process-wide filter for a config file, so the pattern is compiled only once."""
+    config = load_config(config_path).get('azure_ai', {}).get('content_filter', {})
+    return ContentFilter.from_config(config)
@@ -0,0 +1,449 @@
+"""
+Prompt assembly, local token counting and output budgeting for the editor.
+
+The editor's system message (persona, numbered instructions and the JSON output format)
+is built once from the `prompt` section of the config. Story tokens are counted locally,
+so `max_tokens` can follow the length of each story instead of a fixed ceiling, and the
+model is asked for a JSON object carrying the title, pages and illustrator prompt in the
+same completion. StoryReader turns that JSON, streamed or whole, into the story text shown
+to readers and the editor result used by the rest of the pipeline.
+"""
+import re
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from services.monitoring import percentile
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+logger = logging.getLogger('kidsbook')
+
+# Chat framing per message and for the reply, as counted by the OpenAI chat format
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_OVERHEAD_TOKENS = 3
+
+# Fields the pipeline reads itself; every other output field is passed through as metadata
+STORY_FIELDS = ('title', 'pages', 'illustrator_prompt')
+
+DEFAULT_OUTPUT_FORMAT = {
+    "title": "string",
+    "target_age": "number",
+    "pages": "array",
+    "illustrator_prompt": "string",
+    "reading_time": "number",
+    "educational_themes": "array"
+}
+
+DEFAULT_BUDGET_CONFIG = {
+    "output_ratio": 1.6,
+    "overhead_tokens": 300,
+    "min_tokens": 600,
+    "chars_per_token": 4.0,
+    "pages": 8
+}
+
+_JSON_TYPES = {
+    "string": {"type": "string"},
+    "number": {"type": "number"},
+    "integer": {"type": "integer"},
+    "boolean": {"type": "boolean"},
+    "array": {"type": "array", "items": {"type": "string"}}
+}
+
+
+class TruncatedCompletion(Exception):
+    """Raised when an editor completion stopped at `max_tokens`, so its story is unfinished."""
+
+    def __init__(self, max_tokens: int):
+        super().__init__(f"Editor completion stopped at max_tokens={max_tokens} before the story ended")
+        self.max_tokens = max_tokens
+
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken when it is installed. Otherwise estimates from the text
+    length, rounding up so that budgets err on the generous side.
+    """
+
+    def __init__(self, model: str = None, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model or '')
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('o200k_base')
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_messages(self, messages: list) -> int:
+        return sum(
+            MESSAGE_OVERHEAD_TOKENS + self.count(message['content']) for message in messages
+        ) + REPLY_OVERHEAD_TOKENS
+
+
+def _field_schema(kind) -> dict:
+    if isinstance(kind, dict):
+        return kind
+    # "array of strings, one per page" -> array; the rest of the description is for the model
+    name = re.match(r'[a-z]*', str(kind).lower()).group(0)
+    return dict(_JSON_TYPES.get(name, _JSON_TYPES["string"]))
+
+
+class EditorPrompt:
+    """
+    The editor's system message and response format, assembled once from the `prompt`
+    config section.
+
+    `response_format` is "json_schema" (strict structured output), "json_object" (JSON
+    mode, with the fields described in the prompt) or "text" for free-form stories.
+    """
+
+    def __init__(self, prompt_config: dict):
+        self.output_format = prompt_config.get('output_format') or DEFAULT_OUTPUT_FORMAT
+        self.mode = prompt_config.get('response_format', 'json_schema')
+        if self.mode not in ('json_schema', 'json_object', 'text'):
+            raise ValueError(f"Unknown editor response_format '{self.mode}'")
+        self.json = self.mode != 'text'
+
+        parts = [prompt_config['system']]
+        if prompt_config.get('instructions'):
+            parts.append('\n'.join(prompt_config['instructions']))
+        if self.json:
+            fields = '\n'.join(f"- {name}: {kind}" for name, kind in self.output_format.items())
+            parts.append(
+                "Respond with a single JSON object with exactly these fields, in this order:\n" + fields
+            )
+        self.system = '\n\n'.join(parts)
+
+        if self.mode == 'json_schema':
+            self.response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "edited_story",
+                    "strict": True,
+                    "schema": {
+                        "type": "object",
+                        "properties": {name: _field_schema(kind) for name, kind in self.output_format.items()},
+                        "required": list(self.output_format),
+                        "additionalProperties": False
+                    }
+                }
+            }
+        elif self.mode == 'json_object':
+            self.response_format = {"type": "json_object"}
+        else:
+            self.response_format = None
+        self.fingerprint = hashlib.sha256(
+            json.dumps([self.system, self.response_format], sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+
+    def envelope(self, pages: int) -> str:
+        """
+        The JSON reply with every field empty and `pages` empty pages: the framing the model
+        writes around the story text. Empty for free-form stories.
+        """
+        if not self.json:
+            return ''
+        fields = {}
+        for name, kind in self.output_format.items():
+            field_type = _field_schema(kind).get('type')
+            if name == 'pages':
+                fields[name] = [''] * pages
+            else:
+                fields[name] = {'array': [], 'number': 0, 'integer': 0, 'boolean': False}.get(field_type, '')
+        return json.dumps(fields, ensure_ascii=False)
+
+    def messages(self, story: str) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": story}
+        ]
+
+    def result(self, fields: dict) -> dict:
+        """Shapes parsed output fields into the editor result."""
+        title = str(fields.get('title') or '').strip()
+        pages = fields.get('pages')
+        if isinstance(pages, str):
+            pages = [pages]
+        pages = [str(page).strip() for page in pages or [] if str(page).strip()]
+        final_story = '\n\n'.join(([title] if title else []) + pages)
+        result = {
+            "final_story": final_story,
+            "title": title,
+            "pages": pages,
+            "illustrator_prompt": str(fields.get('illustrator_prompt') or '').strip()
+            or "Create illustrations for: " + final_story[:200]
+        }
+        for name in self.output_format:
+            if name not in STORY_FIELDS:
+                result[name] = fields.get(name)
+        return result
+
+    def text_result(self, edited_story: str) -> dict:
+        """Editor result for a free-form story, whose pages are split later."""
+        return {
+            "final_story": edited_story,
+            "illustrator_prompt": "Create illustrations for: " + edited_story[:200]
+        }
+
+    def replay(self, result: dict) -> str:
+        """The completion text that `result` was read from, for serving a cached result as a stream."""
+        if 'pages' not in result:
+            return result['final_story']
+        return json.dumps({name: result.get(name) for name in self.output_format})
+
+
+class StoryReader:
+    """
+    Reads an editor completion delta by delta.
+
+    `feed` returns the readable story text the delta added: the title, then each page,
+    separated by blank lines exactly as in the final story. JSON keys, punctuation and
+    metadata fields are not shown. A completion that does not start with "{" is passed
+    through as plain text. `result` parses the whole completion.
+    """
+
+    def __init__(self, prompt: EditorPrompt):
+        self.prompt = prompt
+        self.raw = []
+        self.plain = None
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.unicode = None
+        self.high_surrogate = None
+        self.expect_key = False
+        self.role = None
+        self.key = None
+        self.key_chars = []
+        self.shown = False
+
+    def feed(self, delta: str) -> str:
+        self.raw.append(delta)
+        if self.plain is None:
+            stripped = ''.join(self.raw).lstrip()
+            if not stripped:
+                return ''
+            self.plain = not stripped.startswith('{')
+            if self.plain:
+                return ''.join(self.raw)
+        if self.plain:
+            return delta
+        out = []
+        for char in delta:
+            self._read(char, out)
+        return ''.join(out)
+
+    def _read(self, char: str, out: list):
+        if self.in_string:
+            if self.unicode is not None:
+                self.unicode += char
+                if len(self.unicode) == 4:
+                    code, self.unicode = int(self.unicode, 16), None
+                    if 0xD800 <= code < 0xDC00:
+                        self.high_surrogate = code
+                    elif 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                        code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                        self.high_surrogate = None
+                        self._char(chr(code), out)
+                    else:
+                        self._char(chr(code), out)
+            elif self.escape:
+                self.escape = False
+                if char == 'u':
+                    self.unicode = ''
+                else:
+                    self._char(_ESCAPES.get(char, char), out)
+            elif char == '\\':
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.role == 'key':
+                    self.key = ''.join(self.key_chars)
+            else:
+                self._char(char, out)
+            return
+
+        if char == '"':
+            self.in_string = True
+            self.role = None
+            if self.stack == ['{']:
+                self.role = 'key' if self.expect_key else 'value'
+                self.key_chars = []
+            elif self.stack == ['{', '[']:
+                self.role = 'item'
+            if self.role == 'value' and self.key == 'title':
+                self._separate(out)
+            elif self.role == 'item' and self.key == 'pages':
+                self._separate(out)
+        elif char in '{[':
+            self.stack.append(char)
+            if self.stack == ['{']:
+                self.expect_key = True
+        elif char in '}]':
+            if self.stack:
+                self.stack.pop()
+        elif len(self.stack) == 1:
+            if char == ',':
+                self.expect_key = True
+            elif char == ':':
+                self.expect_key = False
+
+    def _separate(self, out: list):
+        if self.shown:
+            out.append('\n\n')
+
+    def _char(self, char: str, out: list):
+        if self.role == 'key':
+            self.key_chars.append(char)
+        elif (self.role == 'value' and self.key == 'title') or (self.role == 'item' and self.key == 'pages'):
+            out.append(char)
+            self.shown = True
+
+    def result(self):
+        """The editor result, or None when the completion was empty."""
+        raw = ''.join(self.raw).strip()
+        if not raw:
+            return None
+        if self.plain:
+            return self.prompt.text_result(raw)
+        fields = json.loads(raw)
+        if not isinstance(fields, dict):
+            raise ValueError("editor output is not a JSON object")
+        return self.prompt.result(fields)
+
+
+class TokenBudget:
+    """
+    Sizes `max_tokens` for each completion from the expected length of its output, and
+    keeps per-request token usage and latency so the averages can be watched over time.
+
+    The editor is asked to enhance the story, so its text comes back longer than it went
+    in: `output_ratio` times the story's tokens. The JSON reply around it (field names,
+    quoting and `pages` page separators) is counted once from the prompt's output format
+    as `envelope_tokens`, and `overhead_tokens` covers the title, illustrator prompt and
+    the other short fields. The sum is kept between `min_tokens` and the configured
+    `max_tokens`. A completion cut off below that ceiling is retried once at the ceiling
+    (`retries`); one cut off at the ceiling fails rather than keeping an unfinished story.
+    """
+
+    def __init__(self, counter: TokenCounter, ceiling: int, output_ratio: float = 1.6,
+                 overhead_tokens: int = 300, min_tokens: int = 600, envelope_tokens: int = 0, window: int = 500):
+        self.counter = counter
+        self.ceiling = ceiling
+        self.output_ratio = output_ratio
+        self.overhead_tokens = overhead_tokens
+        self.envelope_tokens = envelope_tokens
+        self.min_tokens = min(min_tokens, ceiling)
+        self.requests = 0
+        self.truncated = 0
+        self.retries = 0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, prompt: EditorPrompt = None):
+        """Reads `editor_agent.budget`; `prompt` gives the output format whose JSON framing is counted."""
+        budget = {**DEFAULT_BUDGET_CONFIG, **config.get('budget', {})}
+        counter = TokenCounter(config.get('model'), float(budget['chars_per_token']))
+        return cls(
+            counter,
+            int(config['max_tokens']),
+            output_ratio=float(budget['output_ratio']),
+            overhead_tokens=int(budget['overhead_tokens']),
+            min_tokens=int(budget['min_tokens']),
+            envelope_tokens=counter.count(prompt.envelope(int(budget['pages']))) if prompt is not None else 0
+        )
+
+    def max_tokens(self, story_tokens: int) -> int:
+        wanted = math.ceil(story_tokens * self.output_ratio) + self.envelope_tokens + self.overhead_tokens
+        return max(self.min_tokens, min(self.ceiling, wanted))
+
+    def plan(self, prompt: EditorPrompt, story: str, max_tokens: int = None) -> dict:
+        """
+        Returns the messages, their estimated prompt tokens and `max_tokens` for `story`;
+        `max_tokens` overrides the size taken from the story's length.
+        """
+        messages = prompt.messages(story)
+        if max_tokens is None:
+            max_tokens = self.max_tokens(self.counter.count(story))
+        return {
+            "messages": messages,
+            "prompt_tokens": self.counter.count_messages(messages),
+            "max_tokens": max_tokens,
+            "started": time.perf_counter()
+        }
+
+    def can_retry(self, error: TruncatedCompletion) -> bool:
+        """Whether a completion cut off at `error.max_tokens` gets another try at the ceiling."""
+        if error.max_tokens >= self.ceiling:
+            return False
+        with self._lock:
+            self.retries += 1
+        logger.warning(f"{str(error)}; retrying with max_tokens={self.ceiling}")
+        return True
+
+    def record(self, plan: dict, usage, finish_reason: str = None):
+        """Records one finished completion against the plan it was made with."""
+        sample = {
+            "seconds": time.perf_counter() - plan['started'],
+            "max_tokens": plan['max_tokens'],
+            "estimated_prompt_tokens": plan['prompt_tokens'],
+            "prompt_tokens": getattr(usage, 'prompt_tokens', None),
+            "completion_tokens": getattr(usage, 'completion_tokens', None)
+        }
+        with self._lock:
+            self.requests += 1
+            if finish_reason == 'length':
+                self.truncated += 1
+            self.recent.append(sample)
+
+    def stats(self):
+        with self._lock:
+            recent = list(self.recent)
+            requests, truncated, retries = self.requests, self.truncated, self.retries
+
+        def average(name):
+            values = [sample[name] for sample in recent if sample[name] is not None]
+            return round(sum(values) / len(values), 1) if values else None
+
+        latencies = [sample['seconds'] for sample in recent]
+        errors = [
+            abs(sample['estimated_prompt_tokens'] - sample['prompt_tokens']) / sample['prompt_tokens']
+            for sample in recent if sample['prompt_tokens']
+        ]
+        return {
+            "counter": "tiktoken" if self.counter.exact else "estimate",
+            "ceiling": self.ceiling,
+            "envelope_tokens": self.envelope_tokens,
+            "requests": requests,
+            "truncated": truncated,
+            "retries": retries,
+            "window": len(recent),
+            "avg_max_tokens": average('max_tokens'),
+            "avg_prompt_tokens": average('prompt_tokens'),
+            "avg_completion_tokens": average('completion_tokens'),
+            "avg_seconds": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p95_seconds": round(percentile(latencies, 95), 3) if latencies else None,
+            "prompt_estimate_error": round(sum(errors) / len(errors), 3) if errors else None
+        }
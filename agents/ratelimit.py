@@ -0,0 +1,110 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger('kidsbook')
+
+
+class TokenBucket:
+    """
+    Async token bucket that keeps calls to one deployment within its requests-per-minute quota.
+    Up to `burst` calls go out at once; after that callers wait for tokens to refill, in FIFO order.
+    With a coordination backend the bucket's state lives there and is shared by every worker
+    process; callers in this process still queue in FIFO order for it.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int = None, backend=None):
+        if requests_per_minute <= 0:
+            raise ValueError(f"Rate limit for '{name}' must be positive")
+        self.name = name
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(requests_per_minute)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.backend = backend
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        started = time.perf_counter()
+        async with self._lock:
+            if self.backend is not None:
+                await self._acquire_shared(tokens)
+            else:
+                self._refill()
+                if self._tokens < tokens:
+                    self.throttled += 1
+                while self._tokens < tokens:
+                    await asyncio.sleep((tokens - self._tokens) / self.rate)
+                    self._refill()
+                self._tokens -= tokens
+        waited = time.perf_counter() - started
+        self.acquired += 1
+        self.total_wait_seconds += waited
+        if waited > 1.0:
+            logger.debug(f"{self.name}: waited {waited:.2f}s for rate limit")
+
+    async def _acquire_shared(self, tokens: float):
+        wait = await self.backend.take(self.name, tokens, self.rate, self.capacity)
+        if wait > 0:
+            self.throttled += 1
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = await self.backend.take(self.name, tokens, self.rate, self.capacity)
+
+    def stats(self):
+        self._refill()
+        return {
+            "requests_per_minute": self.rate * 60.0,
+            "burst": self.capacity,
+            # The shared state is not read just for stats
+            "available": round(self._tokens, 2) if self.backend is None else None,
+            "shared": self.backend is not None,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "total_wait_seconds": round(self.total_wait_seconds, 3)
+        }
+
+
+class DeploymentRateLimiter:
+    """
+    Token buckets for one agent, one per Azure deployment, since each deployment (the
+    fallbacks included) has its own requests-per-minute quota.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int = None, backend=None):
+        if requests_per_minute <= 0:
+            raise ValueError(f"Rate limit for '{name}' must be positive")
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.backend = backend
+        self.buckets = {}
+
+    @classmethod
+    def from_config(cls, name: str, config: dict, backend=None):
+        """Reads an agent's `rate_limit` section; returns None when the agent has none."""
+        rate_limit = config.get('rate_limit')
+        if not rate_limit:
+            return None
+        return cls(name, float(rate_limit.get('requests_per_minute', 20)), burst=rate_limit.get('burst'), backend=backend)
+
+    def bucket(self, deployment: str) -> TokenBucket:
+        if deployment not in self.buckets:
+            self.buckets[deployment] = TokenBucket(
+                f"{self.name}:{deployment}", self.requests_per_minute, burst=self.burst, backend=self.backend
+            )
+        return self.buckets[deployment]
+
+    async def acquire(self, deployment: str):
+        await self.bucket(deployment).acquire()
+
+    def stats(self):
+        return {deployment: bucket.stats() for deployment, bucket in self.buckets.items()}
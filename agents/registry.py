@@ -0,0 +1,164 @@
+import os
+import logging
+import importlib
+import httpx
+from .base_agent import load_config
+from services.assets import ImageStore
+
+logger = logging.getLogger('kidsbook')
+
+AGENT_MODULES = ('editor_agent', 'illustrator_agent', 'story_processor')
+
+DEFAULT_POOL_CONFIG = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "connect_timeout": 10.0,
+    "read_timeout": 120.0
+}
+
+
+class AgentRegistry:
+    """
+    Application-scoped container for the agents and the HTTP connection pools they share.
+    Built once at startup; agents hold a reference to a pooled keep-alive client per
+    Azure endpoint so requests reuse connections instead of paying a new TLS handshake.
+    An optional coordination backend shares the agents' rate limits between worker processes.
+    """
+
+    def __init__(self, config_path='azure_config.json', cache=None, renderer=None, coordination=None):
+        self.config_path = config_path
+        self.cache = cache
+        self.renderer = renderer
+        self.coordination = coordination
+        self.pool_config = self._load_pool_config()
+        self._async_clients = {}
+        self.editor = None
+        self.illustrator = None
+        self.story_processor = None
+        self.image_store = None
+
+    def _load_pool_config(self):
+        """Pool limits come from azure_config.json's http_pool section, overridable by env vars."""
+        pool_config = dict(DEFAULT_POOL_CONFIG)
+        pool_config.update(load_config(self.config_path).get('http_pool', {}))
+        for key, default in DEFAULT_POOL_CONFIG.items():
+            env_value = os.environ.get(f"HTTP_POOL_{key.upper()}")
+            if env_value:
+                pool_config[key] = type(default)(env_value)
+        return pool_config
+
+    def _client_kwargs(self):
+        return {
+            "limits": httpx.Limits(
+                max_connections=int(self.pool_config["max_connections"]),
+                max_keepalive_connections=int(self.pool_config["max_keepalive_connections"]),
+                keepalive_expiry=float(self.pool_config["keepalive_expiry"])
+            ),
+            "timeout": httpx.Timeout(
+                float(self.pool_config["read_timeout"]),
+                connect=float(self.pool_config["connect_timeout"])
+            )
+        }
+
+    def async_client(self, endpoint: str) -> httpx.AsyncClient:
+        """Returns the shared async client for an endpoint, creating it on first use."""
+        key = endpoint.rstrip('/')
+        if key not in self._async_clients:
+            self._async_clients[key] = httpx.AsyncClient(**self._client_kwargs())
+            logger.info(f"Created pooled async HTTP client for {key}")
+        return self._async_clients[key]
+
+    @staticmethod
+    def preload():
+        """Imports the agent modules (and the OpenAI SDK); safe to run in a worker thread."""
+        for name in AGENT_MODULES:
+            importlib.import_module(f'{__package__}.{name}')
+
+    def start(self):
+        """Builds the agents once. Safe to call repeatedly."""
+        if self.editor is not None:
+            return self
+        # Imported here so the OpenAI SDK loads while the app warms up, not when main is imported
+        from .editor_agent import EditorAgent
+        from .illustrator_agent import IllustratorAgent
+        from .story_processor import StoryProcessor
+        try:
+            endpoint = os.environ.get('AZURE_ENDPOINT', '')
+            assets_config = load_config(self.config_path).get('assets', {})
+            if assets_config.get('enabled', True):
+                # Generated images live on a different host, so they get their own pool
+                self.image_store = ImageStore.from_config(self.async_client('assets'), assets_config)
+            self.editor = EditorAgent(
+                self.config_path, http_client=self.async_client(endpoint), cache=self.cache,
+                coordination=self.coordination
+            )
+            self.illustrator = IllustratorAgent(
+                self.config_path, http_client=self.async_client(endpoint), cache=self.cache,
+                image_store=self.image_store, coordination=self.coordination
+            )
+            self.story_processor = StoryProcessor(self.config_path, renderer=self.renderer)
+            logger.info("Agent registry started with pool limits %s", self.pool_config)
+            return self
+        except Exception as e:
+            logger.exception(f"Error starting agent registry: {str(e)}")
+            raise
+
+    def stats(self):
+        """Concurrency, queue-depth and cache counters for the agents."""
+        if self.editor is None:
+            return {}
+        stats = {
+            "editor": self.editor.limiter.stats(),
+            "illustrator": self.illustrator.rate_limiter.stats()
+        }
+        stats["editor"]["budget"] = self.editor.budget.stats()
+        if self.editor.rate_limiter is not None:
+            stats["editor"]["rate_limit"] = self.editor.rate_limiter.stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        stats["renderer"] = self.story_processor.renderer.stats()
+        stats["resilience"] = {
+            "editor": self.editor.resilience.stats(),
+            "illustrator": self.illustrator.resilience.stats()
+        }
+        return stats
+
+    async def warm(self):
+        """
+        Opens a connection (DNS, TCP and TLS) to the Azure endpoint before the first real call.
+        Any HTTP response counts; returns "ok" or the connection error.
+        """
+        endpoint = os.environ.get('AZURE_ENDPOINT', '')
+        if not endpoint:
+            return "skipped: AZURE_ENDPOINT not set"
+        try:
+            await self.async_client(endpoint).head(endpoint)
+            return "ok"
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not warm the connection to {endpoint}: {str(e)}")
+            return f"error: {str(e)}"
+
+    async def aclose(self):
+        """Closes every pooled connection. Called once on application shutdown."""
+        if self.image_store is not None:
+            await self.image_store.aclose()
+            self.image_store = None
+        for client in self._async_clients.values():
+            await client.aclose()
+        self._async_clients.clear()
+        self.editor = None
+        self.illustrator = None
+        self.story_processor = None
+        logger.info("Agent registry closed")
+
+
+_default_registry = None
+
+
+def get_default_registry(config_path='azure_config.json') -> AgentRegistry:
+    """Process-wide registry for callers that are not managed by the FastAPI lifespan."""
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = AgentRegistry(config_path).start()
+    return _default_registry
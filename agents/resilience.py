@@ -0,0 +1,285 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+import openai
+from services.monitoring import percentile
+
+logger = logging.getLogger('kidsbook')
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling Azure while every deployment's circuit is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+def retry_after_seconds(error: Exception):
+    """Delay requested by the server through `retry-after-ms` or `Retry-After`, if any."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Per-deployment breaker: after `failure_threshold` consecutive server errors or timeouts it
+    opens and rejects calls for `reset_timeout` seconds, then lets a single probe through.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejections = 0
+        # When the current half-open probe started; a probe that never reports back
+        # (cancelled, non-retryable error) stops blocking after another reset_timeout
+        self._probe_started = None
+
+    def allow(self) -> bool:
+        if self.state == 'closed':
+            return True
+        now = time.monotonic()
+        if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            self._probe_started = None
+        if self.state == 'half_open' and (
+            self._probe_started is None or now - self._probe_started >= self.reset_timeout
+        ):
+            self._probe_started = now
+            return True
+        self.rejections += 1
+        return False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.opens += 1
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} failure(s)")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "opens": self.opens, "rejections": self.rejections}
+
+
+class Resilience:
+    """
+    Retries, hedging, circuit breaking and deployment fallback for one agent's Azure calls.
+
+    `call(operation)` runs `operation(deployment)` against the primary deployment, retrying
+    retryable failures with full-jitter backoff (or the server's Retry-After). Once a call runs
+    past the observed p95 latency it can fire one hedged duplicate and keep whichever answers
+    first. Latency is tracked per deployment and per `kind` of call, so calls that only open a
+    stream are not hedged against whole completions or the other way round. Each deployment
+    has its own breaker. When the primary is exhausted or its circuit is open, the fallback
+    deployments from the agent's config are tried in order.
+    """
+
+    def __init__(self, name: str, deployments: list, retry: dict = None, circuit_breaker: dict = None,
+                 hedge: dict = None):
+        self.name = name
+        self.deployments = list(deployments)
+        retry = retry or {}
+        self.attempts = int(retry.get('attempts', 3))
+        self.base_delay = float(retry.get('base_delay', 0.5))
+        self.max_delay = float(retry.get('max_delay', 20.0))
+        self.max_retry_after = float(retry.get('max_retry_after', 60.0))
+        circuit_breaker = circuit_breaker or {}
+        self.breakers = {
+            deployment: CircuitBreaker(
+                f"{name}:{deployment}",
+                int(circuit_breaker.get('failure_threshold', 5)),
+                float(circuit_breaker.get('reset_timeout', 30.0))
+            )
+            for deployment in self.deployments
+        }
+        hedge = hedge or {}
+        self.hedge_enabled = bool(hedge.get('enabled', False))
+        self.hedge_percentile = float(hedge.get('percentile', 95))
+        self.hedge_min_samples = int(hedge.get('min_samples', 20))
+        self.hedge_min_delay = float(hedge.get('min_delay', 1.0))
+        # (deployment, kind) -> recent latencies
+        self.latencies = {}
+        self.counters = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "failures": 0}
+
+    @classmethod
+    def from_config(cls, name: str, agent_config: dict):
+        """Reads the agent's `resilience` section; fallbacks are listed in `fallback_deployments`."""
+        config = agent_config.get('resilience', {})
+        deployments = [agent_config['deployment_name']] + list(config.get('fallback_deployments', []))
+        return cls(
+            name,
+            deployments,
+            retry=config.get('retry'),
+            circuit_breaker=config.get('circuit_breaker'),
+            hedge=config.get('hedge')
+        )
+
+    async def call(self, operation, admit=None, kind: str = 'call'):
+        """
+        Returns the result of `await operation(deployment)`. `admit(deployment)`, if given, is
+        awaited before every request (retries and hedges included), e.g. to take a rate-limit
+        token for that deployment; time spent in it is not counted as deployment latency.
+        `kind` names the latency window the hedge threshold is taken from; calls that take
+        differently long (opening a stream vs. a whole completion) should use different kinds.
+        """
+        self.counters["calls"] += 1
+        last_error = None
+        for index, deployment in enumerate(self.deployments):
+            if index:
+                self.counters["fallbacks"] += 1
+                logger.warning(f"{self.name}: falling back to deployment '{deployment}'")
+            try:
+                return await self._call_deployment(deployment, operation, admit, kind)
+            except CircuitOpenError as e:
+                last_error = last_error or e
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+        self.counters["failures"] += 1
+        raise last_error
+
+    async def _call_deployment(self, deployment: str, operation, admit, kind: str):
+        breaker = self.breakers[deployment]
+        for attempt in range(1, self.attempts + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit for {self.name} deployment '{deployment}' is open")
+            try:
+                result = await self._attempt(deployment, operation, admit, kind)
+                breaker.record_success()
+                return result
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                # A 429 means the deployment is healthy but over quota; Retry-After paces
+                # those, so only errors and timeouts count towards opening the circuit
+                if getattr(e, 'status_code', None) != 429:
+                    breaker.record_failure()
+                if attempt == self.attempts:
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                delay = min(delay, self.max_retry_after)
+                self.counters["retries"] += 1
+                logger.warning(
+                    f"{self.name} call to '{deployment}' failed (attempt {attempt}/{self.attempts}), "
+                    f"retrying in {delay:.1f}s: {str(e)}"
+                )
+                await asyncio.sleep(delay)
+
+    def _samples(self, deployment: str, kind: str):
+        samples = self.latencies.get((deployment, kind))
+        if samples is None:
+            samples = self.latencies[(deployment, kind)] = deque(maxlen=500)
+        return samples
+
+    def hedge_delay(self, deployment: str, kind: str = 'call'):
+        """Seconds to wait before hedging, or None while hedging is off or latency is unknown."""
+        samples = self._samples(deployment, kind)
+        if not self.hedge_enabled or len(samples) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, percentile(samples, self.hedge_percentile))
+
+    async def _attempt(self, deployment: str, operation, admit, kind: str):
+        if admit is not None:
+            await admit(deployment)
+        started = time.perf_counter()
+        delay = self.hedge_delay(deployment, kind)
+        if delay is None:
+            result = await operation(deployment)
+        else:
+            result = await self._hedged(deployment, operation, admit, delay)
+        self._samples(deployment, kind).append(time.perf_counter() - started)
+        return result
+
+    async def _hedged(self, deployment: str, operation, admit, delay: float):
+        primary = asyncio.create_task(operation(deployment))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.counters["hedges"] += 1
+        hedge = asyncio.create_task(_admitted(admit, operation, deployment))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        for other in done - {task}:
+                            if other.exception() is None:
+                                await _discard(other.result())
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            **self.counters,
+            "deployments": {
+                deployment: {
+                    **self.breakers[deployment].stats(),
+                    "latency_p95_seconds": {
+                        kind: round(percentile(samples, 95) or 0.0, 3)
+                        for (name, kind), samples in sorted(self.latencies.items()) if name == deployment
+                    }
+                }
+                for deployment in self.deployments
+            }
+        }
+
+
+async def _admitted(admit, operation, deployment: str):
+    if admit is not None:
+        await admit(deployment)
+    return await operation(deployment)
+
+
+async def _discard(result):
+    """Closes a losing hedge's result if it holds a connection (e.g. an open stream)."""
+    close = getattr(result, 'close', None)
+    if close is not None and asyncio.iscoroutinefunction(close):
+        await close()
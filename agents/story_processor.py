@@ -1,15 +1,18 @@
-from azure.ai.textanalytics import TextAnalyticsClient
-from azure.core.credentials import AzureKeyCredential
 import json
 import re
 import logging
-from datetime import datetime
+from .moderation import get_content_filter
+from services.renderer import BookRenderer
+from services.metrics import span
 
 logger = logging.getLogger('kidsbook')
 
 class StoryProcessor:
-    def __init__(self, azure_config_path="azure_config.json"):
+    def __init__(self, azure_config_path="azure_config.json", renderer=None):
         self.azure_config_path = azure_config_path
+        # Books are rendered from webapp/templates/book.html; the app passes in a renderer
+        # built on its own Jinja2 environment
+        self.renderer = renderer if renderer is not None else BookRenderer()
         # Add any initialization that depends on the config here
 
     def load_azure_config(self, path):
@@ -17,14 +20,16 @@ class StoryProcessor:
             return json.load(config_file)
 
     def create_text_analytics_client(self):
+        # The Text Analytics SDK is only imported when a client is actually needed
+        from azure.ai.textanalytics import TextAnalyticsClient
+        from azure.core.credentials import AzureKeyCredential
         endpoint = self.azure_config['endpoint']
         key = self.azure_config['key']
         return TextAnalyticsClient(endpoint=endpoint, credential=AzureKeyCredential(key))
 
     def filter_content(self, story):
-        # Implement content filtering logic here
-        # This should include checks for appropriateness and adherence to responsible AI principles
-        return story  # Placeholder for filtered story
+        # Drops sentences with banned keywords from the `content_filter` config section
+        return get_content_filter(self.azure_config_path).filter(story)
 
     def process_story(self, story):
         filtered_story = self.filter_content(story)
@@ -36,75 +41,62 @@ class StoryProcessor:
         # Call Azure AI services for further analysis if needed
         return processed_story
 
-    def process(self, final_story: str, cover_image_url: str, illustrator_prompt: str):
+    def split_pages(self, final_story: str, max_pages: int = 8, chars_per_page: int = 500):
         """
-        Creates an HTML document combining the cover image and story.
+        Splits the story into pages of roughly equal length for illustration.
+        Paragraphs are kept whole where possible; a story with too few paragraphs
+        is split on sentence boundaries instead.
+        """
+        paragraphs = [p.strip() for p in final_story.split('\n') if p.strip()]
+        total_chars = sum(len(p) for p in paragraphs)
+        if not paragraphs:
+            return []
+        page_count = max(1, min(max_pages, -(-total_chars // chars_per_page)))
+        units, joiner = paragraphs, '\n'
+        if len(units) < page_count:
+            units = [s for p in paragraphs for s in re.split(r'(?<=[.!?])\s+', p) if s]
+            joiner = ' '
+        page_count = min(page_count, len(units))
+
+        pages, current, consumed = [], [], 0
+        for index, unit in enumerate(units):
+            units_left = len(units) - index
+            pages_left = page_count - len(pages) - 1
+            boundary = total_chars * (len(pages) + 1) / page_count
+            # Close the page once this unit would mostly fall past its share of the text,
+            # or when every remaining unit is needed to give each remaining page one
+            if current and pages_left > 0 and (consumed + len(unit) / 2 > boundary or units_left == pages_left):
+                pages.append(joiner.join(current))
+                current = []
+            current.append(unit)
+            consumed += len(unit)
+        if current:
+            pages.append(joiner.join(current))
+        return pages
+
+    def process(self, final_story: str, cover_image_url: str, illustrator_prompt: str, illustrations: list = None,
+                story_id=None, created_at=None, cover_variants: dict = None, title: str = None):
+        """
+        Creates an HTML document combining the title, cover image and story.
+        When page illustrations are given, each page is rendered with its picture;
+        pages whose illustration failed are rendered as text only.
         """
         try:
-            # Split story into paragraphs
-            paragraphs = final_story.split('\n')
-            
-            # Create HTML with modern styling
-            html_content = f"""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Your Kids Book</title>
-                <style>
-                    body {{
-                        font-family: 'Arial', sans-serif;
-                        line-height: 1.6;
-                        max-width: 800px;
-                        margin: 0 auto;
-                        padding: 20px;
-                        background-color: #f9f9f9;
-                    }}
-                    .cover {{
-                        text-align: center;
-                        margin-bottom: 2em;
-                    }}
-                    .cover img {{
-                        max-width: 100%;
-                        height: auto;
-                        border-radius: 10px;
-                        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-                    }}
-                    .story {{
-                        background: white;
-                        padding: 2em;
-                        border-radius: 10px;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    }}
-                    .story p {{
-                        margin-bottom: 1em;
-                    }}
-                    .meta {{
-                        text-align: center;
-                        color: #666;
-                        font-size: 0.9em;
-                        margin-top: 2em;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="cover">
-                    <img src="{cover_image_url}" alt="Story Cover Image">
-                </div>
-                <div class="story">
-                    {"".join(f'<p>{paragraph}</p>' for paragraph in paragraphs if paragraph.strip())}
-                </div>
-                <div class="meta">
-                    <p>Generated on {datetime.now().strftime('%B %d, %Y')}</p>
-                </div>
-            </body>
-            </html>
-            """
-            
+            with span('render'):
+                html_content = self.renderer.render(
+                    final_story, cover_image_url, illustrations, story_id=story_id, created_at=created_at,
+                    cover_variants=cover_variants, title=title
+                )
             logger.info("StoryProcessor: HTML content generated successfully")
             return html_content
-            
         except Exception as e:
             logger.error(f"Error generating HTML content: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def generate(self, final_story: str, cover_image_url: str, illustrations: list = None,
+                 story_id=None, created_at=None, cover_variants: dict = None, title: str = None):
+        """Streaming counterpart of `process`: yields the document in chunks."""
+        return self.renderer.generate(
+            final_story, cover_image_url, illustrations, story_id=story_id, created_at=created_at,
+            cover_variants=cover_variants, title=title
+        )
@@ -0,0 +1,145 @@
+"""
+Bytes a browser downloads to show one finished book.
+
+Creates a book through POST /create_kids_book/ and counts response body bytes on the wire
+for three ways of viewing it:
+
+- full: the job result with the inline HTML and story text, plus the page's and the book's
+  stylesheets and script, all uncompressed (how a book was delivered before lean results)
+- lean: the lean job result, the stored book from /stories/{id} and the same assets,
+  compressed
+- repeat: opening the book again, revalidated with its ETag; fingerprinted assets come
+  from the browser cache
+
+Images are left out; they are the same in every case.
+
+    python -m benchmarks.book_bytes --spawn
+
+--spawn runs the static build (services.static_build) and starts the mock Azure server and
+the app like benchmarks.load_test does.
+"""
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import httpx
+from benchmarks.load_test import spawn
+from services.static_build import build
+
+STORY = "A small turtle named Pip wanted to see the sea. " * 40
+COMPRESSED = {"Accept-Encoding": "br, gzip"}
+IDENTITY = {"Accept-Encoding": "identity"}
+LINK_PATTERN = re.compile(r'(?:href|src)="(/static/[^"]+\.(?:css|js))"')
+
+
+def _wait_until_up(client: httpx.Client, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if client.get('/ready').status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"The app did not become ready within {timeout:.0f}s")
+
+
+def _fetch(client: httpx.Client, path: str, headers: dict) -> httpx.Response:
+    response = client.get(path, headers=headers)
+    if response.status_code not in (200, 304):
+        raise RuntimeError(f"GET {path} returned {response.status_code}")
+    return response
+
+
+def _wire_bytes(response: httpx.Response) -> int:
+    return response.num_bytes_downloaded
+
+
+def measure(client: httpx.Client, timeout: float) -> dict:
+    submitted = client.post('/create_kids_book/', data={"story": STORY, "lean": "true"}).json()
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(submitted['status_url']).json()
+        if job['status'] in ('succeeded', 'failed'):
+            break
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Job {submitted['job_id']} did not finish within {timeout:.0f}s")
+        time.sleep(0.25)
+    if job['status'] != 'succeeded':
+        raise RuntimeError(f"Job {submitted['job_id']} failed: {job['error']}")
+    job_path = f"/jobs/{submitted['job_id']}"
+    story_url = job['result']['story_url']
+
+    book = _fetch(client, story_url, IDENTITY)
+    assets = LINK_PATTERN.findall(client.get('/').text) + LINK_PATTERN.findall(book.text)
+
+    full = {"job": _wire_bytes(_fetch(client, job_path, IDENTITY))}
+    lean = {
+        "job": _wire_bytes(_fetch(client, f"{job_path}?lean=true", COMPRESSED)),
+        "book": _wire_bytes(_fetch(client, story_url, COMPRESSED))
+    }
+    for asset in assets:
+        full[asset] = _wire_bytes(_fetch(client, asset, IDENTITY))
+        lean[asset] = _wire_bytes(_fetch(client, asset, COMPRESSED))
+    revalidated = _fetch(client, story_url, {**COMPRESSED, "If-None-Match": book.headers['etag']})
+    repeat = {
+        "job": lean["job"],
+        "book": _wire_bytes(revalidated),
+        "book_status": revalidated.status_code
+    }
+    for asset in assets:
+        # Fingerprinted files are immutable; anything else the browser would revalidate
+        repeat[asset] = 0 if '/static/dist/' in asset else lean[asset]
+
+    totals = {
+        name: sum(value for key, value in view.items() if key != 'book_status')
+        for name, view in (("full", full), ("lean", lean), ("repeat", repeat))
+    }
+    return {
+        "story_id": job['result']['story_id'],
+        "fingerprinted_assets": all('/static/dist/' in asset for asset in assets),
+        "bytes": {"full": full, "lean": lean, "repeat": repeat},
+        "total_bytes": totals,
+        "lean_vs_full": round(totals["lean"] / totals["full"], 4),
+        "repeat_vs_full": round(totals["repeat"] / totals["full"], 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Base URL of a running app")
+    parser.add_argument('--spawn', action='store_true', help="Start the mock Azure server and the app locally")
+    parser.add_argument('--job-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if not args.url and not args.spawn:
+        parser.error("pass --url or --spawn")
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix='kidsbook-bytes-')
+    try:
+        base_url = args.url
+        if args.spawn:
+            build()
+            base_url, processes = spawn([], workdir)
+        with httpx.Client(base_url=base_url, timeout=30.0) as client:
+            _wait_until_up(client)
+            report = measure(client, args.job_timeout)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
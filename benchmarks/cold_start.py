@@ -0,0 +1,115 @@
+"""
+Measures cold starts of the app: how long `import main` takes, and how long a fresh uvicorn
+process takes to answer HTTP at all and to report ready.
+
+Each run starts a new process against the mock Azure server with a throwaway SQLite
+database; pass --reuse-db to measure restarts against an already migrated database:
+
+    python -m benchmarks.cold_start --runs 5 --output cold_start.json
+
+--path is the endpoint polled for readiness (use /stats for trees without /ready).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+import httpx
+from benchmarks.load_test import _free_port, summarize
+
+
+def time_import(runs: int):
+    """Wall time of `python -c 'import main'` in fresh interpreters."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import main'], check=True, capture_output=True)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def time_boot(env: dict, path: str, timeout: float = 120.0):
+    """Starts uvicorn and returns (seconds until any HTTP response, seconds until `path` returns 200)."""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+    )
+    listening = ready = None
+    try:
+        with httpx.Client(timeout=5.0) as client:
+            while time.perf_counter() - started < timeout:
+                try:
+                    response = client.get(f"http://127.0.0.1:{port}{path}")
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+                    continue
+                if listening is None:
+                    listening = time.perf_counter() - started
+                if response.status_code == 200:
+                    ready = time.perf_counter() - started
+                    break
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return listening, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/ready')
+    parser.add_argument('--reuse-db', action='store_true', help="Keep one database across runs")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kidsbook-cold-')
+    mock_port = _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.mock_azure', '--port', str(mock_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        imports = time_import(args.runs)
+        listening, ready = [], []
+        for run in range(args.runs):
+            database = os.path.join(workdir, 'cold.db' if args.reuse_db else f'cold-{run}.db')
+            env = dict(
+                os.environ,
+                AZURE_ENDPOINT=f"http://127.0.0.1:{mock_port}/",
+                AZURE_API_KEY='benchmark',
+                AZURE_SQL_CONNECTION_STRING=f"sqlite:///{database}",
+                IMAGE_STORE_DIR=os.path.join(workdir, 'generated')
+            )
+            first, done = time_boot(env, args.path)
+            if first is not None:
+                listening.append(first)
+            if done is not None:
+                ready.append(done)
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "config": vars(args),
+        "import_main_seconds": summarize(imports),
+        "first_response_seconds": summarize(listening),
+        "ready_seconds": summarize(ready),
+        "median_ready_seconds": round(statistics.median(ready), 4) if ready else None
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Export throughput against the number of pool processes.
+
+Writes synthetic picture books (a cover and illustrated pages with photographic-noise
+images, the worst case for JPEG encoding) to a temporary directory. Each is then rendered
+with services.export.render_artifact in a process pool of each requested size. The
+report gives books per second and the speedup over one process. With enough books, the
+speedup should track the number of physical cores.
+
+    python -m benchmarks.export_bench --books 24 --format pdf --workers 1,2,4
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from services.export import FORMATS, render_artifact
+
+PARAGRAPH = "Pip the little turtle swam past the coral reef and waved to every fish she met. " * 4
+
+
+def make_book(workdir: str, pages: int, image_size: int) -> dict:
+    from PIL import Image
+    images = []
+    for index in range(pages + 1):
+        path = os.path.join(workdir, f"image-{index}.png")
+        Image.effect_noise((image_size, image_size), 40 + index).convert('RGB').save(path)
+        images.append(path)
+    return {
+        "id": 1,
+        "title": "Pip and the Coral Reef",
+        "cover": images[0],
+        "pages": [
+            {"page": index, "image": images[index], "paragraphs": [PARAGRAPH, PARAGRAPH]}
+            for index in range(1, pages + 1)
+        ],
+        "paginated": True,
+        "generated_on": "January 01, 2025",
+        "modified": "2025-01-01T00:00:00Z"
+    }
+
+
+def measure(book: dict, fmt: str, books: int, workers: int, output: str) -> dict:
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # Start every process and import the writers before timing
+        list(pool.map(render_artifact, [fmt] * workers, [book] * workers,
+                      [os.path.join(output, f"warm-{i}") for i in range(workers)], [{}] * workers))
+        started = time.perf_counter()
+        sizes = list(pool.map(render_artifact, [fmt] * books, [book] * books,
+                              [os.path.join(output, f"book-{i}.{FORMATS[fmt][1]}") for i in range(books)],
+                              [{}] * books))
+        elapsed = time.perf_counter() - started
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "books_per_second": round(books / elapsed, 2),
+        "bytes_per_book": sizes[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=24)
+    parser.add_argument('--pages', type=int, default=6, help="Illustrated pages per book")
+    parser.add_argument('--image-size', type=int, default=1024)
+    parser.add_argument('--format', choices=sorted(FORMATS), default='pdf')
+    parser.add_argument('--workers', help="Comma-separated pool sizes (default: 1, 2, 4, ... up to the core count)")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        sizes = [int(size) for size in args.workers.split(',')]
+    else:
+        sizes = [1]
+        while sizes[-1] * 2 <= cores:
+            sizes.append(sizes[-1] * 2)
+
+    workdir = tempfile.mkdtemp(prefix='kidsbook-export-')
+    try:
+        book = make_book(workdir, args.pages, args.image_size)
+        runs = [measure(book, args.format, args.books, workers, workdir) for workers in sizes]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = runs[0]["books_per_second"]
+    for run in runs:
+        run["speedup"] = round(run["books_per_second"] / baseline, 2)
+    print(json.dumps({"cores": cores, "format": args.format, "books": args.books, "runs": runs}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Open-loop load test for POST /create_kids_book/.
+
+Submits stories at a fixed rate, follows each job to completion and prints a JSON report
+with submit and end-to-end latency percentiles, throughput, event-loop lag and database
+pool waits (taken from the app's GET /stats before and after the run).
+
+Against a running app:
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --rps 5 --duration 60
+
+Fully offline, starting the mock Azure server and the app on free ports with a throwaway
+SQLite database and image directory:
+
+    python -m benchmarks.load_test --spawn --rps 5 --duration 60 --output results.json
+
+Arguments after `--mock-args` are passed through to benchmarks.mock_azure.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import httpx
+from services.monitoring import percentile
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4)
+    }
+
+
+async def _wait_until_up(client: httpx.AsyncClient, url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+class LoadTest:
+    def __init__(self, base_url: str, rps: float, duration: float, job_timeout: float,
+                 poll_interval: float, unique_stories: bool):
+        self.base_url = base_url.rstrip('/')
+        self.rps = rps
+        self.duration = duration
+        self.job_timeout = job_timeout
+        self.poll_interval = poll_interval
+        self.unique_stories = unique_stories
+        self.submit_latencies = []
+        self.job_latencies = []
+        self.outcomes = {"succeeded": 0, "failed": 0, "timed_out": 0, "submit_errors": 0}
+
+    def story(self, n: int) -> str:
+        story = ("A curious little fox finds a shiny key under the old oak tree and sets off "
+                 "to discover which door it opens, making new friends along the way.")
+        # Distinct text per request keeps the result cache from answering every call
+        return f"{story} (Run {n}.)" if self.unique_stories else story
+
+    async def one(self, client: httpx.AsyncClient, n: int):
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{self.base_url}/create_kids_book/", data={"story": self.story(n)})
+            response.raise_for_status()
+            job = response.json()
+        except Exception:
+            self.outcomes["submit_errors"] += 1
+            return
+        self.submit_latencies.append(time.perf_counter() - started)
+
+        deadline = started + self.job_timeout
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                status = (await client.get(f"{self.base_url}{job['status_url']}")).json()
+            except Exception:
+                continue
+            if status.get('status') in ('succeeded', 'failed'):
+                self.outcomes[status['status']] += 1
+                if status['status'] == 'succeeded':
+                    self.job_latencies.append(time.perf_counter() - started)
+                return
+        self.outcomes["timed_out"] += 1
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+        async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+            await _wait_until_up(client, f"{self.base_url}/stats")
+            before = (await client.get(f"{self.base_url}/stats")).json()
+
+            tasks = []
+            started = time.perf_counter()
+            total = int(self.rps * self.duration)
+            for n in range(total):
+                # Open loop: arrivals follow the schedule regardless of how fast responses come back
+                delay = started + n / self.rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.one(client, n)))
+            submit_elapsed = time.perf_counter() - started
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+            after = (await client.get(f"{self.base_url}/stats")).json()
+        return self.report(before, after, total, submit_elapsed, elapsed)
+
+    def report(self, before: dict, after: dict, total: int, submit_elapsed: float, elapsed: float):
+        db_before, db_after = before.get('db', {}), after.get('db', {})
+        waits = db_after.get('session_waits', 0) - db_before.get('session_waits', 0)
+        wait_seconds = db_after.get('total_wait_seconds', 0) - db_before.get('total_wait_seconds', 0)
+        return {
+            "config": {
+                "url": self.base_url,
+                "target_rps": self.rps,
+                "duration_seconds": self.duration,
+                "unique_stories": self.unique_stories
+            },
+            "requests": total,
+            "achieved_submit_rps": round(total / submit_elapsed, 3) if submit_elapsed else None,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_jobs_per_second": round(self.outcomes["succeeded"] / elapsed, 3) if elapsed else None,
+            "outcomes": self.outcomes,
+            "submit_latency_seconds": summarize(self.submit_latencies),
+            "job_latency_seconds": summarize(self.job_latencies),
+            "event_loop": after.get('event_loop'),
+            "db_pool": {
+                "session_waits": waits,
+                "mean_wait_seconds": round(wait_seconds / waits, 5) if waits else 0.0,
+                "max_wait_seconds": db_after.get('max_wait_seconds'),
+                "pool_size": db_after.get('pool_size'),
+                "max_overflow": db_after.get('max_overflow')
+            },
+            "app_stats": after
+        }
+
+
+def spawn(mock_args, workdir: str):
+    """Starts the mock Azure server and the app; returns (base_url, processes)."""
+    mock_port, app_port = _free_port(), _free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'ab')
+    mock = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.mock_azure', '--port', str(mock_port), *mock_args],
+        stdout=log, stderr=log
+    )
+    env = dict(
+        os.environ,
+        AZURE_ENDPOINT=f"http://127.0.0.1:{mock_port}/",
+        AZURE_API_KEY='benchmark',
+        AZURE_SQL_CONNECTION_STRING=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        IMAGE_STORE_DIR=os.path.join(workdir, 'generated')
+    )
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(app_port), '--log-level', 'warning'],
+        stdout=log, stderr=log, env=env
+    )
+    return f"http://127.0.0.1:{app_port}", [app, mock]
+
+
+def main():
+    argv = sys.argv[1:]
+    mock_args = []
+    if '--mock-args' in argv:
+        index = argv.index('--mock-args')
+        argv, mock_args = argv[:index], argv[index + 1:]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Base URL of a running app")
+    parser.add_argument('--spawn', action='store_true', help="Start the mock Azure server and the app locally")
+    parser.add_argument('--rps', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--job-timeout', type=float, default=300.0)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--repeat-story', action='store_true', help="Submit the same story every time (cache path)")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if not args.url and not args.spawn:
+        parser.error("pass --url or --spawn")
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix='kidsbook-bench-')
+    try:
+        base_url = args.url
+        if args.spawn:
+            base_url, processes = spawn(mock_args, workdir)
+        test = LoadTest(base_url, args.rps, args.duration, args.job_timeout, args.poll_interval,
+                        unique_stories=not args.repeat_story)
+        report = asyncio.run(test.run())
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.spawn:
+        print(f"Server logs: {os.path.join(workdir, 'server.log')}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Local stand-in for the Azure OpenAI endpoints the agents call, for offline benchmarking.
+
+Serves chat completions (plain and streamed, as text or as the editor's JSON when a
+`response_format` is requested), DALL-E image generations and the image downloads they
+point to, with configurable latency distributions and error rates:
+
+    python -m benchmarks.mock_azure --port 8100 --chat-latency lognormal:800,0.4 \\
+        --image-latency uniform:2000,6000 --error-rate 0.01 --throttle-rate 0.02
+
+Point the app at it with AZURE_ENDPOINT=http://127.0.0.1:8100/ and any AZURE_API_KEY.
+Latency specs are in milliseconds: `fixed:MS`, `uniform:LOW,HIGH`, `normal:MEAN,SD` or
+`lognormal:MEDIAN,SIGMA`.
+"""
+import io
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import colorsys
+from functools import lru_cache
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+WORDS = [
+    'once', 'upon', 'a', 'time', 'the', 'little', 'fox', 'found', 'a', 'shiny', 'key',
+    'under', 'the', 'old', 'oak', 'tree', 'and', 'ran', 'to', 'tell', 'her', 'friends'
+]
+
+
+class Latency:
+    """A latency distribution parsed from a `kind:params` spec, sampled in seconds."""
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(':')
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',') if p]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution '{spec}'")
+
+    def sample(self) -> float:
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(self.params[0], self.params[1])
+        elif self.kind == 'normal':
+            ms = random.gauss(self.params[0], self.params[1])
+        else:
+            median, sigma = self.params
+            ms = median * random.lognormvariate(0.0, sigma)
+        return max(0.0, ms) / 1000.0
+
+
+class MockSettings:
+    def __init__(self, chat_latency='lognormal:600,0.3', token_latency='fixed:15', image_latency='lognormal:3000,0.3',
+                 download_latency='fixed:50', chunks=60, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 image_size=1024, unique_images=True, deployment_error_rates=None):
+        self.chat_latency = Latency(chat_latency)
+        self.token_latency = Latency(token_latency)
+        self.image_latency = Latency(image_latency)
+        self.download_latency = Latency(download_latency)
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.image_size = image_size
+        self.unique_images = unique_images
+        # Per-deployment 500 rates, to simulate one degraded deployment next to a healthy fallback
+        self.deployment_error_rates = deployment_error_rates or {}
+
+
+settings = MockSettings()
+counters = {"chat": 0, "chat_streamed": 0, "images": 0, "downloads": 0, "errors": 0, "throttled": 0}
+
+app = FastAPI(title="Mock Azure OpenAI")
+
+
+def _injected_failure(deployment: str):
+    """Returns an error response for the configured share of calls, otherwise None."""
+    error_rate = settings.deployment_error_rates.get(deployment, settings.error_rate)
+    roll = random.random()
+    if roll < settings.throttle_rate:
+        counters["throttled"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(settings.retry_after)},
+            content={"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}}
+        )
+    if roll < settings.throttle_rate + error_rate:
+        counters["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"code": "InternalServerError", "message": "Injected failure"}})
+    return None
+
+
+def _story_words():
+    return [random.choice(WORDS) for _ in range(settings.chunks)]
+
+
+def _pieces(body: dict, words) -> list:
+    """The completion content as one piece per token."""
+    if not body.get('response_format'):
+        return [word.capitalize() + ' ' if i == 0 else word + ' ' for i, word in enumerate(words)]
+    per_page = max(1, len(words) // 4)
+    content = json.dumps({
+        "title": ' '.join(words[:3]).title(),
+        "target_age": 6,
+        "pages": [' '.join(words[i:i + per_page]).capitalize() + '.' for i in range(0, len(words), per_page)],
+        "illustrator_prompt": "A little fox under an old oak tree, bright and friendly.",
+        "reading_time": 2,
+        "educational_themes": ["friendship"]
+    })
+    size = -(-len(content) // max(1, len(words)))
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+def _usage(body: dict, pieces) -> dict:
+    prompt_tokens = len(str(body.get('messages', ''))) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces), "total_tokens": prompt_tokens + len(pieces)}
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None, usage=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    if usage:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(settings.chat_latency.sample())
+    failure = _injected_failure(deployment)
+    if failure is not None:
+        return failure
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    words = _story_words()
+    pieces = _pieces(body, words)
+    # One piece per completion token; like the real service, stop at max_tokens with "length"
+    finish_reason = "stop"
+    if body.get('max_tokens') and len(pieces) > body['max_tokens']:
+        pieces, finish_reason = pieces[:body['max_tokens']], "length"
+    if body.get('stream'):
+        counters["chat_streamed"] += 1
+
+        async def stream():
+            yield _chunk(completion_id, deployment, {"role": "assistant", "content": ""})
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(settings.token_latency.sample())
+                yield _chunk(completion_id, deployment, {"content": piece})
+            yield _chunk(completion_id, deployment, {}, finish_reason=finish_reason)
+            if (body.get('stream_options') or {}).get('include_usage'):
+                yield _chunk(completion_id, deployment, {}, usage=_usage(body, pieces))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    counters["chat"] += 1
+    await asyncio.sleep(sum(settings.token_latency.sample() for _ in pieces[1:]))
+    content = ''.join(pieces) if body.get('response_format') or finish_reason == "length" \
+        else ' '.join(words).capitalize() + '.'
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": _usage(body, pieces)
+    }
+
+
+@app.post("/openai/deployments/{deployment}/images/generations")
+async def images_generations(deployment: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(settings.image_latency.sample())
+    failure = _injected_failure(deployment)
+    if failure is not None:
+        return failure
+    counters["images"] += 1
+    # The URL carries the colour, so every image has distinct bytes unless --no-unique-images
+    hue = random.randrange(360) if settings.unique_images else 0
+    return {
+        "created": int(time.time()),
+        "data": [{
+            "url": f"{str(request.base_url).rstrip('/')}/images/{hue}.png",
+            "revised_prompt": body.get('prompt', '')[:200]
+        }]
+    }
+
+
+@lru_cache(maxsize=512)
+def _render_png(hue: int, size: int) -> bytes:
+    from PIL import Image
+    r, g, b = colorsys.hsv_to_rgb(hue / 360.0, 0.5, 0.9)
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), (int(r * 255), int(g * 255), int(b * 255))).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@app.get("/images/{hue}.png")
+async def download_image(hue: int):
+    await asyncio.sleep(settings.download_latency.sample())
+    counters["downloads"] += 1
+    content = await asyncio.to_thread(_render_png, hue % 360, settings.image_size)
+    return Response(content=content, media_type="image/png")
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--chat-latency', default='lognormal:600,0.3', help="Time to first token")
+    parser.add_argument('--token-latency', default='fixed:15', help="Delay between streamed chunks")
+    parser.add_argument('--image-latency', default='lognormal:3000,0.3')
+    parser.add_argument('--download-latency', default='fixed:50')
+    parser.add_argument('--chunks', type=int, default=60, help="Words per completion")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls answered with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--image-size', type=int, default=1024)
+    parser.add_argument('--no-unique-images', action='store_true')
+    parser.add_argument('--deployment-error-rate', action='append', default=[], metavar='NAME=RATE',
+                        help="Override --error-rate for one deployment; repeatable")
+    args = parser.parse_args()
+
+    global settings
+    settings = MockSettings(
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        image_latency=args.image_latency,
+        download_latency=args.download_latency,
+        chunks=args.chunks,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        image_size=args.image_size,
+        unique_images=not args.no_unique_images,
+        deployment_error_rates={
+            name: float(rate) for name, rate in (item.split('=', 1) for item in args.deployment_error_rate)
+        }
+    )
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmarks the single-pass content filter against the per-sentence, per-keyword scan it replaced.
+
+    python -m benchmarks.moderation_bench --size-kb 100 --terms 1000
+
+The reference scan takes about a minute at these sizes; pass --skip-naive to time only the new filter.
+"""
+import re
+import json
+import time
+import random
+import argparse
+import statistics
+from agents.moderation import ContentFilter, DEFAULT_BANNED_KEYWORDS
+
+WORDS = [
+    'the', 'little', 'fox', 'ran', 'through', 'a', 'quiet', 'forest', 'and', 'found',
+    'friend', 'who', 'liked', 'to', 'sing', 'under', 'bright', 'moon', 'every', 'night'
+]
+
+
+def naive_filter(story: str, banned_keywords) -> str:
+    """The original EditorAgent.filter_content: one freshly built regex per keyword per sentence."""
+    sentences = re.split(r'(?<=[.!?])\s+', story)
+    filtered_sentences = []
+    for sentence in sentences:
+        if not any(re.search(r'\b' + re.escape(keyword) + r'\b', sentence, flags=re.IGNORECASE)
+                   for keyword in banned_keywords):
+            filtered_sentences.append(sentence)
+    return ' '.join(filtered_sentences)
+
+
+def make_terms(count: int, rng: random.Random):
+    terms = list(DEFAULT_BANNED_KEYWORDS)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    while len(terms) < count:
+        terms.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(4, 10))))
+    return terms[:count]
+
+
+def make_story(size_kb: int, terms, hit_rate: float, rng: random.Random) -> str:
+    sentences = []
+    length = 0
+    while length < size_kb * 1024:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 16))]
+        if rng.random() < hit_rate:
+            words[rng.randrange(len(words))] = rng.choice(terms)
+        sentence = ' '.join(words).capitalize() + rng.choice('.!?')
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences)
+
+
+def measure(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-kb', type=int, default=100)
+    parser.add_argument('--terms', type=int, default=1000)
+    parser.add_argument('--hit-rate', type=float, default=0.02, help="Fraction of sentences containing a banned term")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--naive-repeat', type=int, default=1)
+    parser.add_argument('--skip-naive', action='store_true')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    terms = make_terms(args.terms, rng)
+    story = make_story(args.size_kb, terms, args.hit_rate, rng)
+
+    started = time.perf_counter()
+    content_filter = ContentFilter(terms)
+    compile_seconds = time.perf_counter() - started
+
+    filtered, timings = measure(lambda: content_filter.filter(story), args.repeat)
+    naive_median = None
+    if not args.skip_naive:
+        expected, naive_timings = measure(lambda: naive_filter(story, terms), args.naive_repeat)
+        if filtered != expected:
+            raise SystemExit("Filter output differs from the reference implementation")
+        naive_median = statistics.median(naive_timings)
+
+    report = {
+        "input_bytes": len(story.encode('utf-8')),
+        "terms": len(terms),
+        "sentences": len(content_filter.sentence_spans(story)),
+        "hits": len(content_filter.scan(story)),
+        "compile_seconds": round(compile_seconds, 4),
+        "single_pass_median_seconds": round(statistics.median(timings), 4),
+        "naive_median_seconds": round(naive_median, 4) if naive_median is not None else None,
+        "speedup": round(naive_median / statistics.median(timings), 1) if naive_median is not None else None
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Compares plain SDK retries with the agents' resilience layer under throttling and errors.
+
+Both sides call the mock Azure server in-process through an ASGI transport, with the same
+latency distribution, 429 rate and error rates. The primary deployment is degraded and a
+healthy fallback deployment is available to the resilience layer:
+
+    python -m benchmarks.resilience_bench --calls 400 --concurrency 40 --throttle-rate 0.3
+
+"baseline" is the OpenAI SDK's built-in retries (max_retries=2) against the primary only.
+"resilient" is agents.resilience.Resilience with max_retries=0 on the client, two attempts per
+deployment and hedging after the observed p95.
+"""
+import json
+import time
+import asyncio
+import argparse
+import httpx
+from openai import AsyncAzureOpenAI
+from agents.resilience import Resilience
+from benchmarks import mock_azure
+from benchmarks.load_test import summarize
+
+PRIMARY = 'gpt-4o-mini'
+FALLBACK = 'gpt-4o-mini-fallback'
+
+
+def make_client(max_retries: int) -> AsyncAzureOpenAI:
+    http_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_azure.app),
+        limits=httpx.Limits(max_connections=1000),
+        timeout=60.0
+    )
+    return AsyncAzureOpenAI(
+        api_key='benchmark',
+        api_version='2025-01-01-preview',
+        azure_endpoint='http://mock-azure',
+        http_client=http_client,
+        max_retries=max_retries
+    )
+
+
+async def run_side(name: str, call, calls: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    outcome_latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+            outcome_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    return {
+        "side": name,
+        "success_rate": round(len(latencies) / calls, 4),
+        "failures": failures,
+        "elapsed_seconds": round(elapsed, 3),
+        "latency_seconds": summarize(latencies),
+        # Time until the caller had an answer or an error, over every call
+        "outcome_latency_seconds": summarize(outcome_latencies)
+    }
+
+
+async def main_async(args):
+    mock_azure.settings = mock_azure.MockSettings(
+        chat_latency=args.latency,
+        token_latency='fixed:0',
+        chunks=20,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        deployment_error_rates={PRIMARY: args.primary_error_rate}
+    )
+    messages = [{"role": "user", "content": "Tell me a story about a fox."}]
+
+    baseline_client = make_client(max_retries=2)
+    baseline = await run_side(
+        'baseline',
+        lambda: baseline_client.chat.completions.create(model=PRIMARY, messages=messages),
+        args.calls, args.concurrency
+    )
+
+    resilient_client = make_client(max_retries=0)
+    resilience = Resilience(
+        'benchmark',
+        [PRIMARY, FALLBACK],
+        retry={"attempts": 2, "base_delay": 0.5, "max_delay": 10.0, "max_retry_after": 30},
+        circuit_breaker={"failure_threshold": 5, "reset_timeout": 30},
+        hedge={"enabled": not args.no_hedge, "percentile": 95, "min_samples": 20, "min_delay": 0.2}
+    )
+    resilient = await run_side(
+        'resilient',
+        lambda: resilience.call(
+            lambda deployment: resilient_client.chat.completions.create(model=deployment, messages=messages)
+        ),
+        args.calls, args.concurrency
+    )
+
+    return {
+        "config": vars(args),
+        "baseline": baseline,
+        "resilient": {**resilient, "stats": resilience.stats()},
+        "mock": dict(mock_azure.counters)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=40)
+    parser.add_argument('--latency', default='lognormal:300,0.8', help="Mock latency spec, see benchmarks.mock_azure")
+    parser.add_argument('--throttle-rate', type=float, default=0.3)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--primary-error-rate', type=float, default=0.3)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--no-hedge', action='store_true')
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
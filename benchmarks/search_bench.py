@@ -0,0 +1,154 @@
+"""
+Times story search over a large library.
+
+Fills a temporary SQLite database with synthetic stories (100,000 by default, about 150
+words each). The FTS triggers index each row as it is inserted, the same as for real books.
+Then it runs StorySearch.search for a rare word, a common word, a phrase and a
+two-word query, and reports median and p95 latency. It times the index as the inserts
+left it, then again after `python -m services.search --optimize` has merged it. The LIKE
+scan used on databases without a full-text index is timed on the same queries for comparison.
+
+    python -m benchmarks.search_bench --stories 100000
+
+Pass --skip-like to time only the indexed search; each LIKE query reads every story.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from models.database import Database, Story
+from models.migrations import ensure_schema
+from services.search import StorySearch, parse_query, optimize
+
+NAMES = ['Pip', 'Luna', 'Milo', 'Hazel', 'Otto', 'Juniper', 'Theo', 'Wren', 'Basil', 'Clover']
+ANIMALS = ['turtle', 'fox', 'owl', 'rabbit', 'bear', 'otter', 'hedgehog', 'badger', 'mouse', 'deer']
+PLACES = ['sea', 'forest', 'meadow', 'mountain', 'river', 'garden', 'village', 'cave', 'island', 'orchard']
+WORDS = [
+    'the', 'little', 'ran', 'through', 'a', 'quiet', 'and', 'found', 'friend', 'who', 'liked', 'to',
+    'sing', 'under', 'bright', 'moon', 'every', 'night', 'brave', 'shared', 'kind', 'wanted', 'see',
+    'laughed', 'home', 'morning', 'gentle', 'wind', 'secret', 'path', 'stars', 'together', 'happy'
+]
+# A word that appears in roughly one story in ten thousand
+RARE_WORD = 'zephyrine'
+QUERIES = {
+    "rare": RARE_WORD,
+    "common": "friend",
+    "phrase": '"brave little turtle"',
+    "two_terms": "otter island"
+}
+
+
+def make_story(rng: random.Random) -> str:
+    name, animal, place = rng.choice(NAMES), rng.choice(ANIMALS), rng.choice(PLACES)
+    sentences = [f"{name} the brave little {animal} wanted to see the {place}."]
+    while len(sentences) < 12:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+        words[rng.randrange(len(words))] = rng.choice(ANIMALS + PLACES)
+        if rng.random() < 0.00001:
+            words[rng.randrange(len(words))] = RARE_WORD
+        sentences.append(' '.join(words).capitalize() + '.')
+    return ' '.join(sentences)
+
+
+def populate(connection, count: int, rng: random.Random, chunk: int = 5000) -> float:
+    """Inserts `count` stories; returns the seconds taken, including the triggers' indexing."""
+    started = time.perf_counter()
+    created = datetime(2024, 1, 1)
+    for first in range(0, count, chunk):
+        rows = []
+        for number in range(first, min(first + chunk, count)):
+            story = make_story(rng)
+            rows.append({
+                "input_text": story,
+                "edited_text": story,
+                "cover_image_url": f"https://example.invalid/{number}.png",
+                "created_at": created + timedelta(minutes=number)
+            })
+        connection.execute(Story.__table__.insert(), rows)
+    return time.perf_counter() - started
+
+
+async def time_queries(method, repeat: int) -> dict:
+    report = {}
+    for name, query in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            page = await method(query)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        report[name] = {
+            "query": query,
+            "results": len(page["results"]),
+            "median_ms": round(statistics.median(timings) * 1000, 2),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 2)
+        }
+    return report
+
+
+async def run(args, path: str) -> dict:
+    os.environ['AZURE_SQL_CONNECTION_STRING'] = f"sqlite:///{path}"
+    db = Database()
+    try:
+        await ensure_schema(db, apply=True)
+        async with db.async_engine.begin() as conn:
+            insert_seconds = await conn.run_sync(populate, args.stories, random.Random(args.seed))
+        search = StorySearch(db)
+
+        async def indexed(query):
+            return await search.search(query, limit=args.limit)
+
+        async def like(query):
+            terms = parse_query(query)
+            rows = await search._search_like(terms, args.limit + 1, 0)
+            return {"results": rows[:args.limit]}
+
+        report = {
+            "stories": args.stories,
+            "insert_seconds": round(insert_seconds, 2),
+            "database_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+            "fts_incremental": await time_queries(indexed, args.repeat)
+        }
+        started = time.perf_counter()
+        async with db.async_engine.begin() as conn:
+            await conn.run_sync(optimize)
+        report["optimize_seconds"] = round(time.perf_counter() - started, 2)
+        report["fts"] = await time_queries(indexed, args.repeat)
+        if not args.skip_like:
+            report["like"] = await time_queries(like, args.like_repeat)
+        report["slowest_fts_p95_ms"] = max(q["p95_ms"] for q in report["fts"].values())
+        report["under_50ms"] = report["slowest_fts_p95_ms"] < 50
+        return report
+    finally:
+        await db.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stories', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=20, help="Results per page")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--like-repeat', type=int, default=3)
+    parser.add_argument('--skip-like', action='store_true')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kidsbook-search-')
+    path = os.path.join(workdir, 'search.db')
+    try:
+        report = asyncio.run(run(args, path))
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(workdir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
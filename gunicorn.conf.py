@@ -0,0 +1,29 @@
+"""
+Gunicorn settings for running several uvicorn workers on one host:
+
+    gunicorn main:app -c gunicorn.conf.py
+
+The worker count defaults to the number of CPU cores; set WEB_CONCURRENCY to change it. The
+count is exported to the workers, which then share rate limits and cached results through
+the coordination backend (see services/coordination.py) instead of each spending the whole
+Azure quota.
+"""
+import os
+import uuid
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Applies to the worker heartbeat, not to requests, so long event streams are not cut off
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def on_starting(server):
+    # Read by every worker (forked after this) to size per-process limits and pick the backend
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    # New for each start of the master, so one worker recovers interrupted work after every restart
+    os.environ['KIDSBOOK_BOOT_ID'] = uuid.uuid4().hex
@@ -1,118 +1,538 @@
+from services.startup import PROFILE as startup
+startup.install_import_timer()
+
 import os
 import asyncio
-from fastapi import FastAPI, Request, HTTPException, Form, Depends
-from fastapi.responses import JSONResponse, HTMLResponse
+from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException, Form, Depends, Query, UploadFile, File
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from models.database import Database, Story
-from sqlalchemy.orm import Session
+from models.database import Database
+from models.migrations import ensure_schema
+import json
+import time
 import logging
+import urllib.parse
 
-from agents.editor_agent import EditorAgent
-from agents.illustrator_agent import IllustratorAgent
-from agents.story_processor import StoryProcessor
+from agents.base_agent import load_config
+from agents.registry import AgentRegistry
+from services.pipeline import BookPipeline
+from services.jobs import JobManager
+from services.cache import ResultCache
+from services import coordination
+from services.assets import ImmutableStaticFiles, PrecompressedStaticFiles
+from services.compression import CompressionMiddleware
+from services.static_build import STATIC_ROOT, DIST_DIR, static_url
+from services.paths import data_path
+from services.renderer import BookRenderer
+from services.monitoring import LoopLagMonitor
+from services.metrics import REGISTRY, HTTP_SECONDS, configure_logging, new_request_id, request_id_var
+from services.library import StoryLibrary, InvalidCursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, BOOK_CACHE_CONTROL, etag_matches
+from services.export import BookExporter, FORMATS, UnknownFormat
+from services.search import StorySearch, InvalidQuery, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from services.batch import BatchRunner, BatchInputError, format_for, parse_stories
+from agents.moderation import get_content_filter
 
-# Load environment variables from .env
+# Load environment variables from .env; the only place the app reads it
 load_dotenv()
+startup.mark('imports')
+
+# Check the schema and build the app's services; anything that talks to Azure or fills
+# connection pools happens afterwards in warm_up(), so the port opens as soon as possible
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = load_config('azure_config.json')
+    # The code directory may be read-only; runtime files go to the data directory (services.paths)
+    await asyncio.to_thread(os.makedirs, assets_dir, exist_ok=True)
+    with startup.phase('database'):
+        # Size the pool to the job workers plus headroom for request handlers and the cache
+        workers = int(os.environ.get('JOB_WORKERS', config.get('jobs', {}).get('workers', 4)))
+        db = app.state.db = Database(pool_size=workers + 4)
+        await ensure_schema(db)
+    # Rate limits and cache entries shared by all worker processes (none with a single worker)
+    app.state.coordination = coordination.from_config(config.get('coordination', {}))
+    cache = ResultCache.from_config(db, config.get('cache', {}), shared=app.state.coordination)
+    renderer = BookRenderer(templates.env)
+    app.state.registry = AgentRegistry(cache=cache, renderer=renderer, coordination=app.state.coordination)
+    app.state.pipeline = BookPipeline(app.state.registry, db)
+    app.state.jobs = JobManager.from_config(db, app.state.pipeline, config.get('jobs', {}))
+    app.state.batches = BatchRunner.from_config(db, app.state.pipeline, config.get('batch', {}))
+    app.state.search = StorySearch.from_config(db, config.get('search', {}))
+    app.state.exporter = BookExporter.from_config(
+        db, app.state.registry, config.get('export', {}), assets_config=config.get('assets', {})
+    )
+    app.state.loop_monitor = LoopLagMonitor().start()
+    app.state.warmup = asyncio.create_task(warm_up(app, cache))
+    startup.mark('listening')
+    try:
+        yield
+    finally:
+        app.state.warmup.cancel()
+        await asyncio.gather(app.state.warmup, return_exceptions=True)
+        await app.state.loop_monitor.stop()
+        await app.state.batches.stop()
+        await app.state.jobs.stop()
+        await app.state.exporter.aclose()
+        await app.state.registry.aclose()
+        if app.state.coordination is not None:
+            await app.state.coordination.aclose()
+        await db.dispose()
+
+async def warm_up(app: FastAPI, cache: ResultCache):
+    """Starts the agents, opens database and Azure connections and compiles the content filter; /ready reports the outcome."""
+    try:
+        with startup.phase('agents'):
+            # The OpenAI SDK takes a few hundred ms to import; off the loop, the port stays responsive
+            await asyncio.to_thread(AgentRegistry.preload)
+            app.state.registry.start()
+            app.state.library = StoryLibrary(app.state.db, app.state.registry.story_processor)
+        with startup.phase('connections'):
+            _, azure = await asyncio.gather(app.state.db.warm(), app.state.registry.warm())
+        with startup.phase('content_filter'):
+            get_content_filter(app.state.registry.config_path)
+        with startup.phase('background'):
+            # With several workers, only the first to start recovers interrupted jobs and batches
+            recover = await coordination.claim_once(app.state.coordination, 'recover')
+            await app.state.jobs.start(recover=recover)
+            await app.state.batches.start(resume=recover)
+        startup.finish()
+        # Housekeeping that no request waits for
+        await cache.purge_expired()
+        return {"database": "ok", "azure": azure}
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception(f"Startup warm-up failed: {str(e)}")
+        raise
 
 # Initialize FastAPI app
-app = FastAPI(title="Kids Book Web App")
-db = Database()
+app = FastAPI(title="Kids Book Web App", lifespan=lifespan)
 
-# Create tables on startup
-@app.on_event("startup")
-async def startup():
-    db.create_tables()
+async def started(request: Request):
+    """Waits for warm_up() so requests that arrive before /ready reports ready still succeed."""
+    await asyncio.shield(request.app.state.warmup)
 
-# Dependency to get DB session
-def get_db():
-    session = db.get_session()
-    try:
+# Dependency to get an async DB session
+async def get_db(request: Request):
+    async with request.app.state.db.session() as session:
         yield session
-    finally:
-        session.close()
 
-# Set up logging
+# Dependency to get the application-scoped agent registry
+async def get_registry(request: Request) -> AgentRegistry:
+    await started(request)
+    return request.app.state.registry
+
+# Dependency to get the book pipeline
+async def get_pipeline(request: Request) -> BookPipeline:
+    await started(request)
+    return request.app.state.pipeline
+
+# Dependency to get the background job manager
+async def get_jobs(request: Request) -> JobManager:
+    await started(request)
+    return request.app.state.jobs
+
+# Dependency to get the stored story library
+async def get_library(request: Request) -> StoryLibrary:
+    await started(request)
+    return request.app.state.library
+
+# Dependency to get the PDF/EPUB exporter
+async def get_exporter(request: Request) -> BookExporter:
+    await started(request)
+    return request.app.state.exporter
+
+# Dependency to get full-text story search; it only needs the database, so it skips warm-up
+async def get_search(request: Request) -> StorySearch:
+    return request.app.state.search
+
+# Dependency to get the bulk generation runner
+async def get_batches(request: Request) -> BatchRunner:
+    await started(request)
+    return request.app.state.batches
+
+# Set up logging; LOG_LEVEL=DEBUG turns on per-span timing lines
 logger = logging.getLogger("kidsbook")
-logging.basicConfig(level=logging.DEBUG)
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO'))
+
+# Compress responses above a size threshold with brotli (when installed) or gzip; static
+# files built by services.static_build are already compressed and pass through. Added before
+# request_context so it sits inside it and sees whole bodies, which the size threshold needs
+compression_config = load_config('azure_config.json').get('compression', {})
+if compression_config.get('enabled', True):
+    app.add_middleware(CompressionMiddleware, **CompressionMiddleware.options(compression_config))
+
+# Tag each request with an id (honouring an incoming X-Request-ID) for logs, spans and the
+# saved story, and record its latency by route
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get('x-request-id') or new_request_id()
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['X-Request-ID'] = request_id
+        return response
+    finally:
+        route = request.scope.get('route')
+        HTTP_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else 'unmatched',
+            status=status
+        )
+        request_id_var.reset(token)
+
+# Generated images are content-addressed, so they can be cached forever; mounted
+# before /static so it takes precedence for that prefix. The directory is under the
+# writable data directory and is created when the app starts
+assets_config = load_config('azure_config.json').get('assets', {})
+assets_dir = data_path(os.environ.get('IMAGE_STORE_DIR', assets_config.get('directory', 'generated')))
+app.mount(
+    assets_config.get('url_prefix', '/static/generated'),
+    ImmutableStaticFiles(directory=assets_dir, check_dir=False),
+    name="generated"
+)
+
+# Fingerprinted stylesheets and scripts from `python -m services.static_build`: their names
+# change with their content, so they are cached forever and sent precompressed. The build
+# runs before deployment; without it the unfingerprinted files under /static are used
+dist_dir = os.path.join(STATIC_ROOT, DIST_DIR)
+if os.path.isdir(dist_dir):
+    app.mount(f"/static/{DIST_DIR}", PrecompressedStaticFiles(directory=dist_dir), name="static-dist")
 
 # Mount static files (assuming your static assets are in webapp/static)
-app.mount("/static", StaticFiles(directory="webapp/static"), name="static")
+app.mount("/static", StaticFiles(directory=STATIC_ROOT), name="static")
 
-# Configure Jinja2 templates (assuming templates are in webapp/templates)
+# Configure Jinja2 templates (assuming templates are in webapp/templates); the same
+# environment compiles the book template used by the renderer. Templates link static
+# files through static_url() so they pick up the fingerprinted names once built
 templates = Jinja2Templates(directory="webapp/templates")
+templates.env.globals['static_url'] = static_url
 
 # Home page endpoint - renders the index template
 @app.get("/", response_class=HTMLResponse)
 async def read_index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
+
+# Agent concurrency, queue-depth, coalescing, database pool and event-loop lag counters for this worker
+@app.get("/stats")
+async def read_stats(request: Request, registry: AgentRegistry = Depends(get_registry)):
+    backend = request.app.state.coordination
+    return {
+        **registry.stats(),
+        "coalescing": request.app.state.pipeline.coalescing.stats(),
+        "coordination": {
+            "workers": coordination.worker_count(),
+            "pid": os.getpid(),
+            **(backend.stats() if backend is not None else {"backend": "local"})
+        },
+        "export": request.app.state.exporter.stats(),
+        "db": request.app.state.db.pool_stats(),
+        "event_loop": request.app.state.loop_monitor.stats(),
+        "startup": startup.report()
+    }
+
+# Readiness probe for the App Service health check: 503 until warm-up has started the agents
+# and opened the database and Azure connections, then a database ping per call
+@app.get("/ready")
+async def read_ready(request: Request):
+    warmup = request.app.state.warmup
+    if not warmup.done():
+        return JSONResponse(status_code=503, content={"ready": False, "status": "warming up"})
+    if warmup.cancelled() or warmup.exception() is not None:
+        error = "cancelled" if warmup.cancelled() else str(warmup.exception())
+        return JSONResponse(status_code=503, content={"ready": False, "status": "warm-up failed", "error": error})
+    try:
+        await request.app.state.db.ping()
+    except Exception as e:
+        logger.warning(f"Readiness check could not reach the database: {str(e)}")
+        return JSONResponse(status_code=503, content={"ready": False, "status": "database unavailable"})
+    checks = warmup.result()
+    if checks["azure"].startswith("error"):
+        # Probe again until the endpoint answers; the recovered status is kept in the warm-up result
+        checks["azure"] = await request.app.state.registry.warm()
+        if checks["azure"].startswith("error"):
+            return JSONResponse(
+                status_code=503, content={"ready": False, "status": "azure unavailable", "checks": checks}
+            )
+    return {"ready": True, "checks": checks, "seconds_to_ready": startup.report()["seconds_to_ready"]}
 
-# Endpoint to process the creation of the kids book
-@app.post("/create_kids_book/")
+# Endpoint to queue the creation of the kids book
+@app.post("/create_kids_book/", status_code=202)
 async def create_kids_book(
-    request: Request, 
+    request: Request,
     story: str = Form(...),
-    db: Session = Depends(get_db)
+    lean: bool = Form(False),
+    jobs: JobManager = Depends(get_jobs)
 ):
-    """Async endpoint to create a kids book and store results in Azure SQL."""
+    """
+    Queues a kids book job and returns its id straight away; progress is on /jobs/{id}.
+    With `lean`, the returned URLs report the result as the story id and URLs only.
+    """
     if not story:
         logger.warning("No story provided in request")
         raise HTTPException(status_code=400, detail="No story provided")
 
     try:
-        # Initialize agents
-        editor = EditorAgent()
-        illustrator = IllustratorAgent()
-        story_processor = StoryProcessor()
-
-        async with asyncio.timeout(300):
-            # Process with editor
-            editor_result = await editor.edit_story(story)
-            if not editor_result:
-                raise HTTPException(status_code=500, detail="Story editing failed")
-
-            final_story = editor_result.get("final_story")
-            illustrator_prompt = editor_result.get("illustrator_prompt")
-
-            # Generate cover image
-            cover_image_url = await illustrator.generate_cover_image(final_story)
-            if not cover_image_url:
-                raise HTTPException(status_code=500, detail="Cover image generation failed")
-
-            # Store in database
-            db_story = Story(
-                input_text=story,
-                edited_text=final_story,
-                cover_image_url=cover_image_url,
-                editor_prompt=editor.config['prompt']['system'],
-                illustrator_prompt=illustrator_prompt,
-                editor_response=editor_result,
-                illustrator_response={"cover_image_url": cover_image_url}
-            )
-            db.add(db_story)
-            db.commit()
-
-            # Create composite HTML
-            html_content = await asyncio.to_thread(
-                story_processor.process,
-                final_story=final_story,
-                cover_image_url=cover_image_url,
-                illustrator_prompt=illustrator_prompt
-            )
+        job_id = await jobs.submit(story)
+    except Exception as e:
+        logger.exception(f"Error queueing request: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    query = "?lean=true" if lean else ""
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}{query}",
+        "events_url": f"/jobs/{job_id}/events{query}"
+    })
 
-            return JSONResponse(content={
-                "status": "success",
-                "html_content": html_content,
-                "cover_image_url": cover_image_url,
-                "final_story": final_story,
-                "story_id": db_story.id
-            })
-
-    except asyncio.TimeoutError:
-        logger.error("Operation timed out")
-        raise HTTPException(status_code=504, detail="Operation timed out")
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Stream the edited story token by token, followed by the cover and the rendered book
+@app.post("/create_kids_book/stream")
+async def stream_kids_book(
+    request: Request,
+    story: str = Form(...),
+    lean: bool = Form(False),
+    pipeline: BookPipeline = Depends(get_pipeline)
+):
+    """
+    Runs the pipeline inline and forwards its events to the client as Server-Sent Events.
+    With `lean`, the rendered book is not sent; load it from the `story_url` of the done event.
+    """
+    if not story:
+        logger.warning("No story provided in request")
+        raise HTTPException(status_code=400, detail="No story provided")
+
+    events = asyncio.Queue()
+
+    async def on_event(event: str, data: dict):
+        if event in ('token', 'stage', 'cover', 'speculation'):
+            await events.put((event, data))
+
+    async def run_pipeline():
+        try:
+            async with asyncio.timeout(300):
+                result = await pipeline.run(story, on_event=on_event, stream=True)
+            if not lean:
+                await events.put(('html', {'html_content': result['html_content']}))
+            await events.put(('done', {
+                'story_id': result['story_id'],
+                'story_url': result['story_url'],
+                'cover_image_url': result['cover_image_url']
+            }))
+        except TimeoutError:
+            logger.error("Operation timed out")
+            await events.put(('error', {'error': "Operation timed out"}))
+        except Exception as e:
+            logger.exception(f"Error processing request: {str(e)}")
+            await events.put(('error', {'error': str(e)}))
+
+    async def event_stream():
+        task = asyncio.create_task(run_pipeline())
+        try:
+            while True:
+                event, data = await events.get()
+                yield format_sse(event, data)
+                if event in ('done', 'error'):
+                    break
+        finally:
+            task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Poll the state of a queued book; `lean` leaves the book's HTML and text out of the result
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str, lean: bool = False, jobs: JobManager = Depends(get_jobs)):
+    job = await jobs.get(job_id, lean=lean)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Server-Sent Events stream of stage updates for a queued book
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, lean: bool = False, jobs: JobManager = Depends(get_jobs)):
+    if await jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event, data in jobs.events(job_id, lean=lean):
+            if event == 'keepalive':
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Queue a batch of stories uploaded as CSV, JSONL or plain text
+@app.post("/batches", status_code=202)
+async def create_batch(file: UploadFile = File(...), batches: BatchRunner = Depends(get_batches)):
+    """Stores every story in the file and generates them in the background; progress is on /batches/{id}."""
+    try:
+        content = (await file.read()).decode('utf-8-sig')
+        batch_id = await batches.submit(parse_stories(content, format_for(file.filename)))
+    except (BatchInputError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Error queueing batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return JSONResponse(status_code=202, content={
+        **await batches.get(batch_id),
+        "status_url": f"/batches/{batch_id}",
+        "events_url": f"/batches/{batch_id}/events",
+        "download_url": f"/batches/{batch_id}/download"
+    })
+
+# Poll the progress of a batch
+@app.get("/batches/{batch_id}")
+async def read_batch(batch_id: str, batches: BatchRunner = Depends(get_batches)):
+    batch = await batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+# Server-Sent Events stream of batch progress, one event per group of saved books
+@app.get("/batches/{batch_id}/events")
+async def stream_batch_events(batch_id: str, batches: BatchRunner = Depends(get_batches)):
+    if await batches.get(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    async def event_stream():
+        async for event, data in batches.events(batch_id):
+            if event == 'keepalive':
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Zip of the books a batch has rendered so far
+@app.get("/batches/{batch_id}/download")
+async def download_batch(batch_id: str, batches: BatchRunner = Depends(get_batches)):
+    archive_path = await batches.archive(batch_id)
+    if archive_path is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return FileResponse(archive_path, media_type="application/zip", filename=f"batch-{batch_id}.zip")
+
+# Prometheus scrape endpoint for span histograms, token counters and HTTP latency
+@app.get("/metrics")
+async def read_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Page through stored books, newest first
+@app.get("/stories")
+async def list_stories(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    created_after: datetime = None,
+    created_before: datetime = None,
+    has_cover: bool = None,
+    library: StoryLibrary = Depends(get_library)
+):
+    """Lists stories with keyset pagination; follow `next_url` for the next page."""
+    try:
+        page = await library.list(
+            limit=limit,
+            cursor=cursor,
+            created_after=created_after,
+            created_before=created_before,
+            has_cover=has_cover
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    page["next_url"] = None
+    if page["next_cursor"]:
+        params = {"limit": limit, "cursor": page["next_cursor"]}
+        if created_after is not None:
+            params["created_after"] = created_after.isoformat()
+        if created_before is not None:
+            params["created_before"] = created_before.isoformat()
+        if has_cover is not None:
+            params["has_cover"] = str(has_cover).lower()
+        page["next_url"] = f"/stories?{urllib.parse.urlencode(params)}"
+    return page
+
+# Full-text search over stored books, best match first; declared before /stories/{story_id}
+# so "search" is not read as a story id
+@app.get("/stories/search")
+async def search_stories(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    offset: int = Query(0, ge=0),
+    search: StorySearch = Depends(get_search)
+):
+    """Searches story text; each result's `snippet` is HTML with the matching words in <mark>."""
+    try:
+        page = await search.search(q, limit=limit, offset=offset)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception(f"Story search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    page["next_url"] = None
+    if page["next_offset"] is not None:
+        params = {"q": q, "limit": limit, "offset": page["next_offset"]}
+        page["next_url"] = f"/stories/search?{urllib.parse.urlencode(params)}"
+    return page
+
+# Download a stored book as PDF, EPUB or a self-contained HTML file for printing. Built once
+# in the export process pool and then served from disk, with Range and If-None-Match support
+@app.get("/stories/{story_id}/export/{fmt}")
+async def export_story(story_id: int, fmt: str, request: Request, exporter: BookExporter = Depends(get_exporter)):
+    try:
+        path = await exporter.export(story_id, fmt)
+    except UnknownFormat as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        logger.exception(f"Error processing request: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.exception(f"Error exporting story {story_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if path is None:
+        raise HTTPException(status_code=404, detail="Story not found")
+
+    media_type, extension = FORMATS[fmt]
+    response = FileResponse(
+        path,
+        stat_result=await asyncio.to_thread(os.stat, path),
+        media_type=media_type,
+        filename=f"kids-book-{story_id}.{extension}"
+    )
+    response.headers["Cache-Control"] = BOOK_CACHE_CONTROL
+    if etag_matches(request.headers.get('if-none-match'), response.headers['etag']):
+        return Response(status_code=304, headers={"ETag": response.headers['etag'], "Cache-Control": BOOK_CACHE_CONTROL})
+    return response
+
+# Re-open a stored book without generating it again; long books are sent in chunks, and a
+# browser that already has the book gets a 304 without the story being loaded
+@app.get("/stories/{story_id}", response_class=HTMLResponse)
+async def read_story(story_id: int, request: Request, library: StoryLibrary = Depends(get_library)):
+    headers = {"ETag": library.etag(story_id), "Cache-Control": BOOK_CACHE_CONTROL}
+    if etag_matches(request.headers.get('if-none-match'), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    story = await library.get(story_id)
+    if story is None:
+        raise HTTPException(status_code=404, detail="Story not found")
+    return StreamingResponse(library.generate(story), media_type="text/html", headers=headers)
@@ -1,8 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import create_engine, event, inspect, text, Index, Column, Integer, String, DateTime, Text, JSON, ForeignKey
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
 from datetime import datetime
+from services.metrics import span
+from services.paths import data_path
 import os
+import time
+import asyncio
 import logging
 import urllib.parse
 
@@ -21,36 +28,251 @@ class Story(Base):
     illustrator_prompt = Column(Text)
     editor_response = Column(JSON)
     illustrator_response = Column(JSON)
+    request_id = Column(String(64), index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # Keyset pagination for the story library walks (created_at, id) newest first
+    __table_args__ = (Index('ix_stories_created_at_id', 'created_at', 'id'),)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(String(36), primary_key=True)
+    status = Column(String(20), nullable=False, default='queued', index=True)
+    stage = Column(String(50))
+    input_text = Column(Text, nullable=False)
+    checkpoint = Column(JSON)
+    result = Column(JSON)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    story_id = Column(Integer, ForeignKey('stories.id'))
+    request_id = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "story_id": self.story_id,
+            "error": self.error,
+            "attempts": self.attempts,
+            "result": self.result,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class Batch(Base):
+    __tablename__ = 'batches'
+
+    id = Column(String(36), primary_key=True)
+    status = Column(String(20), nullable=False, default='queued', index=True)
+    total = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    output_dir = Column(String(500))
+    error = Column(Text)
+    request_id = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "batch_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "pending": self.total - self.succeeded - self.failed,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class BatchItem(Base):
+    __tablename__ = 'batch_items'
+
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String(36), ForeignKey('batches.id'), nullable=False)
+    position = Column(Integer, nullable=False)
+    input_text = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default='pending')
+    story_id = Column(Integer, ForeignKey('stories.id'))
+    error = Column(Text)
+
+    # Resuming a batch selects its unfinished items
+    __table_args__ = (Index('ix_batch_items_batch_id_status', 'batch_id', 'status'),)
+
+class CacheEntry(Base):
+    __tablename__ = 'result_cache'
+
+    key = Column(String(64), primary_key=True)
+    kind = Column(String(20), nullable=False)
+    value = Column(JSON, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    
-class Database:
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Under the writable data directory (services.paths) when no connection string is set
+DEFAULT_SQLITE_FILE = 'kidsbook.db'
+
+# Async drivers used in place of the blocking DBAPI named in the connection string
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'mssql': 'mssql+aioodbc',
+    'mssql+pyodbc': 'mssql+aioodbc',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg'
+}
+
+def to_async_url(conn_str: str):
+    url = make_url(conn_str)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+def pool_settings(pool_size: int = None):
+    """Pool sizing and health checks, overridable with DB_POOL_* environment variables."""
+    size = int(os.getenv('DB_POOL_SIZE') or pool_size or 5)
+    return {
+        "pool_size": size,
+        "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', max(2, size // 2))),
+        "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    }
+
+def create_missing_indexes(connection):
+    """create_all skips tables that already exist, so indexes added to a model later are created here."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def add_missing_columns(connection):
+    """Adds nullable columns introduced after a table was first created."""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD {column.name} {column_type}')
+                logger.info(f"Added column {table.name}.{column.name}")
+
+class TimedAsyncSession(AsyncSession):
+    """AsyncSession whose commits are recorded as `db_commit` spans."""
+
+    async def commit(self):
+        with span('db_commit'):
+            await super().commit()
+
+class PoolMetrics:
+    """Counts pool checkouts and how long sessions waited to get a connection."""
+
     def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def attach(self, engine):
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+
+    def _on_connect(self, *args):
+        self.connects += 1
+
+    def _on_checkout(self, *args):
+        self.checkouts += 1
+
+    def _on_checkin(self, *args):
+        self.checkins += 1
+
+    def record_wait(self, seconds: float):
+        self.waits += 1
+        self.total_wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+class Database:
+    def __init__(self, pool_size: int = None):
         try:
             conn_str = os.getenv('AZURE_SQL_CONNECTION_STRING')
             if not conn_str:
-                raise ValueError("Azure SQL connection string not found in environment variables")
-            
-            # Create SQLAlchemy engine with proper connection pooling
-            self.engine = create_engine(
-                conn_str,
-                pool_size=5,
-                max_overflow=2,
-                pool_timeout=30,
-                pool_recycle=1800
+                path = data_path(DEFAULT_SQLITE_FILE)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                conn_str = f"sqlite:///{path}"
+                logger.warning(f"AZURE_SQL_CONNECTION_STRING not set, using local database {conn_str}")
+            self.conn_str = conn_str
+            self.settings = pool_settings(pool_size)
+            self._engine = None
+            self._SessionLocal = None
+
+            # The async engine serves the request path; it connects lazily on first use
+            self.async_engine = create_async_engine(to_async_url(conn_str), **self.settings)
+            self.AsyncSessionLocal = async_sessionmaker(
+                self.async_engine, class_=TimedAsyncSession, expire_on_commit=False
             )
-            self.SessionLocal = sessionmaker(bind=self.engine)
-            logger.info("Database connection established successfully")
+            self.metrics = PoolMetrics()
+            self.metrics.attach(self.async_engine.sync_engine)
+            logger.info(f"Database configured with pool settings {self.settings}")
         except Exception as e:
             logger.error(f"Failed to initialize database: {str(e)}")
             raise
 
-    def create_tables(self):
-        try:
-            Base.metadata.create_all(self.engine)
-            logger.info("Database tables created successfully")
-        except Exception as e:
-            logger.error(f"Failed to create tables: {str(e)}")
-            raise
-        
+    @property
+    def engine(self):
+        """Blocking engine for scripts and maintenance commands; created on first use."""
+        if self._engine is None:
+            engine_kwargs = dict(self.settings)
+            if self.conn_str.startswith('sqlite'):
+                engine_kwargs["connect_args"] = {"check_same_thread": False}
+            self._engine = create_engine(self.conn_str, **engine_kwargs)
+        return self._engine
+
+    async def ping(self):
+        async with self.session() as session:
+            await session.execute(text('SELECT 1'))
+
+    async def warm(self, connections: int = None):
+        """Opens up to `connections` pooled connections at once so the first requests skip the connect."""
+        count = min(connections or self.settings["pool_size"], self.settings["pool_size"])
+        await asyncio.gather(*(self.ping() for _ in range(count)))
+
+    @asynccontextmanager
+    async def session(self):
+        """Async session whose connection is checked out up front so pool waits are measured."""
+        async with self.AsyncSessionLocal() as session:
+            started = time.perf_counter()
+            await session.connection()
+            self.metrics.record_wait(time.perf_counter() - started)
+            yield session
+
     def get_session(self):
-        return self.SessionLocal()
\ No newline at end of file
+        """Blocking session for scripts and maintenance commands."""
+        if self._SessionLocal is None:
+            self._SessionLocal = sessionmaker(bind=self.engine)
+        return self._SessionLocal()
+
+    def pool_stats(self):
+        pool = self.async_engine.pool
+        return {
+            "pool_size": self.settings["pool_size"],
+            "max_overflow": self.settings["max_overflow"],
+            "checked_out": pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            "overflow": pool.overflow() if hasattr(pool, 'overflow') else None,
+            "connects": self.metrics.connects,
+            "checkouts": self.metrics.checkouts,
+            "checkins": self.metrics.checkins,
+            "session_waits": self.metrics.waits,
+            "total_wait_seconds": round(self.metrics.total_wait_seconds, 4),
+            "max_wait_seconds": round(self.metrics.max_wait_seconds, 4)
+        }
+
+    async def dispose(self):
+        await self.async_engine.dispose()
+        if self._engine is not None:
+            self._engine.dispose()
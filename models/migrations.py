@@ -0,0 +1,183 @@
+"""
+Versioned schema migrations.
+
+The applied version is kept in `schema_version`, so a started app only reads one row to
+confirm the schema is current instead of inspecting every table on each boot. Run it as a
+deployment step:
+
+    python -m models.migrations          # apply pending migrations
+    python -m models.migrations --check  # exit 1 if the database is behind
+
+New schema changes are added as a numbered function at the end of MIGRATIONS. They must be
+safe to run again, since worker processes starting together may race to apply them.
+"""
+import os
+import sys
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, select, func, inspect
+from sqlalchemy.exc import DBAPIError
+from models.database import Base, add_missing_columns, create_missing_indexes
+
+logger = logging.getLogger('kidsbook')
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200))
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SchemaOutOfDate(RuntimeError):
+    """Raised at startup when the schema is behind and migrating on startup is disabled."""
+
+
+def _baseline(connection):
+    # Databases created before migrations existed already hold some of these tables
+    add_missing_columns(connection)
+    Base.metadata.create_all(connection)
+    create_missing_indexes(connection)
+
+
+# External-content FTS5 table over the stories' text, kept current by triggers so every
+# insert path (single books and bulk batch saves alike) is indexed in the same transaction
+SQLITE_SEARCH_INDEX = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+        input_text, edited_text, content='stories', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+        INSERT INTO stories_fts (rowid, input_text, edited_text) VALUES (new.id, new.input_text, new.edited_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+        INSERT INTO stories_fts (stories_fts, rowid, input_text, edited_text)
+        VALUES ('delete', old.id, old.input_text, old.edited_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF input_text, edited_text ON stories BEGIN
+        INSERT INTO stories_fts (stories_fts, rowid, input_text, edited_text)
+        VALUES ('delete', old.id, old.input_text, old.edited_text);
+        INSERT INTO stories_fts (rowid, input_text, edited_text) VALUES (new.id, new.input_text, new.edited_text);
+    END""",
+    # Indexes the rows that existed before the table did
+    "INSERT INTO stories_fts (stories_fts) VALUES ('rebuild')"
+)
+
+
+def _search_index(connection):
+    if connection.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_INDEX:
+            connection.exec_driver_sql(statement)
+    else:
+        # SQL Server refuses full-text DDL inside a transaction, so it is a separate step
+        logger.warning("Create the full-text index with `python -m services.search --backfill`")
+
+
+MIGRATIONS = [
+    (1, "Baseline: tables, columns and indexes for stories, jobs, cache and batches", _baseline),
+    (2, "Full-text search index over story text", _search_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection) -> int:
+    """Highest applied migration, or 0 for a database that has never been migrated."""
+    if not inspect(connection).has_table(SchemaVersion.__tablename__):
+        return 0
+    return connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+
+def upgrade(connection) -> list:
+    """Applies pending migrations in order; returns the versions applied."""
+    applied = []
+    version = current_version(connection)
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info(f"Applying migration {number}: {description}")
+        migrate(connection)
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+        connection.execute(SchemaVersion.__table__.insert().values(
+            version=number, description=description, applied_at=datetime.utcnow()
+        ))
+        applied.append(number)
+    return applied
+
+
+async def migrate(db, attempts: int = 3) -> list:
+    for attempt in range(1, attempts + 1):
+        try:
+            async with db.async_engine.begin() as conn:
+                applied = await conn.run_sync(upgrade)
+            break
+        except DBAPIError:
+            # Worker processes starting together race to migrate: the loser's check-then-create
+            # fails on objects the winner has just made, so look again and retry if still behind
+            async with db.async_engine.connect() as conn:
+                version = await conn.run_sync(current_version)
+            if version >= LATEST_VERSION:
+                logger.info("Migrations were applied concurrently by another process")
+                return []
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(0.5 * attempt)
+    if applied:
+        logger.info(f"Database migrated to version {LATEST_VERSION}")
+    return applied
+
+
+async def ensure_schema(db, apply: bool = None) -> int:
+    """
+    Reads the schema version and migrates only when it is behind.
+    With DB_MIGRATE_ON_STARTUP=false a stale schema is an error instead, for deployments
+    that run `python -m models.migrations` before starting the app.
+    """
+    if apply is None:
+        apply = os.environ.get('DB_MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+    async with db.async_engine.connect() as conn:
+        version = await conn.run_sync(current_version)
+    if version >= LATEST_VERSION:
+        return version
+    if not apply:
+        raise SchemaOutOfDate(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run `python -m models.migrations`"
+        )
+    await migrate(db)
+    return LATEST_VERSION
+
+
+async def _run_cli(check: bool) -> int:
+    from models.database import Database
+
+    db = Database()
+    try:
+        async with db.async_engine.connect() as conn:
+            version = await conn.run_sync(current_version)
+        if check:
+            print(f"Schema version {version}, latest {LATEST_VERSION}")
+            return 0 if version >= LATEST_VERSION else 1
+        applied = await migrate(db)
+        print(f"Applied {applied}" if applied else f"Already at version {version}")
+        return 0
+    finally:
+        await db.dispose()
+
+
+def main():
+    import argparse
+    from dotenv import load_dotenv
+    from services.metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help="Only report whether migrations are pending")
+    args = parser.parse_args()
+    load_dotenv()
+    configure_logging(os.environ.get('LOG_LEVEL', 'INFO'))
+    sys.exit(asyncio.run(_run_cli(args.check)))
+
+
+if __name__ == '__main__':
+    main()
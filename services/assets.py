@@ -0,0 +1,274 @@
+import os
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import mimetypes
+import anyio.to_thread
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from services.compression import accepts
+from services.paths import data_path
+
+logger = logging.getLogger('kidsbook')
+
+DEFAULT_VARIANTS = [
+    {"width": 1024, "format": "webp"},
+    {"width": 512, "format": "webp"},
+    {"width": 512, "format": "jpeg"}
+]
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp"
+}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _detect_format(path: str) -> str:
+    from PIL import Image
+    with Image.open(path) as image:
+        return (image.format or 'png').lower()
+
+
+def _copy_into_place(source_path: str, target: str):
+    """
+    Copies under a temporary name beside `target` and renames it over, so concurrent stores
+    of the same image never leave a reader with a half-written file.
+    """
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, scratch = tempfile.mkstemp(prefix='.store-', dir=directory)
+    os.close(fd)
+    try:
+        shutil.copyfile(source_path, scratch)
+        # mkstemp creates the file owner-only; stored images are public
+        os.chmod(scratch, 0o644)
+        os.replace(scratch, target)
+    except BaseException:
+        os.remove(scratch)
+        raise
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _render_variant(source_path: str, target_path: str, width: int, fmt: str):
+    """Resizes an image to `width` (never upscaling) and encodes it. Runs in the worker pool."""
+    from PIL import Image
+    with Image.open(source_path) as image:
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(target_path, format=fmt.upper(), quality=85)
+
+
+class LocalImageBackend:
+    """Keeps images under a directory that is served by the /static mount."""
+
+    def __init__(self, root: str, url_prefix: str):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def _path(self, name: str):
+        return os.path.join(self.root, name)
+
+    async def exists(self, name: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self._path(name))
+
+    async def save(self, name: str, source_path: str, content_type: str):
+        target = self._path(name)
+        await asyncio.to_thread(_copy_into_place, source_path, target)
+
+    def url(self, name: str) -> str:
+        return f"{self.url_prefix}/{name}"
+
+    async def aclose(self):
+        return None
+
+
+class BlobImageBackend:
+    """Stores images in an Azure Blob container with long-lived cache headers."""
+
+    def __init__(self, connection_string: str, container: str):
+        from azure.storage.blob.aio import BlobServiceClient
+        self.service = BlobServiceClient.from_connection_string(connection_string)
+        self.container = self.service.get_container_client(container)
+
+    async def exists(self, name: str) -> bool:
+        return await self.container.get_blob_client(name).exists()
+
+    async def save(self, name: str, source_path: str, content_type: str):
+        from azure.storage.blob import ContentSettings
+        data = await asyncio.to_thread(_read_bytes, source_path)
+        await self.container.upload_blob(
+            name,
+            data,
+            overwrite=True,
+            content_settings=ContentSettings(
+                content_type=content_type,
+                cache_control=IMMUTABLE_CACHE_CONTROL
+            )
+        )
+
+    def url(self, name: str) -> str:
+        return self.container.get_blob_client(name).url
+
+    async def aclose(self):
+        await self.service.close()
+
+
+class ImageStore:
+    """
+    Persists generated images so the book never depends on DALL-E's expiring URLs.
+
+    Each image is downloaded once with streaming I/O, named by the SHA-256 of its bytes,
+    and stored with resized WebP/JPEG variants rendered by Pillow in a worker pool
+    (Pillow releases the GIL while resizing and encoding, so threads scale across cores).
+    """
+
+    def __init__(self, http_client, backend, variants=None, workers: int = 2):
+        self.http_client = http_client
+        self.backend = backend
+        self.variants = variants if variants is not None else DEFAULT_VARIANTS
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-store')
+
+    @classmethod
+    def from_config(cls, http_client, config: dict):
+        """Reads the `assets` section of azure_config.json, with env var overrides."""
+        backend_name = os.environ.get('IMAGE_STORE_BACKEND', config.get('backend', 'local'))
+        if backend_name == 'blob':
+            backend = BlobImageBackend(
+                os.environ['AZURE_STORAGE_CONNECTION_STRING'],
+                os.environ.get('IMAGE_STORE_CONTAINER', config.get('container', 'covers'))
+            )
+        else:
+            backend = LocalImageBackend(
+                data_path(os.environ.get('IMAGE_STORE_DIR', config.get('directory', 'generated'))),
+                config.get('url_prefix', '/static/generated')
+            )
+        return cls(
+            http_client,
+            backend,
+            variants=config.get('variants'),
+            workers=int(config.get('workers', 2))
+        )
+
+    async def store(self, source_url: str) -> dict:
+        """
+        Downloads `source_url` and returns {"url", "source_url", "sha256", "variants"}
+        where every URL points at the persistent copy.
+        """
+        fd, download_path = tempfile.mkstemp(prefix='kidsbook-', suffix='.img')
+        os.close(fd)
+        scratch = [download_path]
+        try:
+            digest = hashlib.sha256()
+            async with self.http_client.stream('GET', source_url) as response:
+                response.raise_for_status()
+                f = await asyncio.to_thread(open, download_path, 'wb')
+                try:
+                    async for chunk in response.aiter_bytes():
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            sha256 = digest.hexdigest()
+
+            loop = asyncio.get_running_loop()
+            fmt = await loop.run_in_executor(self._executor, _detect_format, download_path)
+            ext = 'jpg' if fmt == 'jpeg' else fmt
+            prefix = f"{sha256[:2]}/{sha256}"
+            original_name = f"{prefix}.{ext}"
+
+            if not await self.backend.exists(original_name):
+                await self.backend.save(original_name, download_path, CONTENT_TYPES.get(fmt, 'application/octet-stream'))
+
+            variants = {}
+            pending = []
+            for variant in self.variants:
+                width, variant_fmt = int(variant['width']), variant['format']
+                label = f"w{width}.{'jpg' if variant_fmt == 'jpeg' else variant_fmt}"
+                name = f"{prefix}-{label}"
+                variants[label] = self.backend.url(name)
+                if await self.backend.exists(name):
+                    continue
+                fd, variant_path = tempfile.mkstemp(prefix='kidsbook-', suffix=f'.{variant_fmt}')
+                os.close(fd)
+                scratch.append(variant_path)
+                pending.append((name, variant_path, variant_fmt, loop.run_in_executor(
+                    self._executor, _render_variant, download_path, variant_path, width, variant_fmt
+                )))
+
+            for name, variant_path, variant_fmt, future in pending:
+                await future
+                await self.backend.save(name, variant_path, CONTENT_TYPES[variant_fmt])
+
+            logger.info(f"Stored image {sha256[:12]} with {len(variants)} variant(s)")
+            return {
+                "url": self.backend.url(original_name),
+                "source_url": source_url,
+                "sha256": sha256,
+                "variants": variants
+            }
+        finally:
+            for path in scratch:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    async def aclose(self):
+        self._executor.shutdown(wait=False)
+        await self.backend.aclose()
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-addressed files: adds a one-year immutable Cache-Control on top of ETags."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+class PrecompressedStaticFiles(ImmutableStaticFiles):
+    """
+    Serves the fingerprinted build in webapp/static/dist. When the client accepts it, the
+    `.br` or `.gz` copy written at build time is sent as is, so nothing is compressed per request.
+    """
+
+    # Preferred first
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    async def get_response(self, path: str, scope):
+        request_headers = Headers(scope=scope)
+        for encoding, suffix in self.ENCODINGS:
+            if not accepts(request_headers, encoding):
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result is None or not os.path.isfile(full_path):
+                continue
+            response = FileResponse(
+                full_path,
+                stat_result=stat_result,
+                media_type=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+            )
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        response = await super().get_response(path, scope)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
@@ -0,0 +1,501 @@
+"""
+Bulk book generation from a CSV, JSONL or plain-text file of stories.
+
+Used by the /batches API and as a command-line tool against the same database:
+
+    python -m services.batch stories.csv --output books.zip
+    python -m services.batch --resume BATCH_ID
+
+CSV files use their `story` column (or the first column when there is no such header),
+JSONL lines are {"story": ...} objects or plain strings, and .txt files hold one story per
+line. Books are written as numbered HTML files to the output directory, which is zipped
+when the output path ends in .zip.
+"""
+import io
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import zipfile
+import tempfile
+from collections import deque
+from datetime import datetime
+from sqlalchemy import select, update, func
+from models.database import Batch, BatchItem
+from services.metrics import request_id_var, current_request_id
+from services.coordination import worker_count
+from services.paths import data_path
+
+logger = logging.getLogger('kidsbook')
+
+TERMINAL_STATUSES = ('completed', 'failed')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.txt': 'text'}
+
+
+class BatchInputError(ValueError):
+    """Raised when an uploaded story file cannot be read."""
+
+
+def format_for(filename: str) -> str:
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in FORMATS:
+        raise BatchInputError(f"Unsupported file type '{extension}', expected one of {sorted(FORMATS)}")
+    return FORMATS[extension]
+
+
+def parse_stories(content: str, fmt: str) -> list:
+    """Returns the non-empty stories in a CSV, JSONL or plain-text document."""
+    stories = []
+    if fmt == 'csv':
+        rows = list(csv.reader(io.StringIO(content)))
+        column = 0
+        if rows:
+            header = [name.strip().lower() for name in rows[0]]
+            if 'story' in header:
+                column = header.index('story')
+                rows = rows[1:]
+        stories = [row[column] for row in rows if len(row) > column]
+    elif fmt == 'jsonl':
+        for number, line in enumerate(content.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise BatchInputError(f"Line {number} is not valid JSON: {str(e)}")
+            stories.append(record.get('story', '') if isinstance(record, dict) else str(record))
+    else:
+        stories = content.splitlines()
+    return [story.strip() for story in stories if story and story.strip()]
+
+
+def read_stories(path: str) -> list:
+    with open(path, encoding='utf-8-sig') as f:
+        return parse_stories(f.read(), format_for(path))
+
+
+def _write_book(path: str, html_content: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+
+def _zip_directory(directory: str, archive_path: str):
+    """
+    Zips `directory` under a temporary name and renames it over `archive_path`, so a download
+    already streaming the previous archive is never handed a half-written one.
+    """
+    parent = os.path.dirname(os.path.abspath(archive_path))
+    fd, scratch = tempfile.mkstemp(prefix='.batch-', suffix='.zip', dir=parent)
+    try:
+        with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(directory)):
+                archive.write(os.path.join(directory, name), arcname=name)
+        os.replace(scratch, archive_path)
+    except BaseException:
+        os.remove(scratch)
+        raise
+    return archive_path
+
+
+def _archive_current(directory: str, archive_path: str) -> bool:
+    """True when `archive_path` exists and no book in `directory` was written after it."""
+    try:
+        built = os.stat(archive_path).st_mtime
+    except FileNotFoundError:
+        return False
+    return all(os.stat(os.path.join(directory, name)).st_mtime <= built for name in os.listdir(directory))
+
+
+class BatchRunner:
+    """
+    Runs a batch of stories through the editor and illustrator and stores the books.
+
+    Stories are persisted as `batch_items` when the batch is created. A bounded pool of
+    workers (shared by every batch in the process) generates them; the agents' own limiters
+    keep the calls within the Azure quotas. Finished items are saved in groups: one
+    transaction bulk-inserts their `stories` rows and marks the items done, then their books
+    are written to the batch's output directory. An interrupted batch resumes with the items
+    that were not yet saved.
+    """
+
+    def __init__(self, db, pipeline, workers: int = 4, commit_every: int = 20, commit_interval: float = 5.0,
+                 timeout: float = 300, max_stories: int = 1000, output_root: str = 'batches',
+                 poll_interval: float = 2.0):
+        self.db = db
+        self.pipeline = pipeline
+        self.workers = workers
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.timeout = timeout
+        self.max_stories = max_stories
+        self.output_root = output_root
+        self.poll_interval = poll_interval
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks = {}
+        self._subscribers = {}
+
+    @classmethod
+    def from_config(cls, db, pipeline, config: dict):
+        """Reads the `batch` section of azure_config.json, with env var overrides."""
+        return cls(
+            db,
+            pipeline,
+            workers=int(os.environ.get('BATCH_WORKERS', config.get('workers', 4))),
+            commit_every=int(config.get('commit_every', 20)),
+            commit_interval=float(config.get('commit_interval', 5.0)),
+            timeout=float(config.get('timeout', 300)),
+            max_stories=int(config.get('max_stories', 1000)),
+            output_root=data_path(os.environ.get('BATCH_OUTPUT_DIR', config.get('output_dir', 'batches'))),
+            poll_interval=float(config.get('poll_interval', 2.0))
+        )
+
+    async def start(self, resume: bool = True):
+        """
+        Resumes batches left queued or running by a previous process. With several worker
+        processes only one of them passes `resume`, so each batch is resumed once.
+        """
+        if not resume:
+            return
+        async with self.db.session() as session:
+            rows = await session.execute(
+                select(Batch.id).where(Batch.status.in_(('queued', 'running'))).order_by(Batch.created_at)
+            )
+            unfinished = list(rows.scalars())
+        for batch_id in unfinished:
+            self.schedule(batch_id)
+        if unfinished:
+            logger.info(f"Resuming {len(unfinished)} unfinished batch(es)")
+
+    async def stop(self):
+        """Cancels running batches; they stay 'running' and resume on next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+
+    async def submit(self, stories: list, output_dir: str = None) -> str:
+        batch_id = await self.create(stories, output_dir)
+        self.schedule(batch_id)
+        return batch_id
+
+    def schedule(self, batch_id: str):
+        task = asyncio.create_task(self.run(batch_id), name=f"batch-{batch_id}")
+        self._tasks[batch_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(batch_id, None))
+
+    async def create(self, stories: list, output_dir: str = None) -> str:
+        """Stores a new batch and all of its items in one transaction; returns its id."""
+        if not stories:
+            raise BatchInputError("No stories provided")
+        if len(stories) > self.max_stories:
+            raise BatchInputError(f"A batch holds at most {self.max_stories} stories, got {len(stories)}")
+        batch_id = str(uuid.uuid4())
+        async with self.db.session() as session:
+            session.add(Batch(
+                id=batch_id,
+                status='queued',
+                total=len(stories),
+                output_dir=output_dir or os.path.join(self.output_root, batch_id),
+                request_id=current_request_id()
+            ))
+            session.add_all(
+                BatchItem(batch_id=batch_id, position=position, input_text=story)
+                for position, story in enumerate(stories, start=1)
+            )
+            await session.commit()
+        logger.info(f"Created batch {batch_id} with {len(stories)} stories")
+        return batch_id
+
+    async def get(self, batch_id: str):
+        async with self.db.session() as session:
+            batch = await session.get(Batch, batch_id)
+            return batch.to_dict() if batch else None
+
+    async def output_dir(self, batch_id: str):
+        async with self.db.session() as session:
+            batch = await session.get(Batch, batch_id)
+            return batch.output_dir if batch else None
+
+    async def archive(self, batch_id: str, archive_path: str = None):
+        """
+        Zips the books written so far; returns the archive path, or None for an unknown batch.
+        Once the batch has finished, an archive built after its last book is reused as is.
+        """
+        async with self.db.session() as session:
+            batch = await session.get(Batch, batch_id)
+            if batch is None:
+                return None
+            directory, finished = batch.output_dir, batch.status in TERMINAL_STATUSES
+        archive_path = archive_path or directory.rstrip('/\\') + '.zip'
+        await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+        if finished and await asyncio.to_thread(_archive_current, directory, archive_path):
+            return archive_path
+        return await asyncio.to_thread(_zip_directory, directory, archive_path)
+
+    async def events(self, batch_id: str, keepalive: float = 15.0):
+        """
+        Yields (event, data) pairs for a batch until it finishes, starting with its current status.
+        A batch run by another worker process is followed by polling its row instead.
+        """
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(batch_id, set()).add(queue)
+        try:
+            batch = await self.get(batch_id)
+            if batch is None:
+                return
+            yield 'status', batch
+            if batch['status'] in TERMINAL_STATUSES:
+                return
+            last_sent = time.monotonic()
+            while True:
+                local = batch_id in self._tasks or worker_count() == 1
+                try:
+                    event, data = await asyncio.wait_for(
+                        queue.get(), timeout=keepalive if local else min(keepalive, self.poll_interval)
+                    )
+                except asyncio.TimeoutError:
+                    latest = None if local else await self.get(batch_id)
+                    if latest is not None and latest != batch:
+                        batch = latest
+                        yield 'status', batch
+                        if batch['status'] in TERMINAL_STATUSES:
+                            return
+                        last_sent = time.monotonic()
+                    elif time.monotonic() - last_sent >= keepalive:
+                        yield 'keepalive', {}
+                        last_sent = time.monotonic()
+                    continue
+                yield event, data
+                if event in ('done', 'error'):
+                    return
+        finally:
+            subscribers = self._subscribers.get(batch_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    self._subscribers.pop(batch_id, None)
+
+    def _publish(self, batch_id: str, event: str, data: dict):
+        for queue in self._subscribers.get(batch_id, ()):
+            queue.put_nowait((event, data))
+
+    async def run(self, batch_id: str):
+        """Generates every unfinished item of a batch and returns its final status."""
+        async with self.db.session() as session:
+            batch = await session.get(Batch, batch_id)
+            if batch is None:
+                raise KeyError(batch_id)
+            rows = await session.execute(
+                select(BatchItem.id, BatchItem.position, BatchItem.input_text)
+                .where(BatchItem.batch_id == batch_id, BatchItem.status != 'succeeded')
+                .order_by(BatchItem.position)
+            )
+            items = deque(rows.all())
+            output_dir, total = batch.output_dir, batch.total
+            request_id_var.set(batch.request_id or batch_id)
+
+        os.makedirs(output_dir, exist_ok=True)
+        await self._update(batch_id, status='running', error=None)
+        self._publish(batch_id, 'status', await self.get(batch_id))
+        logger.info(f"Batch {batch_id}: {len(items)} of {total} stories to generate")
+
+        finished = []
+        flush_lock = asyncio.Lock()
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal finished, last_flush
+            async with flush_lock:
+                if not finished:
+                    return
+                done, finished = finished, []
+                last_flush = time.monotonic()
+                progress = await self._save(batch_id, output_dir, total, done)
+            self._publish(batch_id, 'progress', progress)
+
+        async def worker():
+            while items:
+                item_id, position, story = items.popleft()
+                async with self._slots:
+                    try:
+                        async with asyncio.timeout(self.timeout):
+                            state = await self.pipeline.generate(story)
+                        finished.append((item_id, position, story, state, None))
+                    except Exception as e:
+                        message = "Operation timed out" if isinstance(e, TimeoutError) else str(e)
+                        logger.warning(f"Batch {batch_id} story {position} failed: {message}")
+                        finished.append((item_id, position, story, None, message))
+                if len(finished) >= self.commit_every or time.monotonic() - last_flush >= self.commit_interval:
+                    await flush()
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                for _ in range(min(self.workers, len(items))):
+                    group.create_task(worker())
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            error = e.exceptions[0] if isinstance(e, BaseExceptionGroup) else e
+            logger.exception(f"Batch {batch_id} failed: {str(error)}")
+            await self._update(batch_id, status='failed', error=str(error))
+            self._publish(batch_id, 'error', {'batch_id': batch_id, 'error': str(error)})
+            return 'failed'
+
+        await self._write_manifest(batch_id, output_dir)
+        await self._update(batch_id, status='completed')
+        result = await self.get(batch_id)
+        self._publish(batch_id, 'done', result)
+        logger.info(f"Batch {batch_id} completed: {result['succeeded']} succeeded, {result['failed']} failed")
+        return 'completed'
+
+    async def _save(self, batch_id: str, output_dir: str, total: int, done: list) -> dict:
+        """
+        Bulk-inserts the stories for finished items and marks every item in one transaction.
+        Books are written once their story ids are assigned and before the commit, so a
+        crash can leave a file for an unsaved item (overwritten on resume) but never a saved
+        item without its file.
+        """
+        width = len(str(total))
+        async with self.db.session() as session:
+            rows = {
+                item_id: self.pipeline.story_row(story, state)
+                for item_id, position, story, state, error in done if state is not None
+            }
+            session.add_all(rows.values())
+            await session.flush()
+
+            updates = []
+            for item_id, position, story, state, error in done:
+                if item_id in rows:
+                    state['story_id'] = rows[item_id].id
+                    path = os.path.join(output_dir, f"{position:0{width}d}.html")
+                    await asyncio.to_thread(_write_book, path, self.pipeline.render(state))
+                    updates.append({"id": item_id, "status": 'succeeded', "story_id": state['story_id'], "error": None})
+                else:
+                    updates.append({"id": item_id, "status": 'failed', "error": error})
+            await session.execute(update(BatchItem), updates)
+
+            counts = dict((await session.execute(
+                select(BatchItem.status, func.count())
+                .where(BatchItem.batch_id == batch_id)
+                .group_by(BatchItem.status)
+            )).all())
+            progress = {
+                "batch_id": batch_id,
+                "total": total,
+                "succeeded": counts.get('succeeded', 0),
+                "failed": counts.get('failed', 0),
+                "items": [
+                    {"position": position, "story_id": state['story_id'] if state else None, "error": error}
+                    for item_id, position, story, state, error in done
+                ]
+            }
+            await session.execute(
+                update(Batch)
+                .where(Batch.id == batch_id)
+                .values(succeeded=progress["succeeded"], failed=progress["failed"], updated_at=datetime.utcnow())
+            )
+            await session.commit()
+        return progress
+
+    async def _write_manifest(self, batch_id: str, output_dir: str):
+        async with self.db.session() as session:
+            rows = await session.execute(
+                select(BatchItem.position, BatchItem.status, BatchItem.story_id, BatchItem.error)
+                .where(BatchItem.batch_id == batch_id)
+                .order_by(BatchItem.position)
+            )
+            manifest = [
+                {"position": position, "status": status, "story_id": story_id, "error": error}
+                for position, status, story_id, error in rows.all()
+            ]
+        await asyncio.to_thread(_write_book, os.path.join(output_dir, 'manifest.json'), json.dumps(manifest, indent=2))
+
+    async def _update(self, batch_id: str, **values):
+        async with self.db.session() as session:
+            values['updated_at'] = datetime.utcnow()
+            await session.execute(update(Batch).where(Batch.id == batch_id).values(**values))
+            await session.commit()
+
+
+async def _run_cli(args):
+    from agents.base_agent import load_config
+    from agents.registry import AgentRegistry
+    from models.database import Database
+    from models.migrations import ensure_schema
+    from services.cache import ResultCache
+    from services.pipeline import BookPipeline
+
+    config = load_config('azure_config.json')
+    batch_config = config.get('batch', {})
+    db = Database(pool_size=int(os.environ.get('BATCH_WORKERS', batch_config.get('workers', 4))) + 2)
+    await ensure_schema(db)
+    cache = ResultCache.from_config(db, config.get('cache', {}))
+    registry = AgentRegistry(cache=cache).start()
+    try:
+        pipeline = BookPipeline(registry, db)
+        runner = BatchRunner.from_config(db, pipeline, batch_config)
+
+        archive_path = None
+        output_dir = args.output
+        if output_dir and output_dir.lower().endswith('.zip'):
+            archive_path, output_dir = output_dir, output_dir[:-4]
+        if args.resume:
+            batch_id = args.resume
+            if await runner.get(batch_id) is None:
+                raise SystemExit(f"Unknown batch {batch_id}")
+            if output_dir:
+                await runner._update(batch_id, output_dir=output_dir)
+        else:
+            batch_id = await runner.create(read_stories(args.input), output_dir)
+        print(f"Batch {batch_id} (resume with --resume {batch_id})", file=sys.stderr)
+
+        async def report():
+            async for event, data in runner.events(batch_id):
+                if event == 'progress':
+                    print(f"{data['succeeded'] + data['failed']}/{data['total']} done, "
+                          f"{data['failed']} failed", file=sys.stderr)
+
+        reporter = asyncio.create_task(report())
+        status = await runner.run(batch_id)
+        await asyncio.wait_for(reporter, timeout=5)
+        if archive_path:
+            await runner.archive(batch_id, archive_path)
+        result = await runner.get(batch_id)
+        result["output"] = archive_path or await runner.output_dir(batch_id)
+        print(json.dumps(result, indent=2))
+        return 0 if status == 'completed' else 1
+    finally:
+        await registry.aclose()
+        await db.dispose()
+
+
+def main():
+    import argparse
+    from dotenv import load_dotenv
+    from services.metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', help="CSV, JSONL or .txt file of stories")
+    parser.add_argument('--output', help="Directory for the books, or a .zip path")
+    parser.add_argument('--resume', metavar='BATCH_ID', help="Continue an interrupted batch")
+    parser.add_argument('--workers', type=int, help="Stories generated at once (default: batch.workers)")
+    args = parser.parse_args()
+    if not args.input and not args.resume:
+        parser.error("pass a story file or --resume BATCH_ID")
+
+    load_dotenv()
+    if args.workers:
+        os.environ['BATCH_WORKERS'] = str(args.workers)
+    configure_logging(os.environ.get('LOG_LEVEL', 'WARNING'))
+    sys.exit(asyncio.run(_run_cli(args)))
+
+
+if __name__ == '__main__':
+    main()
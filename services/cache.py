@@ -0,0 +1,180 @@
+import re
+import time
+import json
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from models.database import CacheEntry
+
+logger = logging.getLogger('kidsbook')
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def normalize_text(text: str) -> str:
+    """Folds case, Unicode forms and whitespace so near-identical submissions share a key."""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def make_key(kind: str, **parts) -> str:
+    """Content address for a generation: a SHA-256 over the kind and every input that shapes the output."""
+    payload = json.dumps({"kind": kind, **parts}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for editor and illustrator results.
+
+    An in-process LRU with per-entry TTL answers repeat submissions without I/O; misses
+    fall through to the `result_cache` table so results survive restarts and are shared
+    by every worker using the same database. With a coordination backend (`shared`), its
+    cache sits between the two, so worker processes on one host share results without a
+    database round trip.
+    """
+
+    def __init__(self, db=None, max_entries: int = 1024, ttl_seconds: dict = None, enabled: bool = True,
+                 shared=None):
+        self.db = db
+        self.shared = shared
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds or {}
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self.counters = {
+            "memory_hits": 0,
+            "shared_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "writes": 0
+        }
+
+    @classmethod
+    def from_config(cls, db, config: dict, shared=None):
+        """Reads the `cache` section of azure_config.json."""
+        return cls(
+            db if config.get('persistent', True) else None,
+            max_entries=int(config.get('max_entries', 1024)),
+            ttl_seconds=config.get('ttl_seconds', {}),
+            enabled=config.get('enabled', True),
+            shared=shared
+        )
+
+    def ttl_for(self, kind: str) -> float:
+        return float(self.ttl_seconds.get(kind, DEFAULT_TTL_SECONDS))
+
+    async def get(self, key: str):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return value
+            del self._entries[key]
+            self.counters["expirations"] += 1
+
+        if self.shared is not None:
+            try:
+                row = await self.shared.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache lookup failed: {str(e)}")
+                row = None
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                self.counters["shared_hits"] += 1
+                return value
+
+        if self.db is not None:
+            try:
+                row = await self._load(key)
+            except Exception as e:
+                logger.warning(f"Result cache lookup failed: {str(e)}")
+                row = None
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                await self._share(key, value, expires_at)
+                self.counters["persistent_hits"] += 1
+                return value
+
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, kind: str, value):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl_for(kind)
+        self._remember(key, value, expires_at)
+        self.counters["writes"] += 1
+        await self._share(key, value, expires_at)
+        if self.db is not None:
+            try:
+                await self._store(key, kind, value, expires_at)
+            except Exception as e:
+                # The in-memory tier still holds the value; a failed write only costs persistence
+                logger.warning(f"Result cache write failed: {str(e)}")
+
+    async def _share(self, key: str, value, expires_at: float):
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(key, value, expires_at)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def _remember(self, key: str, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def _load(self, key: str):
+        async with self.db.session() as session:
+            entry = await session.get(CacheEntry, key)
+            if entry is None:
+                return None
+            if entry.expires_at <= datetime.utcnow():
+                await session.delete(entry)
+                await session.commit()
+                self.counters["expirations"] += 1
+                return None
+            remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+            return entry.value, time.time() + remaining
+
+    async def _store(self, key: str, kind: str, value, expires_at: float):
+        async with self.db.session() as session:
+            await session.merge(CacheEntry(
+                key=key,
+                kind=kind,
+                value=value,
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=expires_at - time.time())
+            ))
+            await session.commit()
+
+    async def purge_expired(self):
+        """Deletes expired rows from the shared and persistent tiers; returns how many were removed from the latter."""
+        if self.shared is not None:
+            await self.shared.purge_expired()
+        if self.db is None:
+            return 0
+        async with self.db.session() as session:
+            result = await session.execute(
+                delete(CacheEntry).where(CacheEntry.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+            return result.rowcount
+
+    def stats(self):
+        return {**self.counters, "entries": len(self._entries), "max_entries": self.max_entries}
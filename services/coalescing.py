@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('kidsbook')
+
+# Queued after a flight's last event so attached callers stop waiting
+_FINISHED = (None, None, None)
+
+
+class Flight:
+    """One shared generation and the callers attached to it."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.state = {}
+        self.task = None
+        # (event, data, state snapshot) in emission order, replayed to late joiners
+        self.history = []
+        self.queues = set()
+
+    async def emit(self, event: str, data: dict):
+        item = (event, data, dict(self.state) if event == 'checkpoint' else None)
+        self.history.append(item)
+        for queue in self.queues:
+            queue.put_nowait(item)
+
+    def attach(self) -> asyncio.Queue:
+        """Returns a queue primed with everything emitted so far, then fed live events."""
+        queue = asyncio.Queue()
+        tokens = []
+        for event, data, snapshot in self.history:
+            if event == 'token':
+                # A late joiner gets the text streamed so far as one delta
+                tokens.append(data['text'])
+                continue
+            if tokens:
+                queue.put_nowait(('token', {'text': ''.join(tokens)}, None))
+                tokens = []
+            queue.put_nowait((event, data, snapshot))
+        if tokens:
+            queue.put_nowait(('token', {'text': ''.join(tokens)}, None))
+        if self.task.done():
+            queue.put_nowait(_FINISHED)
+        else:
+            self.queues.add(queue)
+        return queue
+
+    def finish(self):
+        for queue in self.queues:
+            queue.put_nowait(_FINISHED)
+        self.queues.clear()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical generations.
+
+    The first caller for a key starts `work(state, emit)` as a shared task; callers arriving
+    with the same key while it runs attach to it instead of starting their own. Every caller
+    receives the shared events through its own `emit` and gets the shared stage outputs copied
+    into its own `state`. A caller that goes away only detaches; the shared task is cancelled
+    once nobody is waiting for it.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights = {}
+        self.counters = {"leaders": 0, "followers": 0, "abandoned": 0}
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Reads the `pipeline.coalescing` section of azure_config.json."""
+        return cls(enabled=config.get('enabled', True))
+
+    async def run(self, key: str, work, state: dict, emit):
+        if not self.enabled:
+            return await work(state, emit)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, work)
+            self.counters["leaders"] += 1
+        else:
+            self.counters["followers"] += 1
+            logger.info(f"Attached to in-flight generation {key[:12]} ({len(flight.queues)} waiting)")
+
+        queue = flight.attach()
+        try:
+            while True:
+                event, data, snapshot = await queue.get()
+                if event is None:
+                    break
+                if snapshot is not None:
+                    state.update(snapshot)
+                await emit(event, data)
+            result = flight.task.result()
+            state.update(flight.state)
+            return result
+        finally:
+            flight.queues.discard(queue)
+            if not flight.queues and not flight.task.done():
+                self.counters["abandoned"] += 1
+                flight.task.cancel()
+
+    def _start(self, key: str, work) -> Flight:
+        flight = Flight(key)
+        flight.task = asyncio.create_task(work(flight.state, flight.emit))
+
+        def finished(task):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.finish()
+            # Callers read the outcome; this only keeps an unobserved failure out of the log
+            if not task.cancelled():
+                task.exception()
+
+        flight.task.add_done_callback(finished)
+        self._flights[key] = flight
+        return flight
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self._flights), "enabled": self.enabled}
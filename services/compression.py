@@ -0,0 +1,85 @@
+"""
+Response compression.
+
+CompressionMiddleware extends Starlette's GZipMiddleware with brotli for clients that accept
+it. Brotli is optional: without the `brotli` package every client gets gzip. Responses below
+`minimum_size`, responses that already carry a Content-Encoding (the precompressed static
+files), images, event streams and exported PDF/EPUB files pass through untouched.
+"""
+import os
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder, DEFAULT_EXCLUDED_CONTENT_TYPES
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+DEFAULT_COMPRESSION_CONFIG = {
+    "enabled": True,
+    "minimum_size": 1024,
+    "gzip_level": 6,
+    "brotli_quality": 5
+}
+
+# Exported books are served with Range support and are mostly JPEG data already
+EXCLUDED_CONTENT_TYPES = DEFAULT_EXCLUDED_CONTENT_TYPES + ("application/pdf", "application/epub+zip")
+
+
+def accepts(headers: Headers, encoding: str) -> bool:
+    """True when Accept-Encoding lists `encoding` without refusing it (q=0)."""
+    for part in headers.get('accept-encoding', '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() != encoding:
+            continue
+        return params.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int = 5, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        data = self._compressor.process(body)
+        # Flush each chunk so streamed books reach the browser as they are rendered
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZipMiddleware that prefers brotli when it is installed and the client accepts it."""
+
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 6, brotli_quality: int = 5):
+        super().__init__(
+            app, minimum_size=minimum_size, compresslevel=compresslevel, exclude_content_types=EXCLUDED_CONTENT_TYPES
+        )
+        self.brotli_quality = brotli_quality if brotli is not None else None
+
+    @classmethod
+    def options(cls, config: dict) -> dict:
+        """Middleware kwargs from the `compression` section of azure_config.json, with env var overrides."""
+        merged = dict(DEFAULT_COMPRESSION_CONFIG)
+        merged.update(config)
+        return {
+            "minimum_size": int(os.environ.get('COMPRESSION_MINIMUM_SIZE', merged['minimum_size'])),
+            "compresslevel": int(merged['gzip_level']),
+            "brotli_quality": merged.get('brotli_quality')
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.brotli_quality is not None and accepts(Headers(scope=scope), 'br'):
+            responder = BrotliResponder(
+                self.app,
+                self.minimum_size,
+                quality=int(self.brotli_quality),
+                exclude_content_types=self.exclude_content_types
+            )
+            await responder(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
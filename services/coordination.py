@@ -0,0 +1,277 @@
+"""
+State shared by the worker processes of one deployment.
+
+With a single process the agents' limiters and the result cache's memory tier live in that
+process. With several workers (`gunicorn -c gunicorn.conf.py` or `uvicorn --workers`, with
+WEB_CONCURRENCY set to the worker count) each process would otherwise spend the whole Azure
+quota. A coordination backend instead holds:
+
+- the token-bucket state for every Azure deployment, so quotas hold across processes
+- a shared tier of the result cache between each worker's LRU and the database
+- one-off claims, so work such as recovering interrupted jobs happens in one worker only
+
+The `coordination.backend` setting (or COORDINATION_BACKEND) picks the backend:
+
+- "auto" (the default): "sqlite" when WEB_CONCURRENCY is above 1, otherwise "local"
+- "local": no shared state
+- "sqlite": a WAL-mode SQLite file on local disk (`coordination.path`, or COORDINATION_PATH)
+- "package.module:Class": any CoordinationBackend subclass; it is built with `Class.from_config(config)`
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+import importlib
+from abc import ABC, abstractmethod
+from services.paths import scratch_path
+
+logger = logging.getLogger('kidsbook')
+
+DEFAULT_PATH = 'kidsbook-coordination.db'
+
+# Set once per server run by gunicorn.conf.py and inherited by its workers
+BOOT_ID_ENV = 'KIDSBOOK_BOOT_ID'
+
+
+def worker_count() -> int:
+    """Worker processes serving the app, from WEB_CONCURRENCY (which gunicorn and uvicorn both read)."""
+    return max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+
+def server_id() -> str:
+    """
+    Identifies one run of the server. gunicorn.conf.py sets KIDSBOOK_BOOT_ID to a fresh value
+    before it forks the workers. Otherwise this is the supervising process (or this one, without
+    workers) and its start time: a restarted container reuses the same PIDs, usually 1.
+    """
+    boot_id = os.environ.get(BOOT_ID_ENV)
+    if boot_id:
+        return boot_id
+    pid = os.getppid() if worker_count() > 1 else os.getpid()
+    return f"{pid}@{_process_start_time(pid)}"
+
+
+def _process_start_time(pid: int) -> str:
+    """Start time of `pid` in clock ticks after boot, from /proc; empty where /proc is missing."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Field 22; counted after the command name, which may itself contain spaces
+            return f.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return ''
+
+
+class CoordinationBackend(ABC):
+    """Interface for backends; every method may be called concurrently from many processes."""
+
+    name = 'base'
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls()
+
+    @abstractmethod
+    async def take(self, bucket: str, tokens: float, rate: float, capacity: float) -> float:
+        """
+        Refills `bucket` at `rate` tokens per second up to `capacity` and takes `tokens` from it.
+        Returns 0 once taken, otherwise the seconds until enough tokens will be available.
+        """
+
+    @abstractmethod
+    async def get(self, key: str):
+        """Returns (value, expires_at) for an unexpired cache entry, or None."""
+
+    @abstractmethod
+    async def set(self, key: str, value, expires_at: float):
+        """Stores a JSON-serializable `value` until `expires_at` (a time.time() timestamp)."""
+
+    async def purge_expired(self) -> int:
+        return 0
+
+    @abstractmethod
+    async def claim(self, name: str, owner) -> bool:
+        """True for the first caller per (name, owner); False for every later one with the same owner."""
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+    async def aclose(self):
+        return None
+
+
+class SQLiteBackend(CoordinationBackend):
+    """
+    Coordination through a SQLite file shared by the processes on one host.
+
+    Every operation is one short `BEGIN IMMEDIATE` transaction, so updates to a bucket are
+    serialized across processes. Calls run in a worker thread to keep the event loop free.
+    The file must be on local disk: SQLite locking is not reliable on network shares.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS token_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS claims (name TEXT PRIMARY KEY, owner TEXT NOT NULL, claimed_at REAL NOT NULL)"
+    )
+
+    def __init__(self, path: str = DEFAULT_PATH, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._connection = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "takes": 0,
+            "throttled": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_writes": 0
+        }
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(scratch_path(os.environ.get('COORDINATION_PATH', config.get('path', DEFAULT_PATH))))
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily so a connection is never inherited across fork()
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    def _transaction(self, operation, *args):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(connection, *args)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+
+    async def _call(self, operation, *args):
+        return await asyncio.to_thread(self._transaction, operation, *args)
+
+    @staticmethod
+    def _take(connection, bucket: str, tokens: float, rate: float, capacity: float) -> float:
+        now = time.time()
+        row = connection.execute("SELECT tokens, updated FROM token_buckets WHERE name = ?", (bucket,)).fetchone()
+        available = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+        wait = 0.0
+        if available >= tokens:
+            available -= tokens
+        else:
+            wait = (tokens - available) / rate
+        connection.execute(
+            "INSERT OR REPLACE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)", (bucket, available, now)
+        )
+        return wait
+
+    async def take(self, bucket: str, tokens: float, rate: float, capacity: float) -> float:
+        wait = await self._call(self._take, bucket, tokens, rate, capacity)
+        self.counters["takes" if wait <= 0 else "throttled"] += 1
+        return wait
+
+    @staticmethod
+    def _get(connection, key: str):
+        return connection.execute(
+            "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+
+    async def get(self, key: str):
+        row = await self._call(self._get, key)
+        if row is None:
+            self.counters["cache_misses"] += 1
+            return None
+        self.counters["cache_hits"] += 1
+        return json.loads(row[0]), row[1]
+
+    @staticmethod
+    def _set(connection, key: str, value: str, expires_at: float):
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+        )
+
+    async def set(self, key: str, value, expires_at: float):
+        await self._call(self._set, key, json.dumps(value), expires_at)
+        self.counters["cache_writes"] += 1
+
+    @staticmethod
+    def _purge(connection) -> int:
+        return connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    async def purge_expired(self) -> int:
+        return await self._call(self._purge)
+
+    @staticmethod
+    def _claim(connection, name: str, owner: str) -> bool:
+        row = connection.execute("SELECT owner FROM claims WHERE name = ?", (name,)).fetchone()
+        if row is not None and row[0] == owner:
+            return False
+        connection.execute(
+            "INSERT OR REPLACE INTO claims (name, owner, claimed_at) VALUES (?, ?, ?)", (name, owner, time.time())
+        )
+        return True
+
+    async def claim(self, name: str, owner) -> bool:
+        return await self._call(self._claim, name, str(owner))
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "path": self.path, **self.counters}
+
+    async def aclose(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend
+}
+
+
+def from_config(config: dict):
+    """
+    Builds the backend named by the `coordination` section of azure_config.json.
+    Returns None for "local", where each process keeps its own state.
+    """
+    name = os.environ.get('COORDINATION_BACKEND', config.get('backend', 'auto'))
+    if name == 'auto':
+        name = 'sqlite' if worker_count() > 1 else 'local'
+    if name == 'local':
+        return None
+    if name in BACKENDS:
+        backend_class = BACKENDS[name]
+    else:
+        module_name, _, class_name = name.partition(':')
+        try:
+            backend_class = getattr(importlib.import_module(module_name), class_name)
+        except (ImportError, AttributeError, ValueError) as e:
+            logger.exception(f"Unknown coordination backend '{name}': {str(e)}")
+            raise
+    backend = backend_class.from_config(config)
+    logger.info(f"Coordinating {worker_count()} worker(s) through the {backend.name} backend")
+    return backend
+
+
+async def claim_once(backend, name: str) -> bool:
+    """True in exactly one worker per server run (always True without a backend)."""
+    if backend is None:
+        return True
+    return await backend.claim(name, server_id())
@@ -0,0 +1,389 @@
+"""
+PDF, EPUB and printable HTML exports of stored books.
+
+An export is built from the same page layout StoryProcessor renders (the renderer's
+context: pages, paragraphs and pictures). Rendering and image encoding are CPU-bound, so
+they run in a bounded process pool instead of on the event loop or its thread pool, and
+throughput grows with the number of cores. Pictures are read from the image store's
+directory, or downloaded once into the export directory, so they are embedded as local
+bytes rather than links.
+
+Each artifact is written to `export.directory` once per story, format and renderer
+version, and served from there afterwards, with Range support for large files. Concurrent
+requests for an artifact that is still rendering share that render.
+"""
+import os
+import io
+import html
+import base64
+import asyncio
+import hashlib
+import logging
+import zipfile
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from models.database import Story
+from services.coordination import worker_count
+from services.paths import data_path
+
+logger = logging.getLogger('kidsbook')
+
+# Bump when the output of the writers below changes, so stored artifacts are rebuilt
+EXPORT_VERSION = 2
+
+# format -> (media type, file extension)
+FORMATS = {
+    "pdf": ("application/pdf", "pdf"),
+    "epub": ("application/epub+zip", "epub"),
+    "html": ("text/html; charset=utf-8", "html")
+}
+
+DEFAULT_EXPORT_CONFIG = {
+    "directory": "exports",
+    "workers": 0,
+    "page_size": "a4",
+    "font": None,
+    "bold_font": None,
+    "fallback_fonts": []
+}
+
+
+class UnknownFormat(ValueError):
+    """Raised for an export format that is not in FORMATS."""
+
+
+def _data_uri(path: str) -> str:
+    from services.pdf import load_jpeg
+    data, _, _ = load_jpeg(path)
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def write_html(book: dict, f, options: dict):
+    """One self-contained HTML file: the book template with the stylesheet and pictures inlined."""
+    from services.renderer import default_environment, BOOK_TEMPLATE, BOOK_STYLESHEET
+    from services.static_build import STATIC_ROOT
+
+    with open(os.path.join(STATIC_ROOT, BOOK_STYLESHEET), 'rb') as stylesheet:
+        css = base64.b64encode(stylesheet.read()).decode('ascii')
+    context = {
+        "stylesheet_url": f"data:text/css;base64,{css}",
+        "title": book.get("heading"),
+        "cover_image_url": _data_uri(book["cover"]) if book.get("cover") else None,
+        "pages": [
+            {"page": page["page"], "url": _data_uri(page["image"]) if page.get("image") else None,
+             "paragraphs": page["paragraphs"]}
+            for page in book["pages"]
+        ],
+        "paginated": book["paginated"],
+        "generated_on": book["generated_on"]
+    }
+    f.write(default_environment().get_template(BOOK_TEMPLATE).render(**context).encode('utf-8'))
+
+
+EPUB_CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+
+EPUB_CSS = """body { font-family: sans-serif; line-height: 1.5; margin: 1em; }
+h1 { text-align: center; }
+img { display: block; max-width: 100%; height: auto; margin: 0 auto 1em; }
+.meta { text-align: center; color: #666; font-size: 0.9em; }
+"""
+
+
+def _xhtml(title: str, body: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="en">\n'
+        f'<head><meta charset="UTF-8"/><title>{html.escape(title)}</title>'
+        '<link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+        f'<body>\n{body}\n</body>\n</html>\n'
+    )
+
+
+def write_epub(book: dict, f, options: dict):
+    """EPUB 3: a cover document and one XHTML document per story page, pictures as JPEG."""
+    from services.pdf import load_jpeg
+
+    title = html.escape(book["title"])
+    manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+                '<item id="css" href="style.css" media-type="text/css"/>']
+    spine, toc, files = [], [], {}
+
+    def add_image(path: str, name: str, properties: str = '') -> str:
+        data, _, _ = load_jpeg(path)
+        files[f"OEBPS/{name}"] = data
+        extra = f' properties="{properties}"' if properties else ''
+        manifest.append(f'<item id="img-{name.split(".")[0]}" href="{name}" media-type="image/jpeg"{extra}/>')
+        return name
+
+    cover = f'<h1>{title}</h1>\n'
+    if book.get("cover"):
+        cover += f'<img src="{add_image(book["cover"], "cover.jpg", "cover-image")}" alt="Cover"/>\n'
+    cover += f'<p class="meta">Generated on {html.escape(book["generated_on"])}</p>'
+    files["OEBPS/cover.xhtml"] = _xhtml(book["title"], cover)
+    manifest.append('<item id="cover" href="cover.xhtml" media-type="application/xhtml+xml"/>')
+    spine.append('<itemref idref="cover"/>')
+    toc.append(f'<li><a href="cover.xhtml">{title}</a></li>')
+
+    for index, page in enumerate(book["pages"], start=1):
+        body = ''
+        if page.get("image"):
+            body += f'<img src="{add_image(page["image"], f"page-{index}.jpg")}" alt="Illustration for page {index}"/>\n'
+        body += '\n'.join(f'<p>{html.escape(paragraph)}</p>' for paragraph in page["paragraphs"])
+        name = f"page-{index}.xhtml"
+        files[f"OEBPS/{name}"] = _xhtml(f"Page {index}", body)
+        manifest.append(f'<item id="p{index}" href="{name}" media-type="application/xhtml+xml"/>')
+        spine.append(f'<itemref idref="p{index}"/>')
+        toc.append(f'<li><a href="{name}">Page {index}</a></li>')
+
+    files["OEBPS/style.css"] = EPUB_CSS
+    files["OEBPS/nav.xhtml"] = _xhtml(
+        book["title"], f'<nav epub:type="toc" id="toc"><h1>Contents</h1><ol>{"".join(toc)}</ol></nav>'
+    )
+    items = '\n    '.join(manifest)
+    files["OEBPS/content.opf"] = f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:kidsbook:story:{book["id"]}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>en</dc:language>
+    <meta property="dcterms:modified">{book["modified"]}</meta>
+  </metadata>
+  <manifest>
+    {items}
+  </manifest>
+  <spine>{''.join(spine)}</spine>
+</package>
+"""
+    with zipfile.ZipFile(f, 'w') as archive:
+        # The mimetype entry must come first and be stored uncompressed
+        archive.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        archive.writestr('META-INF/container.xml', EPUB_CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+        for name, content in files.items():
+            # JPEG data is already compressed
+            compression = zipfile.ZIP_STORED if name.endswith('.jpg') else zipfile.ZIP_DEFLATED
+            archive.writestr(name, content, compress_type=compression)
+
+
+def write_pdf(book: dict, f, options: dict):
+    from services import pdf
+    pdf.write_pdf(
+        book, f,
+        page_size=options.get('page_size', 'a4'),
+        font=options.get('font'),
+        bold_font=options.get('bold_font'),
+        fallback_fonts=options.get('fallback_fonts')
+    )
+
+
+WRITERS = {
+    "pdf": write_pdf,
+    "epub": write_epub,
+    "html": write_html
+}
+
+
+def render_artifact(fmt: str, book: dict, path: str, options: dict) -> int:
+    """
+    Writes one export to `path` and returns its size. Runs in a pool process; the file is
+    written under a temporary name and renamed, so readers never see a partial artifact.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, scratch = tempfile.mkstemp(prefix='.export-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            WRITERS[fmt](book, f, options)
+        os.replace(scratch, path)
+    except BaseException:
+        os.remove(scratch)
+        raise
+    return os.path.getsize(path)
+
+
+class BookExporter:
+    """
+    Builds, stores and looks up exports of stored stories.
+
+    Workers default to the machine's cores divided among the app's worker processes, so
+    several app workers do not oversubscribe the CPU between them.
+    """
+
+    def __init__(self, db, registry, directory: str = 'exports', workers: int = 0, page_size: str = 'a4',
+                 images_dir: str = 'generated', images_url: str = '/static/generated', fonts: dict = None):
+        self.db = db
+        self.registry = registry
+        self.directory = directory
+        self.workers = workers or max(1, (os.cpu_count() or 1) // worker_count())
+        self.options = {"page_size": page_size, **(fonts or {})}
+        self.images_dir = images_dir
+        self.images_url = images_url.rstrip('/')
+        self._executor = None
+        self._inflight = {}
+        self.counters = {
+            "stored_hits": 0,
+            "coalesced": 0,
+            "renders": 0,
+            "failures": 0,
+            "render_seconds": 0.0,
+            "bytes_written": 0
+        }
+
+    @classmethod
+    def from_config(cls, db, registry, config: dict, assets_config: dict = None):
+        """Reads the `export` section of azure_config.json, with env var overrides."""
+        merged = dict(DEFAULT_EXPORT_CONFIG)
+        merged.update(config)
+        assets_config = assets_config or {}
+        return cls(
+            db,
+            registry,
+            directory=data_path(os.environ.get('EXPORT_DIR', merged['directory'])),
+            workers=int(os.environ.get('EXPORT_WORKERS', merged['workers'])),
+            page_size=merged['page_size'],
+            images_dir=data_path(os.environ.get('IMAGE_STORE_DIR', assets_config.get('directory', 'generated'))),
+            images_url=assets_config.get('url_prefix', '/static/generated'),
+            fonts={key: merged[key] for key in ('font', 'bold_font', 'fallback_fonts')}
+        )
+
+    @property
+    def version(self) -> str:
+        # Follows the book template, so a redesigned book is exported again
+        return hashlib.sha256(
+            f"{EXPORT_VERSION}-{self.registry.story_processor.renderer.version}".encode('utf-8')
+        ).hexdigest()[:12]
+
+    def path(self, story_id: int, fmt: str) -> str:
+        if fmt not in FORMATS:
+            raise UnknownFormat(f"Unknown export format '{fmt}'; expected one of {', '.join(FORMATS)}")
+        return os.path.join(self.directory, str(story_id), f"{story_id}-{self.version}.{FORMATS[fmt][1]}")
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Spawned rather than forked: the parent runs an event loop and threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    async def export(self, story_id: int, fmt: str):
+        """Path of the stored artifact, rendering it first if needed; None if the story does not exist."""
+        path = self.path(story_id, fmt)
+        if await asyncio.to_thread(os.path.isfile, path):
+            self.counters["stored_hits"] += 1
+            return path
+        key = (story_id, fmt)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._build(story_id, fmt, path))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.counters["coalesced"] += 1
+        # Shielded so a client that disconnects does not cancel a render others may share
+        return await asyncio.shield(task)
+
+    async def _build(self, story_id: int, fmt: str, path: str):
+        async with self.db.session() as session:
+            story = await session.get(Story, story_id)
+        if story is None:
+            return None
+        book = await self._book(story)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            size = await loop.run_in_executor(self._pool(), render_artifact, fmt, book, path, self.options)
+        except BrokenProcessPool as e:
+            # A pool process died (e.g. out of memory); start a fresh pool for the next export
+            self.counters["failures"] += 1
+            self._executor = None
+            logger.exception(f"Export pool failed rendering story {story_id} as {fmt}: {str(e)}")
+            raise
+        except Exception as e:
+            self.counters["failures"] += 1
+            logger.exception(f"Error exporting story {story_id} as {fmt}: {str(e)}")
+            raise
+        elapsed = loop.time() - started
+        self.counters["renders"] += 1
+        self.counters["render_seconds"] += elapsed
+        self.counters["bytes_written"] += size
+        logger.info(f"Exported story {story_id} as {fmt} ({size} bytes) in {elapsed:.2f}s")
+        return path
+
+    async def _book(self, story: Story) -> dict:
+        """The layout StoryProcessor renders, with every picture resolved to a local file."""
+        illustrator_response = story.illustrator_response or {}
+        context = self.registry.story_processor.renderer.context(
+            story.edited_text, story.cover_image_url, illustrator_response.get('illustrations'), story.created_at,
+            title=(story.editor_response or {}).get('title')
+        )
+        urls = [context["cover_image_url"]] + [page["url"] for page in context["pages"]]
+        paths = await asyncio.gather(*(self._local_image(url) for url in urls))
+        created_at = story.created_at
+        return {
+            "id": story.id,
+            "title": context["title"] or (story.edited_text or '').split('\n')[0].strip() or "Your Kids Book",
+            # Shown above the cover in the HTML export; stories saved before titles were kept have none
+            "heading": context["title"],
+            "cover": paths[0],
+            "pages": [
+                {"page": page["page"], "image": image, "paragraphs": page["paragraphs"]}
+                for page, image in zip(context["pages"], paths[1:])
+            ],
+            "paginated": context["paginated"],
+            "generated_on": context["generated_on"],
+            "modified": created_at.strftime('%Y-%m-%dT%H:%M:%SZ') if created_at else '1970-01-01T00:00:00Z'
+        }
+
+    async def _local_image(self, url: str):
+        """A local file holding the picture at `url`, or None if it cannot be had (the export goes without it)."""
+        if not url:
+            return None
+        if url.startswith(self.images_url + '/'):
+            path = os.path.join(self.images_dir, url[len(self.images_url) + 1:])
+            if await asyncio.to_thread(os.path.isfile, path):
+                return path
+        if not url.startswith(('http://', 'https://')):
+            logger.warning(f"Export skipped picture {url}: not in the image store")
+            return None
+        # Blob storage or an original DALL-E URL: downloaded once and kept with the exports
+        path = os.path.join(self.directory, 'images', hashlib.sha256(url.encode('utf-8')).hexdigest())
+        if await asyncio.to_thread(os.path.isfile, path):
+            return path
+        try:
+            await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+            buffer = io.BytesIO()
+            async with self.registry.async_client('assets').stream('GET', url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    buffer.write(chunk)
+            await asyncio.to_thread(_write_file, path, buffer.getvalue())
+            return path
+        except Exception as e:
+            logger.warning(f"Export could not download picture {url}: {str(e)}")
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": len(self._inflight),
+            **self.counters,
+            "render_seconds": round(self.counters["render_seconds"], 3)
+        }
+
+    async def aclose(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _write_file(path: str, data: bytes):
+    fd, scratch = tempfile.mkstemp(prefix='.download-', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(scratch, path)
@@ -0,0 +1,263 @@
+import os
+import uuid
+import time
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, update
+from models.database import Job
+from services.metrics import request_id_var, current_request_id
+from services.coordination import worker_count
+
+logger = logging.getLogger('kidsbook')
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+
+def lean_result(result: dict):
+    """A finished job's result without the book's HTML and text: the story id and the URLs to fetch them."""
+    if not result:
+        return result
+    return {
+        "story_id": result['story_id'],
+        "story_url": f"/stories/{result['story_id']}",
+        "cover_image_url": result.get('cover_image_url')
+    }
+
+
+class JobManager:
+    """
+    Durable background job queue backed by the `jobs` table.
+
+    Submissions are persisted before they are queued, a fixed pool of asyncio workers
+    runs them through the BookPipeline, and every stage change is both written to the
+    database and pushed to live subscribers. On startup, jobs left queued or running by
+    a previous process are put back on the queue and resume from their last checkpoint.
+    """
+
+    def __init__(self, db, pipeline, workers: int = 4, max_attempts: int = 3, timeout: float = 300,
+                 poll_interval: float = 2.0):
+        self.db = db
+        self.pipeline = pipeline
+        self.worker_count = workers
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self._subscribers = {}
+        self._partial_text = {}
+        self._running = set()
+
+    @classmethod
+    def from_config(cls, db, pipeline, config: dict):
+        """Reads the `jobs` section of azure_config.json, with env var overrides."""
+        return cls(
+            db,
+            pipeline,
+            workers=int(os.environ.get('JOB_WORKERS', config.get('workers', 4))),
+            max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', config.get('max_attempts', 3))),
+            timeout=float(os.environ.get('JOB_TIMEOUT', config.get('timeout', 300))),
+            poll_interval=float(config.get('poll_interval', 2.0))
+        )
+
+    async def start(self, recover: bool = True):
+        """
+        Starts the workers. With several worker processes only one of them passes `recover`,
+        since requeueing 'running' jobs would also catch the jobs its siblings are running.
+        """
+        if recover:
+            recovered = await self._recover()
+            for job_id in recovered:
+                self._queue.put_nowait(job_id)
+            if recovered:
+                logger.info(f"Recovered {len(recovered)} unfinished job(s)")
+        self._workers = [
+            asyncio.create_task(self._worker(n), name=f"job-worker-{n}")
+            for n in range(self.worker_count)
+        ]
+        logger.info(f"Job manager started with {self.worker_count} worker(s)")
+
+    async def stop(self):
+        """Cancels the workers. Interrupted jobs stay 'running' and are recovered on next start."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Job manager stopped")
+
+    async def submit(self, story: str) -> str:
+        job_id = str(uuid.uuid4())
+        await self._insert(job_id, story, current_request_id())
+        await self._queue.put(job_id)
+        logger.info(f"Queued job {job_id}")
+        return job_id
+
+    async def get(self, job_id: str, lean: bool = False):
+        job = await self._load(job_id)
+        if job is not None and lean:
+            job['result'] = lean_result(job['result'])
+        return job
+
+    async def events(self, job_id: str, keepalive: float = 15.0, lean: bool = False):
+        """
+        Yields (event, data) pairs for a job until it reaches a terminal status.
+        The current snapshot is sent first so late subscribers catch up. With `lean`,
+        the result carries the story id and URLs instead of the book itself.
+
+        A job run by another worker process publishes nothing here, so its row is polled
+        every `poll_interval` seconds instead and each change is sent as a new 'status'.
+        """
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        # Copied in the same step as subscribing so no delta is missed or repeated
+        partial_text = ''.join(self._partial_text.get(job_id, ()))
+        try:
+            job = await self.get(job_id, lean=lean)
+            if job is None:
+                return
+            yield 'status', job
+            if job['status'] in TERMINAL_STATUSES:
+                return
+            if partial_text:
+                yield 'token', {'text': partial_text}
+            last_sent = time.monotonic()
+            while True:
+                local = job_id in self._running or worker_count() == 1
+                try:
+                    event, data = await asyncio.wait_for(
+                        queue.get(), timeout=keepalive if local else min(keepalive, self.poll_interval)
+                    )
+                except asyncio.TimeoutError:
+                    latest = None if local else await self.get(job_id, lean=lean)
+                    if latest is not None and (latest['status'], latest['stage']) != (job['status'], job['stage']):
+                        job = latest
+                        yield 'status', job
+                        if job['status'] in TERMINAL_STATUSES:
+                            return
+                        last_sent = time.monotonic()
+                    elif time.monotonic() - last_sent >= keepalive:
+                        yield 'keepalive', {}
+                        last_sent = time.monotonic()
+                    continue
+                if event == 'done' and lean:
+                    data = {**data, 'result': lean_result(data['result'])}
+                yield event, data
+                if event in ('done', 'error'):
+                    return
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+    def _publish(self, job_id: str, event: str, data: dict):
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait((event, data))
+
+    async def _worker(self, n: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Worker {n} crashed on job {job_id}: {str(e)}")
+            finally:
+                request_id_var.set(None)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self._claim(job_id)
+        if job is None:
+            return
+        story, checkpoint, request_id = job
+        self._running.add(job_id)
+        # Logs, spans and the saved story carry the id of the request that queued the job
+        request_id_var.set(request_id or job_id)
+        self._publish(job_id, 'stage', {'stage': 'started'})
+
+        async def on_event(event: str, data: dict):
+            if event == 'token':
+                self._partial_text.setdefault(job_id, []).append(data['text'])
+                self._publish(job_id, 'token', data)
+            elif event in ('cover', 'speculation'):
+                self._publish(job_id, event, data)
+            elif event == 'stage':
+                await self._update(job_id, stage=data['stage'])
+                self._publish(job_id, 'stage', data)
+            elif event == 'checkpoint':
+                await self._update(job_id, checkpoint=dict(checkpoint), story_id=checkpoint.get('story_id'))
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                result = await self.pipeline.run(story, state=checkpoint, on_event=on_event, stream=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                message = "Operation timed out"
+            else:
+                message = str(e)
+            logger.exception(f"Job {job_id} failed: {message}")
+            await self._update(job_id, status='failed', error=message)
+            self._publish(job_id, 'error', {'job_id': job_id, 'error': message})
+            return
+        finally:
+            self._partial_text.pop(job_id, None)
+            self._running.discard(job_id)
+
+        await self._update(job_id, status='succeeded', stage='done', result=result, story_id=result['story_id'])
+        self._publish(job_id, 'done', {'job_id': job_id, 'result': result})
+        logger.info(f"Job {job_id} finished")
+
+    async def _insert(self, job_id: str, story: str, request_id: str = None):
+        async with self.db.session() as session:
+            session.add(Job(id=job_id, status='queued', input_text=story, checkpoint={}, request_id=request_id))
+            await session.commit()
+
+    async def _load(self, job_id: str):
+        async with self.db.session() as session:
+            job = await session.get(Job, job_id)
+            return job.to_dict() if job else None
+
+    async def _claim(self, job_id: str):
+        """Atomically moves a queued job to running; returns (input_text, checkpoint, request_id) or None."""
+        async with self.db.session() as session:
+            result = await session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', attempts=Job.attempts + 1, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            if not result.rowcount:
+                return None
+            job = await session.get(Job, job_id)
+            return job.input_text, dict(job.checkpoint or {}), job.request_id
+
+    async def _update(self, job_id: str, **values):
+        async with self.db.session() as session:
+            values['updated_at'] = datetime.utcnow()
+            await session.execute(update(Job).where(Job.id == job_id).values(**values))
+            await session.commit()
+
+    async def _recover(self):
+        """Requeues jobs interrupted by a restart, failing any that exhausted their attempts."""
+        async with self.db.session() as session:
+            await session.execute(
+                update(Job)
+                .where(Job.status == 'running', Job.attempts >= self.max_attempts)
+                .values(status='failed', error="Exceeded maximum attempts", updated_at=datetime.utcnow())
+            )
+            await session.execute(
+                update(Job)
+                .where(Job.status == 'running')
+                .values(status='queued', updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            rows = await session.execute(
+                select(Job.id).where(Job.status == 'queued').order_by(Job.created_at)
+            )
+            return list(rows.scalars())
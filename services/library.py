@@ -0,0 +1,142 @@
+import base64
+import logging
+from datetime import datetime
+from sqlalchemy import select, func, and_, or_
+from models.database import Story
+
+logger = logging.getLogger('kidsbook')
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+TITLE_CHARS = 80
+# Browsers keep the book but revalidate it with If-None-Match, which costs one 304
+BOOK_CACHE_CONTROL = "public, no-cache"
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(created_at: datetime, story_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{story_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, story_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(story_id)
+    except Exception as e:
+        raise InvalidCursor(f"Invalid cursor: {str(e)}")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as RFC 9110 asks for GET."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+class StoryLibrary:
+    """
+    Read side of the `stories` table: newest-first listing and re-opening stored books.
+
+    Listing uses keyset pagination on (created_at, id) backed by a composite index, so
+    every page costs the same however deep the client scrolls, and it selects only the
+    columns the list shows; the story text and JSON responses are never loaded for it.
+    """
+
+    # Columns returned by list(); the title is cut down by the database, not in Python
+    LIST_COLUMNS = (
+        Story.id,
+        Story.created_at,
+        Story.cover_image_url,
+        func.substr(Story.edited_text, 1, TITLE_CHARS).label('title')
+    )
+
+    def __init__(self, db, story_processor):
+        self.db = db
+        self.story_processor = story_processor
+
+    async def list(self, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+                   created_after: datetime = None, created_before: datetime = None,
+                   has_cover: bool = None) -> dict:
+        """
+        Returns {"stories": [...], "next_cursor": str or None}, newest first.
+        Pass `next_cursor` back as `cursor` to fetch the following page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = select(*self.LIST_COLUMNS)
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            query = query.where(or_(
+                Story.created_at < cursor_created_at,
+                and_(Story.created_at == cursor_created_at, Story.id < cursor_id)
+            ))
+        if created_after is not None:
+            query = query.where(Story.created_at >= created_after)
+        if created_before is not None:
+            query = query.where(Story.created_at < created_before)
+        if has_cover is True:
+            query = query.where(Story.cover_image_url.isnot(None))
+        elif has_cover is False:
+            query = query.where(Story.cover_image_url.is_(None))
+        # One extra row tells us whether another page exists without a COUNT(*)
+        query = query.order_by(Story.created_at.desc(), Story.id.desc()).limit(limit + 1)
+
+        async with self.db.session() as session:
+            rows = (await session.execute(query)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return {
+            "stories": [
+                {
+                    "id": row.id,
+                    "title": (row.title or '').split('\n')[0].strip(),
+                    "cover_image_url": row.cover_image_url,
+                    "created_at": row.created_at.isoformat() if row.created_at else None,
+                    "url": f"/stories/{row.id}"
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor
+        }
+
+    def etag(self, story_id: int) -> str:
+        """
+        Validator for a stored book. Saved books never change, so the id and the renderer's
+        template version identify the HTML and a match is answered without loading the story.
+        Weak because the compression middleware may encode the body differently.
+        """
+        return f'W/"{story_id}-{self.story_processor.renderer.version}"'
+
+    async def get(self, story_id: int):
+        async with self.db.session() as session:
+            return await session.get(Story, story_id)
+
+    def render(self, story: Story) -> str:
+        """Rebuilds the stored book's HTML from the saved story and images, without calling Azure."""
+        return self.story_processor.process(illustrator_prompt=story.illustrator_prompt, **self._render_args(story))
+
+    def generate(self, story: Story):
+        """Streams the stored book in chunks; served from the render cache once seen."""
+        return self.story_processor.generate(**self._render_args(story))
+
+    def _render_args(self, story: Story) -> dict:
+        illustrator_response = story.illustrator_response or {}
+        return {
+            "final_story": story.edited_text,
+            "title": (story.editor_response or {}).get('title'),
+            "cover_image_url": story.cover_image_url,
+            "illustrations": illustrator_response.get('illustrations'),
+            "cover_variants": illustrator_response.get('variants'),
+            "story_id": story.id,
+            "created_at": story.created_at
+        }
@@ -0,0 +1,185 @@
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger('kidsbook')
+
+# Id of the HTTP request (or the job it queued) the current task is working for
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_request_id():
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds `request_id` to every log record so handlers can include it in their format."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, [('le', repr(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+SPAN_SECONDS = REGISTRY.histogram(
+    'kidsbook_span_duration_seconds',
+    "Duration of instrumented operations (config load, editor and image calls, DB commits, renders).",
+    ('span', 'outcome')
+)
+TOKENS = REGISTRY.counter(
+    'kidsbook_tokens_total',
+    "Azure OpenAI tokens reported in completion usage.",
+    ('agent', 'kind')
+)
+COMPLETION_TOKENS = REGISTRY.histogram(
+    'kidsbook_completion_tokens',
+    "Completion tokens per Azure OpenAI chat request.",
+    ('agent',),
+    buckets=(50, 100, 200, 400, 600, 800, 1000, 1500, 2000, 3000, 4000)
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    'kidsbook_http_request_duration_seconds',
+    "HTTP request latency by route and status code.",
+    ('method', 'route', 'status')
+)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times the enclosed block into `kidsbook_span_duration_seconds{span=name}`. Failures are
+    recorded with outcome="error". A DEBUG line carrying the request id is logged only when
+    DEBUG is enabled.
+    """
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, span=name, outcome=outcome)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s %s in %.1f ms", name, outcome, elapsed * 1000)
+
+
+def record_token_usage(agent: str, usage):
+    """
+    Counts prompt and completion tokens from an OpenAI `usage` object, when present, and
+    observes the completion size per request.
+    """
+    if usage is None:
+        return
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, agent=agent, kind='prompt')
+    TOKENS.inc(completion_tokens, agent=agent, kind='completion')
+    COMPLETION_TOKENS.observe(completion_tokens, agent=agent)
+
+
+def configure_logging(level: str = 'INFO'):
+    """Sets the root log level and adds the request id to every handler's records."""
+    level = getattr(logging, str(level).upper(), logging.INFO)
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+    logging.getLogger().setLevel(level)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
@@ -0,0 +1,61 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger('kidsbook')
+
+
+def percentile(values, q: float):
+    """Nearest-rank percentile (q in 0..100) of an unsorted sequence; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: a background task sleeps for `interval` and records how much
+    later than requested it woke up. Sustained lag means something is blocking the loop.
+    """
+
+    def __init__(self, interval: float = 0.05, window: int = 1200):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > 0.5:
+                logger.warning(f"Event loop was blocked for {lag:.2f}s")
+
+    def stats(self):
+        samples = list(self.samples)
+        return {
+            "samples": len(samples),
+            "lag_p50_seconds": round(percentile(samples, 50) or 0.0, 4),
+            "lag_p99_seconds": round(percentile(samples, 99) or 0.0, 4),
+            "lag_max_seconds": round(self.max_lag, 4)
+        }
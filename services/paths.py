@@ -0,0 +1,36 @@
+"""
+Writable locations for files the app creates at runtime.
+
+The code and webapp/static may be deployed read-only (App Service runs from a mounted
+package with WEBSITE_RUN_FROM_PACKAGE=1), so nothing is written next to the code. Generated
+images, exports, batch archives and the fallback SQLite database go under one data
+directory: DATA_DIR, else $HOME/data/kidsbook, else kidsbook/ in the system temp directory.
+Relative paths in azure_config.json and in their env var overrides are taken from there.
+Directories are created when something is first written, never at import.
+"""
+import os
+import tempfile
+
+
+def data_root() -> str:
+    root = os.environ.get('DATA_DIR')
+    if root:
+        return root
+    home = os.environ.get('HOME')
+    if home:
+        return os.path.join(home, 'data', 'kidsbook')
+    return os.path.join(tempfile.gettempdir(), 'kidsbook')
+
+
+def data_path(path: str) -> str:
+    """`path` if absolute, else the same path under the data directory."""
+    return path if os.path.isabs(path) else os.path.join(data_root(), path)
+
+
+def scratch_path(path: str) -> str:
+    """
+    `path` if absolute, else under the system temp directory. For files that must be on
+    local disk (SQLite in WAL mode does not work on network shares such as App Service's
+    /home) and need not outlive the host.
+    """
+    return path if os.path.isabs(path) else os.path.join(tempfile.gettempdir(), path)
@@ -0,0 +1,141 @@
+"""
+PDF layout for exported books, drawn with fpdf2.
+
+Lays out a book (the dict built by services.export) as a cover page followed by one or more
+PDF pages per story page. Text is set in DejaVu Sans, a Unicode TrueType font shipped in
+services/fonts, and fpdf2 embeds the subset of glyphs each book uses, so accented Latin,
+Greek and Cyrillic print as written. Characters DejaVu lacks (CJK, most emoji) are taken
+from the `export.fallback_fonts` files when the host has them. Illustrations are re-encoded
+as JPEG with Pillow and embedded once each.
+"""
+import io
+import os
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+DEFAULT_FONT = os.path.join(FONT_DIR, 'DejaVuSans.ttf')
+DEFAULT_BOLD_FONT = os.path.join(FONT_DIR, 'DejaVuSans-Bold.ttf')
+FONT_FAMILY = 'Book'
+
+# export.page_size -> fpdf2 page format
+PAGE_SIZES = {
+    "a4": "A4",
+    "letter": "Letter"
+}
+
+# Lengths in points
+MARGIN = 54
+TITLE_SIZE = 26
+BODY_SIZE = 14
+LEADING = 20
+PARAGRAPH_GAP = 8
+FOOTER_SIZE = 9
+# Largest share of a page's text area an illustration may take
+IMAGE_SHARE = 0.5
+# Longest side of an embedded image, about 150 dpi across the page
+IMAGE_MAX_PIXELS = 1200
+JPEG_QUALITY = 85
+# Gray level of the page numbers and the date line
+MUTED = 102
+
+
+def load_jpeg(path: str):
+    """Returns (jpeg bytes, width, height), flattening transparency onto white."""
+    from PIL import Image
+    with Image.open(path) as image:
+        image.load()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((IMAGE_MAX_PIXELS, IMAGE_MAX_PIXELS), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        return buffer.getvalue(), image.width, image.height
+
+
+def _document(page_size: str, font: str, bold_font: str, fallback_fonts: list):
+    from fpdf import FPDF
+
+    class BookPdf(FPDF):
+        def footer(self):
+            # Drawn by fpdf2 as each page is closed; the cover counts as page 1
+            self.set_y(-MARGIN - FOOTER_SIZE)
+            self.set_font(FONT_FAMILY, '', FOOTER_SIZE)
+            self.set_text_color(MUTED)
+            self.cell(0, FOOTER_SIZE, str(self.page_no()), align='C')
+            self.set_text_color(0)
+
+    pdf = BookPdf(unit='pt', format=PAGE_SIZES[page_size])
+    pdf.set_margins(MARGIN, MARGIN, MARGIN)
+    pdf.set_auto_page_break(True, margin=MARGIN + FOOTER_SIZE * 2)
+    pdf.add_font(FONT_FAMILY, '', font)
+    pdf.add_font(FONT_FAMILY, 'B', bold_font)
+    fallbacks = []
+    for index, path in enumerate(fallback_fonts):
+        # A fallback missing on this host is skipped; its characters print as empty boxes
+        if os.path.isfile(path):
+            fallbacks.append(f"Fallback{index}")
+            pdf.add_font(fallbacks[-1], '', path)
+    if fallbacks:
+        pdf.set_fallback_fonts(fallbacks, exact_match=False)
+    return pdf
+
+
+class _Images:
+    """Draws illustrations centred in the text column, re-encoding each file only once."""
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self._loaded = {}
+
+    def draw(self, path: str, max_height: float):
+        if path not in self._loaded:
+            self._loaded[path] = load_jpeg(path)
+        data, pixel_width, pixel_height = self._loaded[path]
+        pdf = self.pdf
+        scale = min(pdf.epw / pixel_width, max_height / pixel_height)
+        width, height = pixel_width * scale, pixel_height * scale
+        if pdf.get_y() + height > pdf.page_break_trigger:
+            pdf.add_page()
+        pdf.image(io.BytesIO(data), x=pdf.l_margin + (pdf.epw - width) / 2, y=pdf.get_y(), w=width, h=height)
+        pdf.set_y(pdf.get_y() + height + LEADING)
+
+
+def write_pdf(book: dict, f, page_size: str = 'a4', font: str = None, bold_font: str = None,
+              fallback_fonts: list = None):
+    """Writes `book` to the binary file `f`."""
+    pdf = _document(page_size, font or DEFAULT_FONT, bold_font or DEFAULT_BOLD_FONT, fallback_fonts or [])
+    pdf.set_title(book["title"])
+    pdf.set_producer("Kids Book Web App")
+    images = _Images(pdf)
+    text_height = pdf.page_break_trigger - pdf.t_margin
+
+    # Cover: title, cover picture, date
+    pdf.add_page()
+    pdf.set_font(FONT_FAMILY, 'B', TITLE_SIZE)
+    pdf.multi_cell(0, TITLE_SIZE * 1.3, book["title"], align='C', new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(LEADING)
+    date_y = pdf.page_break_trigger - LEADING - BODY_SIZE
+    if book.get("cover"):
+        images.draw(book["cover"], date_y - pdf.get_y() - LEADING * 2)
+    pdf.set_font(FONT_FAMILY, '', BODY_SIZE)
+    pdf.set_text_color(MUTED)
+    pdf.set_y(date_y)
+    pdf.cell(0, BODY_SIZE, f"Generated on {book['generated_on']}", align='C')
+    pdf.set_text_color(0)
+
+    # Story: each illustrated page starts a new sheet; unillustrated text flows on
+    pdf.add_page()
+    for index, page in enumerate(book["pages"]):
+        if index and book.get("paginated"):
+            pdf.add_page()
+        if page.get("image"):
+            images.draw(page["image"], text_height * IMAGE_SHARE)
+        pdf.set_font(FONT_FAMILY, '', BODY_SIZE)
+        for paragraph in page["paragraphs"]:
+            pdf.multi_cell(0, LEADING, paragraph, align='L', new_x='LMARGIN', new_y='NEXT')
+            pdf.ln(PARAGRAPH_GAP)
+    f.write(pdf.output())
@@ -0,0 +1,342 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from difflib import SequenceMatcher
+from agents.base_agent import load_config
+from agents.prompting import TruncatedCompletion
+from models.database import Story
+from services.cache import make_key
+from services.coalescing import SingleFlight
+from services.metrics import current_request_id
+
+logger = logging.getLogger('kidsbook')
+
+
+class PipelineError(Exception):
+    """Raised when a stage produces no usable output."""
+
+
+async def _ignore_event(event: str, data: dict):
+    return None
+
+
+def opening_similarity(a: str, b: str) -> float:
+    """Word-level similarity (0..1) between two story openings."""
+    return SequenceMatcher(None, a.lower().split(), b.lower().split(), autojunk=False).ratio()
+
+
+class SpeculativeCover:
+    """A cover generation started before editing finishes, from text that may still change."""
+
+    def __init__(self, illustrator, source_text: str, prefix_chars: int):
+        self.opening = source_text[:prefix_chars]
+        self.started = time.perf_counter()
+        self.finished = None
+        self.task = asyncio.create_task(self._generate(illustrator, source_text))
+
+    async def _generate(self, illustrator, source_text: str):
+        try:
+            return await illustrator.generate_cover(source_text)
+        finally:
+            self.finished = time.perf_counter()
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+
+class BookPipeline:
+    """
+    Runs a story through the editor, illustrator, database and HTML render stages.
+
+    Stage outputs are written into a caller-owned `state` dict so an interrupted run
+    can be resumed from the last completed stage instead of starting over.
+    """
+
+    STAGES = ('editing', 'illustrating', 'saving', 'rendering')
+
+    def __init__(self, registry, db):
+        self.registry = registry
+        self.db = db
+        pipeline_config = load_config(registry.config_path).get('pipeline', {})
+        self.speculation_config = pipeline_config.get('speculative_cover', {})
+        self.speculation_source = self.speculation_config.get('source', 'tokens')
+        self.coalescing = SingleFlight.from_config(pipeline_config.get('coalescing', {}))
+
+    async def run(self, story: str, state: dict = None, on_event=None, stream: bool = False):
+        """
+        Builds the book and returns the final result.
+
+        Args:
+            story (str): The raw story submitted by the user.
+            state (dict): Checkpoint of previously completed stages, updated in place.
+            on_event: Async callback receiving ("stage", {...}) when a stage starts,
+                ("checkpoint", {...}) when it completes, ("token", {"text": ...}) for each
+                streamed editor delta, ("speculation", {...}) when a speculative cover is
+                kept or discarded and ("cover", {...}) once the cover exists.
+            stream (bool): Stream the editor completion and emit its deltas as they arrive.
+        """
+        state = state if state is not None else {}
+        emit = on_event or _ignore_event
+
+        await self.generate(story, state, emit, stream)
+        await emit('cover', {'cover_image_url': state['cover_image_url']})
+
+        if 'story_id' not in state:
+            await emit('stage', {'stage': 'saving'})
+            state['story_id'] = await self._save_story(story, state)
+            await emit('checkpoint', {'stage': 'saving'})
+
+        await emit('stage', {'stage': 'rendering'})
+        html_content = self.render(state)
+
+        return {
+            "html_content": html_content,
+            "cover_image_url": state['cover_image_url'],
+            "illustrations": state.get('illustrations') or [],
+            "final_story": state['editor_result'].get('final_story'),
+            "story_id": state['story_id'],
+            "story_url": f"/stories/{state['story_id']}",
+            "speculation": state.get('speculation')
+        }
+
+    async def generate(self, story: str, state: dict = None, emit=None, stream: bool = False) -> dict:
+        """
+        Runs the editing and illustrating stages only, for callers that store and render
+        the book themselves. Returns `state` with the editor result and images filled in.
+        """
+        state = state if state is not None else {}
+        emit = emit or _ignore_event
+        if 'cover_image_url' not in state:
+            if 'editor_result' in state:
+                # Resuming from a checkpoint: this run already owns its edited text
+                await self._generate(story, state, emit, stream)
+            else:
+                # Identical submissions arriving together share one editor and illustrator run;
+                # each still gets its own events, checkpoints and stored story
+                await self.coalescing.run(
+                    self.flight_key(story),
+                    lambda shared_state, shared_emit: self._generate(story, shared_state, shared_emit, stream),
+                    state,
+                    emit
+                )
+        return state
+
+    def render(self, state: dict) -> str:
+        """Renders the finished book for a state that has been generated and saved."""
+        return self.registry.story_processor.process(
+            final_story=state['editor_result'].get('final_story'),
+            cover_image_url=state['cover_image_url'],
+            illustrator_prompt=state['editor_result'].get('illustrator_prompt'),
+            illustrations=state.get('illustrations'),
+            story_id=state['story_id'],
+            cover_variants=state.get('cover', {}).get('variants'),
+            title=state['editor_result'].get('title'),
+            created_at=datetime.fromisoformat(state['created_at']) if state.get('created_at') else None
+        )
+
+    def flight_key(self, story: str) -> str:
+        """Fingerprint of everything that shapes the edited story and its pictures."""
+        illustrator = self.registry.illustrator
+        return make_key(
+            'pipeline',
+            editor=self.registry.editor.cache_key(story),
+            illustrator=illustrator.cache_key(''),
+            pages=illustrator.config.get('pages', {}),
+            speculation=self.speculation_config
+        )
+
+    async def _generate(self, story: str, state: dict, emit, stream: bool):
+        """Runs the editing and illustrating stages, writing their outputs into `state`."""
+        editor = self.registry.editor
+        illustrator = self.registry.illustrator
+
+        speculation = None
+        if 'editor_result' not in state:
+            await emit('stage', {'stage': 'editing'})
+            speculate = self._speculation_starter()
+            try:
+                if speculate is not None and (not stream or self.speculation_source == 'input'):
+                    speculation = speculate(story)
+                if stream:
+                    editor_result, streamed_speculation = await self._stream_edit(story, emit, speculate)
+                    speculation = speculation or streamed_speculation
+                else:
+                    editor_result = await editor.edit_story(story)
+                if not editor_result:
+                    raise PipelineError("Story editing failed")
+            except BaseException:
+                if speculation is not None:
+                    speculation.cancel()
+                raise
+            editing_finished = time.perf_counter()
+            state['editor_result'] = editor_result
+            await emit('checkpoint', {'stage': 'editing'})
+
+        editor_result = state['editor_result']
+        final_story = editor_result.get('final_story')
+        await emit('stage', {'stage': 'illustrating'})
+        if speculation is not None:
+            cover_request = self._speculative_cover(speculation, editor_result, editing_finished, state, emit)
+        else:
+            cover_request = illustrator.generate_cover(final_story, editor_result.get('illustrator_prompt'))
+        # The cover and every page picture are requested together; the illustrator's
+        # rate limiter spaces them out only as far as the deployment quota requires
+        cover, illustrations = await asyncio.gather(
+            cover_request,
+            self._illustrate_pages(editor_result)
+        )
+        if not cover or not cover.get('url'):
+            raise PipelineError("Cover image generation failed")
+        state['cover_image_url'] = cover['url']
+        state['cover'] = cover
+        state['illustrations'] = illustrations
+        await emit('checkpoint', {'stage': 'illustrating'})
+
+    def _speculation_starter(self):
+        """Returns a callable that starts a SpeculativeCover, or None when the mode is off."""
+        if not self.speculation_config.get('enabled', False):
+            return None
+        prefix_chars = int(self.speculation_config.get('prefix_chars', 200))
+        return lambda text: SpeculativeCover(self.registry.illustrator, text, prefix_chars)
+
+    async def _speculative_cover(self, speculation, editor_result: dict, editing_finished: float, state: dict, emit):
+        """
+        Keeps the speculative cover if the edited opening stayed close to the text it was
+        drawn from; otherwise cancels or discards it and generates the cover from the
+        edited story.
+        """
+        final_story = editor_result.get('final_story')
+        similarity = opening_similarity(speculation.opening, final_story[:len(speculation.opening)])
+        accepted = similarity >= float(self.speculation_config.get('min_similarity', 0.6))
+        cover = None
+        if accepted:
+            try:
+                cover = await speculation.task
+            except Exception as e:
+                logger.warning(f"Speculative cover failed, generating from the edited story: {str(e)}")
+        else:
+            speculation.cancel()
+
+        # Time the cover spent generating while the editor was still running
+        saved = 0.0
+        if cover is not None:
+            saved = max(0.0, min(speculation.finished, editing_finished) - speculation.started)
+        info = {
+            "accepted": cover is not None,
+            "similarity": round(similarity, 3),
+            "overlap_saved_seconds": round(saved, 3)
+        }
+        state['speculation'] = info
+        logger.info(
+            f"Speculative cover {'kept' if info['accepted'] else 'discarded'} "
+            f"(similarity {info['similarity']}, saved {info['overlap_saved_seconds']}s)"
+        )
+        await emit('speculation', info)
+
+        if cover is None:
+            cover = await self.registry.illustrator.generate_cover(final_story, editor_result.get('illustrator_prompt'))
+        return cover
+
+    def book_pages(self, editor_result: dict, pages_config: dict) -> list:
+        """
+        The pages to illustrate: the editor's own pages, as returned, when there are no more
+        than `max_pages`; otherwise the story split by length. The title is not page text;
+        the renderer shows it as the book's heading.
+        """
+        max_pages = int(pages_config.get('max_pages', 8))
+        pages = list(editor_result.get('pages') or [])
+        if pages and len(pages) <= max_pages:
+            return pages
+        return self.registry.story_processor.split_pages(
+            editor_result.get('final_story') or '',
+            max_pages=max_pages,
+            chars_per_page=int(pages_config.get('chars_per_page', 500))
+        )
+
+    async def _illustrate_pages(self, editor_result: dict):
+        """Illustrates each page of the book; returns None when pages are disabled."""
+        pages_config = self.registry.illustrator.config.get('pages', {})
+        if not pages_config.get('enabled', False):
+            return None
+        pages = self.book_pages(editor_result, pages_config)
+        if not pages:
+            return None
+        return await self.registry.illustrator.generate_illustrations(pages)
+
+    async def _stream_edit(self, story: str, emit, speculate=None):
+        """
+        Streams the editor completion, emitting each delta. When `speculate` is given and the
+        source is "tokens", a speculative cover is started from the first streamed opening.
+        A stream cut off by the token budget is finished with one non-streamed completion at
+        the editor's `max_tokens` ceiling. Returns (editor_result, speculation).
+        """
+        speculation = None
+        from_tokens = speculate is not None and self.speculation_source == 'tokens'
+        prefix_chars = int(self.speculation_config.get('prefix_chars', 200))
+        # Token events carry the story text only, not the JSON around it
+        editor = self.registry.editor
+        reader = editor.output_reader()
+        parts, length = [], 0
+        try:
+            try:
+                async for delta in editor.stream_edit_story(story):
+                    text = reader.feed(delta)
+                    if not text:
+                        continue
+                    parts.append(text)
+                    length += len(text)
+                    await emit('token', {'text': text})
+                    if from_tokens and speculation is None and length >= prefix_chars:
+                        speculation = speculate(''.join(parts))
+                editor_result = reader.result()
+            except TruncatedCompletion as e:
+                # The streamed story has no ending; the book is built from a complete one
+                if not editor.budget.can_retry(e):
+                    raise
+                editor_result = await editor.edit_story(story, max_tokens=editor.budget.ceiling)
+        except BaseException:
+            if speculation is not None:
+                speculation.cancel()
+            raise
+        if not editor_result or not editor_result.get('final_story'):
+            if speculation is not None:
+                speculation.cancel()
+            return None, None
+        return editor_result, speculation
+
+    def story_row(self, story: str, state: dict) -> Story:
+        """
+        Builds the `stories` row for a generated state without adding it to a session. The
+        row's `created_at` is recorded in `state` too, so the book rendered now shows the same
+        date as one rendered later from the database.
+        """
+        editor_result = state['editor_result']
+        created_at = datetime.utcnow()
+        state['created_at'] = created_at.isoformat()
+        return Story(
+            created_at=created_at,
+            input_text=story,
+            edited_text=editor_result.get('final_story'),
+            cover_image_url=state['cover_image_url'],
+            editor_prompt=self.registry.editor.prompt.system,
+            illustrator_prompt=editor_result.get('illustrator_prompt'),
+            editor_response=editor_result,
+            request_id=current_request_id(),
+            illustrator_response={
+                "cover_image_url": state['cover_image_url'],
+                "source_url": state.get('cover', {}).get('source_url'),
+                "variants": state.get('cover', {}).get('variants', {}),
+                "illustrations": state.get('illustrations') or [],
+                "speculation": state.get('speculation')
+            }
+        )
+
+    async def _save_story(self, story: str, state: dict):
+        """Stores the edited story and its cover, returning the new row id."""
+        async with self.db.session() as session:
+            db_story = self.story_row(story, state)
+            session.add(db_story)
+            await session.commit()
+            return db_story.id
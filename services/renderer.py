@@ -0,0 +1,145 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from services.static_build import static_url
+
+logger = logging.getLogger('kidsbook')
+
+BOOK_TEMPLATE = 'book.html'
+BOOK_STYLESHEET = 'css/book.css'
+
+VARIANT_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+
+def picture_sources(variants: dict) -> list:
+    """
+    `<source>` entries for the resized copies ImageStore keeps next to an image, one per
+    format with a width-descriptor srcset: [{"type", "srcset"}], WebP first.
+    """
+    by_type = {}
+    for label, url in sorted((variants or {}).items()):
+        width, _, ext = label.partition('.')
+        if ext not in VARIANT_TYPES or not width[1:].isdigit():
+            continue
+        by_type.setdefault(VARIANT_TYPES[ext], []).append((int(width[1:]), url))
+    return [
+        {"type": content_type, "srcset": ', '.join(f"{url} {width}w" for width, url in sorted(by_type[content_type]))}
+        for content_type in VARIANT_TYPES.values() if content_type in by_type
+    ]
+
+
+def default_environment(directory: str = 'webapp/templates') -> Environment:
+    """Stand-alone environment for callers outside the FastAPI app (scripts, the Django views)."""
+    return Environment(loader=FileSystemLoader(directory), autoescape=select_autoescape(default=True))
+
+
+class BookRenderer:
+    """
+    Renders finished books from the precompiled `book.html` template.
+
+    The template is compiled once and story text is autoescaped. Styling lives in a
+    shared stylesheet (its fingerprinted copy once the static build has run) instead of
+    being inlined into every book. Pictures list their stored WebP/JPEG variants in a
+    `<picture>` so browsers fetch the smallest copy that fits. Output for a stored story is kept in a small LRU keyed
+    by story id, since a saved book never changes.
+    """
+
+    def __init__(self, env: Environment = None, stylesheet_url: str = None, cache_entries: int = 256):
+        self.env = env if env is not None else default_environment()
+        self.template = self.env.get_template(BOOK_TEMPLATE)
+        self.stylesheet_url = stylesheet_url or static_url(BOOK_STYLESHEET)
+        # Changes whenever the template or stylesheet does; part of stored books' ETags
+        template_source = self.env.loader.get_source(self.env, BOOK_TEMPLATE)[0]
+        self.version = hashlib.sha256(
+            f"{template_source}\n{self.stylesheet_url}".encode('utf-8')
+        ).hexdigest()[:12]
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def context(self, final_story: str, cover_image_url: str, illustrations: list = None, created_at: datetime = None,
+                cover_variants: dict = None, title: str = None):
+        """
+        Template variables for a book. `title` is shown as the heading; the story text then
+        starts after it, as the editor's `final_story` opens with the title line.
+        """
+        if illustrations:
+            pages = [
+                {
+                    "page": page.get("page"),
+                    "url": page.get("url"),
+                    "sources": picture_sources(page.get("variants")) if page.get("url") else [],
+                    "paragraphs": [p for p in page.get("text", "").split('\n') if p.strip()]
+                }
+                for page in illustrations
+            ]
+        else:
+            paragraphs = [p for p in final_story.split('\n') if p.strip()]
+            if title and paragraphs and paragraphs[0].strip() == title:
+                paragraphs = paragraphs[1:]
+            pages = [{"page": None, "url": None, "sources": [], "paragraphs": paragraphs}]
+        return {
+            "stylesheet_url": self.stylesheet_url,
+            "title": title,
+            "cover_image_url": cover_image_url,
+            "cover_sources": picture_sources(cover_variants) if cover_image_url else [],
+            "pages": pages,
+            "paginated": bool(illustrations),
+            "generated_on": (created_at or datetime.now()).strftime('%B %d, %Y')
+        }
+
+    def cached(self, story_id):
+        if story_id is None:
+            return None
+        html_content = self._cache.get(story_id)
+        if html_content is not None:
+            self._cache.move_to_end(story_id)
+            self.hits += 1
+        return html_content
+
+    def _remember(self, story_id, html_content: str):
+        if story_id is None or self.cache_entries <= 0:
+            return
+        self._cache[story_id] = html_content
+        self._cache.move_to_end(story_id)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    def render(self, final_story: str, cover_image_url: str, illustrations: list = None,
+               story_id=None, created_at: datetime = None, cover_variants: dict = None, title: str = None) -> str:
+        """Returns the book as one string, reusing the cached copy for a known story id."""
+        html_content = self.cached(story_id)
+        if html_content is not None:
+            return html_content
+        self.misses += 1
+        html_content = self.template.render(
+            self.context(final_story, cover_image_url, illustrations, created_at, cover_variants, title)
+        )
+        self._remember(story_id, html_content)
+        return html_content
+
+    def generate(self, final_story: str, cover_image_url: str, illustrations: list = None,
+                 story_id=None, created_at: datetime = None, cover_variants: dict = None, title: str = None):
+        """
+        Yields the book in chunks as the template produces them, for chunked responses.
+        The chunks are joined into the story's cache entry once the book is complete.
+        """
+        html_content = self.cached(story_id)
+        if html_content is not None:
+            yield html_content
+            return
+        self.misses += 1
+        chunks = [] if story_id is not None else None
+        context = self.context(final_story, cover_image_url, illustrations, created_at, cover_variants, title)
+        for chunk in self.template.generate(context):
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            self._remember(story_id, ''.join(chunks))
+
+    def stats(self):
+        return {"entries": len(self._cache), "max_entries": self.cache_entries, "hits": self.hits, "misses": self.misses}
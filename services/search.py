@@ -0,0 +1,325 @@
+"""
+Full-text search over stored stories.
+
+On SQLite, the `stories_fts` FTS5 table (created by migration 2) indexes each story's
+submitted and edited text. Triggers keep it current on every insert. Results are ranked
+with BM25, weighting the edited text above the submission, and FTS5 builds the
+highlighted snippets. A query ranks at most `search.max_candidates` matches, so common
+words stay fast. On Azure SQL, a full-text index on `stories` is queried through
+CONTAINSTABLE, and snippets are cut in Python. Other databases fall back to a LIKE scan.
+
+Queries are plain words, all of which must match (stemmed, so "foxes" finds "fox"), and
+"quoted phrases". Operators are treated as words, so no input is a syntax error.
+
+Index the rows that predate the index, or create the index on Azure SQL:
+
+    python -m services.search --backfill
+    python -m services.search --optimize        # merge the SQLite index after a big batch
+    python -m services.search "brave turtle"   # try a query from the shell
+"""
+import os
+import re
+import sys
+import html
+import asyncio
+import logging
+from sqlalchemy import text, select, bindparam, or_, and_, null, DateTime
+from models.database import Story
+
+logger = logging.getLogger('kidsbook')
+
+DEFAULT_SEARCH_LIMIT = 20
+DEFAULT_MAX_CANDIDATES = 2000
+MAX_SEARCH_LIMIT = 100
+TITLE_CHARS = 80
+SNIPPET_WORDS = 16
+# BM25 column weights for (input_text, edited_text)
+COLUMN_WEIGHTS = (1.0, 2.0)
+# Escape character for the LIKE fallback; `_` is a word character, so terms can contain it
+LIKE_ESCAPE = '\\'
+
+# Marks matches inside FTS5 snippets; replaced with <mark> after the snippet is escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+_QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r'\w+')
+
+# Ranks at most :window + 1 matches: the newest ones, found by walking the index backwards.
+# Scoring every match of a word that is in most stories would take far longer.
+SQLITE_RANKED = f"""
+    SELECT rowid AS id, bm25(stories_fts, {COLUMN_WEIGHTS[0]}, {COLUMN_WEIGHTS[1]}) AS score
+    FROM stories_fts
+    WHERE stories_fts MATCH :query AND rowid >= coalesce(
+        (SELECT rowid FROM stories_fts WHERE stories_fts MATCH :query ORDER BY rowid DESC LIMIT 1 OFFSET :window), 0
+    )
+    ORDER BY score
+    LIMIT :limit OFFSET :offset
+"""
+
+# Snippets for one page only; snippet() re-reads each story's text, so it runs after ranking
+SQLITE_SNIPPETS = text(f"""
+    SELECT s.id, s.created_at, s.cover_image_url, substr(s.edited_text, 1, {TITLE_CHARS}) AS title,
+           snippet(stories_fts, -1, char(2), char(3), '…', {SNIPPET_WORDS}) AS snippet
+    FROM stories_fts JOIN stories AS s ON s.id = stories_fts.rowid
+    WHERE stories_fts MATCH :query AND stories_fts.rowid IN :ids
+""").bindparams(bindparam('ids', expanding=True)).columns(created_at=DateTime)
+
+MSSQL_SEARCH = """
+    SELECT s.id, s.created_at, s.cover_image_url, s.edited_text AS title, k.[RANK] AS score
+    FROM CONTAINSTABLE(stories, (input_text, edited_text), :query, :window) AS k
+    JOIN stories AS s ON s.id = k.[KEY]
+    ORDER BY k.[RANK] DESC, s.id DESC
+    OFFSET :offset ROWS FETCH NEXT :limit ROWS ONLY
+"""
+
+MSSQL_INDEX = (
+    "IF NOT EXISTS (SELECT 1 FROM sys.fulltext_catalogs WHERE name = 'kidsbook_catalog') "
+    "CREATE FULLTEXT CATALOG kidsbook_catalog",
+    "IF NOT EXISTS (SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('stories')) "
+    "CREATE FULLTEXT INDEX ON stories (input_text, edited_text) KEY INDEX {key_index} "
+    "ON kidsbook_catalog WITH CHANGE_TRACKING AUTO"
+)
+
+
+class InvalidQuery(ValueError):
+    """Raised for a search query with nothing to search for."""
+
+
+def parse_query(query: str) -> list:
+    """Splits a query into terms: single words and space-joined quoted phrases."""
+    terms = []
+    for phrase, word in _QUERY_PART.findall(query or ''):
+        words = _WORD.findall(phrase if phrase else word)
+        if phrase:
+            if words:
+                terms.append(' '.join(words))
+        else:
+            terms.extend(words)
+    if not terms:
+        raise InvalidQuery("Search query must contain at least one word")
+    return terms
+
+
+def fts5_query(terms: list) -> str:
+    # Every term quoted, so FTS5 operators and column filters in the input are just words
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def contains_query(terms: list) -> str:
+    return ' AND '.join(f'"{term}"' for term in terms)
+
+
+def like_pattern(term: str) -> str:
+    """`%term%` with LIKE's wildcards and the escape character in `term` matched literally."""
+    for character in (LIKE_ESCAPE, '%', '_'):
+        term = term.replace(character, LIKE_ESCAPE + character)
+    return f"%{term}%"
+
+
+def highlight(snippet: str) -> str:
+    """HTML for an FTS5 snippet: the story text escaped, the matches wrapped in <mark>."""
+    return html.escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def make_snippet(content: str, terms: list, words: int = SNIPPET_WORDS) -> str:
+    """Highlighted window of about `words` words around the first match, for databases without snippet()."""
+    # Whole words starting with a term, the way LIKE and the stemmed indexes match them
+    pattern = re.compile(
+        '|'.join(r'\b' + r'\s+'.join(map(re.escape, term.split())) + r'\w*' for term in terms), re.IGNORECASE
+    )
+    content = content or ''
+    match = pattern.search(content)
+    tokens = content.split()
+    if match is None:
+        start = 0
+    else:
+        start = max(0, len(content[:match.start()].split()) - words // 4)
+    window = ' '.join(tokens[start:start + words])
+    marked = pattern.sub(lambda m: f"{_OPEN}{m.group(0)}{_CLOSE}", window)
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + words < len(tokens) else ''
+    return highlight(f"{prefix}{marked}{suffix}")
+
+
+def _title(value: str) -> str:
+    return (value or '').split('\n')[0].strip()[:TITLE_CHARS]
+
+
+class StorySearch:
+    """
+    Ranked full-text search over the `stories` table, using the database's own index.
+
+    At most `max_candidates` matches are ranked per query: on SQLite the newest ones, on
+    Azure SQL the best ones (CONTAINSTABLE's top_n_by_rank). That keeps a word found in
+    most stories as fast as a rare one. Snippets are built for the returned page only.
+    """
+
+    def __init__(self, db, max_candidates: int = DEFAULT_MAX_CANDIDATES):
+        self.db = db
+        self.max_candidates = max_candidates
+        self.dialect = db.async_engine.dialect.name
+        self._mssql_indexed = None
+
+    @classmethod
+    def from_config(cls, db, config: dict):
+        """Builds the search from the `search` section of azure_config.json, with env var overrides."""
+        return cls(db, int(os.environ.get('SEARCH_MAX_CANDIDATES', config.get('max_candidates', DEFAULT_MAX_CANDIDATES))))
+
+    async def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT, offset: int = 0) -> dict:
+        """
+        Returns {"query", "results": [...], "next_offset"}, best match first. Each result has
+        the story's id, title, cover, creation time, URL and an HTML snippet with <mark>ed matches.
+        """
+        terms = parse_query(query)
+        limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+        offset = max(0, int(offset))
+        if self.dialect == 'sqlite':
+            results = await self._search_sqlite(terms, limit + 1, offset)
+        elif self.dialect == 'mssql' and await self._has_mssql_index():
+            results = await self._search_mssql(terms, limit + 1, offset)
+        else:
+            results = await self._search_like(terms, limit + 1, offset)
+        # One extra row tells us whether another page exists
+        next_offset = offset + limit if len(results) > limit else None
+        return {"query": query, "results": results[:limit], "next_offset": next_offset}
+
+    def _result(self, row, snippet: str, score) -> dict:
+        return {
+            "id": row.id,
+            "title": _title(row.title),
+            "snippet": snippet,
+            "score": round(float(score), 4) if score is not None else None,
+            "cover_image_url": row.cover_image_url,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "url": f"/stories/{row.id}"
+        }
+
+    async def _search_sqlite(self, terms: list, limit: int, offset: int) -> list:
+        query = fts5_query(terms)
+        async with self.db.session() as session:
+            ranked = (await session.execute(text(SQLITE_RANKED), {
+                "query": query, "window": self.max_candidates - 1, "limit": limit, "offset": offset
+            })).all()
+            if not ranked:
+                return []
+            rows = (await session.execute(SQLITE_SNIPPETS, {"query": query, "ids": [row.id for row in ranked]})).all()
+        snippets = {row.id: row for row in rows}
+        # bm25() is lower for better matches; flip it so a higher score is better everywhere
+        return [
+            self._result(snippets[row.id], highlight(snippets[row.id].snippet), -row.score)
+            for row in ranked if row.id in snippets
+        ]
+
+    async def _has_mssql_index(self) -> bool:
+        if self._mssql_indexed is None:
+            async with self.db.session() as session:
+                self._mssql_indexed = (await session.execute(text(
+                    "SELECT COUNT(*) FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('stories')"
+                ))).scalar() > 0
+            if not self._mssql_indexed:
+                logger.warning("No full-text index on stories; searching with LIKE until `python -m services.search --backfill` runs")
+        return self._mssql_indexed
+
+    async def _search_mssql(self, terms: list, limit: int, offset: int) -> list:
+        async with self.db.session() as session:
+            rows = (await session.execute(
+                text(MSSQL_SEARCH),
+                {"query": contains_query(terms), "window": self.max_candidates, "limit": limit, "offset": offset}
+            )).all()
+        return [self._result(row, make_snippet(row.title, terms), row.score) for row in rows]
+
+    async def _search_like(self, terms: list, limit: int, offset: int) -> list:
+        conditions = [
+            or_(
+                Story.input_text.ilike(like_pattern(term), escape=LIKE_ESCAPE),
+                Story.edited_text.ilike(like_pattern(term), escape=LIKE_ESCAPE)
+            )
+            for term in terms
+        ]
+        query = (
+            select(Story.id, Story.created_at, Story.cover_image_url, Story.edited_text.label('title'), null().label('score'))
+            .where(and_(*conditions))
+            .order_by(Story.created_at.desc(), Story.id.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+        async with self.db.session() as session:
+            rows = (await session.execute(query)).all()
+        return [self._result(row, make_snippet(row.title, terms), row.score) for row in rows]
+
+
+def optimize(connection):
+    """
+    Merges the SQLite index into one segment. Inserts add small segments that FTS5 merges
+    only gradually, and a fragmented index makes phrase queries slower. Run it after a
+    large batch, or from a nightly job.
+    """
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("INSERT INTO stories_fts (stories_fts) VALUES ('optimize')")
+
+
+def backfill(connection) -> str:
+    """
+    Indexes every existing story. On SQLite the FTS table is rebuilt from `stories`; on
+    Azure SQL the full-text index is created if needed and a full population is started.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.exec_driver_sql("INSERT INTO stories_fts (stories_fts) VALUES ('rebuild')")
+        optimize(connection)
+        count = connection.exec_driver_sql("SELECT COUNT(*) FROM stories").scalar()
+        return f"Indexed {count} stories"
+    if dialect == 'mssql':
+        key_index = connection.exec_driver_sql(
+            "SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID('stories') AND is_primary_key = 1"
+        ).scalar()
+        for statement in MSSQL_INDEX:
+            connection.exec_driver_sql(statement.format(key_index=key_index))
+        connection.exec_driver_sql("ALTER FULLTEXT INDEX ON stories START FULL POPULATION")
+        return "Started full-text population of stories"
+    return f"No full-text index for {dialect}; searches use LIKE"
+
+
+async def _run_cli(args) -> int:
+    from models.database import Database
+    from models.migrations import ensure_schema
+
+    db = Database()
+    try:
+        await ensure_schema(db)
+        if args.backfill:
+            # Full-text DDL on Azure SQL cannot run inside a transaction
+            async with db.async_engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                print(await conn.run_sync(backfill))
+        elif args.optimize:
+            async with db.async_engine.begin() as conn:
+                await conn.run_sync(optimize)
+        if args.query:
+            page = await StorySearch(db).search(args.query, limit=args.limit)
+            for result in page["results"]:
+                print(f"{result['id']:>8}  {result['score']}  {result['title']}\n          {result['snippet']}")
+        return 0
+    finally:
+        await db.dispose()
+
+
+def main():
+    import argparse
+    from dotenv import load_dotenv
+    from services.metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('query', nargs='?', help="Search and print the best matches")
+    parser.add_argument('--backfill', action='store_true', help="Index the stories already in the database")
+    parser.add_argument('--optimize', action='store_true', help="Merge the index after many inserts")
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+    if not args.query and not args.backfill and not args.optimize:
+        parser.error("pass a query, --backfill or --optimize")
+    load_dotenv()
+    configure_logging(os.environ.get('LOG_LEVEL', 'INFO'))
+    sys.exit(asyncio.run(_run_cli(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Cold-start profiling.
+
+Phases of application startup are always timed. With STARTUP_PROFILE=1 every module
+imported after `install_import_timer()` is timed as well, so the startup report shows which
+imports and which init steps the time went to.
+"""
+import os
+import sys
+import time
+import logging
+import importlib.abc
+from contextlib import contextmanager
+
+logger = logging.getLogger('kidsbook')
+
+# Taken when main.py starts importing; phases and the report are relative to it
+STARTED = time.perf_counter()
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time creating and executing it, nested imports included."""
+
+    def __init__(self, loader, timer, name: str):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def create_module(self, spec):
+        self._timer.enter(self._name)
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.exit(self._name)
+
+    def __getattr__(self, attribute):
+        return getattr(self._loader, attribute)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Meta path hook that records cumulative and self import time per module."""
+
+    def __init__(self):
+        self.modules = {}
+        self._stack = []
+        self._finding = False
+
+    def find_spec(self, fullname, path, target=None):
+        if self._finding:
+            return None
+        self._finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._finding = False
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    def enter(self, name: str):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self, name: str):
+        if not self._stack or self._stack[-1][0] != name:
+            return
+        _, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.modules[name] = (elapsed, elapsed - children)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def report(self, top: int = 15) -> dict:
+        packages = {}
+        for name, (_, self_time) in self.modules.items():
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0.0) + self_time
+        slowest = sorted(self.modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        return {
+            "modules_imported": len(self.modules),
+            "packages_seconds": {
+                name: round(seconds, 4)
+                for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+            },
+            "slowest_modules": [
+                {"module": name, "cumulative_seconds": round(cumulative, 4), "self_seconds": round(self_time, 4)}
+                for name, (cumulative, self_time) in slowest
+            ]
+        }
+
+
+class StartupProfile:
+    def __init__(self):
+        self.phases = {}
+        self.imports = None
+        self.ready_at = None
+
+    def install_import_timer(self):
+        """Starts timing imports when STARTUP_PROFILE is set; call before the heavy imports."""
+        if os.environ.get('STARTUP_PROFILE', '').lower() in ('1', 'true', 'yes') and self.imports is None:
+            self.imports = ImportTimer()
+            sys.meta_path.insert(0, self.imports)
+        return self
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def mark(self, name: str):
+        """Records how long after startup began a point was reached."""
+        self.phases[name] = round(time.perf_counter() - STARTED, 4)
+
+    def finish(self):
+        self.ready_at = time.perf_counter()
+        if self.imports is not None:
+            sys.meta_path.remove(self.imports)
+            logger.info(f"Startup profile: {self.report()}")
+        else:
+            logger.info(f"Ready {self.ready_at - STARTED:.2f}s after startup began: {self.phases}")
+
+    def report(self) -> dict:
+        report = {
+            "seconds_to_ready": round(self.ready_at - STARTED, 4) if self.ready_at else None,
+            "phases_seconds": self.phases
+        }
+        if self.imports is not None:
+            report["imports"] = self.imports.report()
+        return report
+
+
+PROFILE = StartupProfile()
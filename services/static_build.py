@@ -0,0 +1,98 @@
+"""
+Build step for the stylesheets and scripts under webapp/static.
+
+Each file is copied to webapp/static/dist under a name that includes a hash of its content.
+Next to it go gzip and, when the `brotli` package is installed, brotli copies compressed
+at the highest level. The mapping is written to dist/manifest.json. Pages link through
+static_url(), so a changed file gets a new URL, and the dist files can be cached
+forever. Run it before packaging a deployment and after editing a stylesheet or script:
+
+    python -m services.static_build
+"""
+import os
+import json
+import gzip
+import hashlib
+import logging
+from functools import lru_cache
+from services.compression import brotli
+
+logger = logging.getLogger('kidsbook')
+
+STATIC_ROOT = 'webapp/static'
+STATIC_URL = '/static'
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+SOURCES = ('css', 'js')
+HASH_CHARS = 12
+
+
+def fingerprint(path: str, content: bytes) -> str:
+    """`css/book.css` -> `css/book.<hash>.css`"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.{hashlib.sha256(content).hexdigest()[:HASH_CHARS]}{ext}"
+
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def build(root: str = STATIC_ROOT, sources=SOURCES) -> dict:
+    """
+    Writes the fingerprinted and precompressed copies and returns the manifest.
+    Older builds are left in place so pages cached before a deployment keep working.
+    """
+    manifest = {}
+    for source in sources:
+        for directory, _, filenames in os.walk(os.path.join(root, source)):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    content = f.read()
+                hashed = f"{DIST_DIR}/{fingerprint(relative, content)}"
+                target = os.path.join(root, hashed)
+                _write(target, content)
+                # mtime=0 keeps the .gz byte-identical across builds of the same file
+                _write(target + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(target + '.br', brotli.compress(content, quality=11))
+                manifest[relative] = hashed
+    with open(os.path.join(root, DIST_DIR, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(f"Built {len(manifest)} static file(s) into {os.path.join(root, DIST_DIR)}")
+    return manifest
+
+
+@lru_cache(maxsize=None)
+def load_manifest(root: str = STATIC_ROOT) -> dict:
+    """The build's manifest, read once per process; empty when the build has not been run."""
+    try:
+        with open(os.path.join(root, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def static_url(path: str, root: str = STATIC_ROOT) -> str:
+    """URL of a static file: its fingerprinted copy once built, otherwise the file itself."""
+    return f"{STATIC_URL}/{load_manifest(root).get(path, path)}"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=STATIC_ROOT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for source, target in sorted(build(args.root).items()):
+        print(f"{source} -> {target}")
+    if brotli is None:
+        print("brotli is not installed; wrote gzip copies only")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,175 @@
 document.addEventListener('DOMContentLoaded', function() {
     const form = document.getElementById('storyForm');
     const processingMessage = document.getElementById('processingMessage');
+    const processingStatus = processingMessage.querySelector('p');
     const resultsDiv = document.getElementById('results');
     const compositeStoryP = document.getElementById('compositeStory');
+    const streamingStory = document.getElementById('streamingStory');
+    const coverPreview = document.getElementById('coverPreview');
+
+    const stageLabels = {
+        queued: 'Waiting for a free storyteller...',
+        started: 'Getting started...',
+        editing: 'Polishing your story...',
+        illustrating: 'Painting the cover...',
+        saving: 'Saving your book...',
+        rendering: 'Binding the pages...'
+    };
+
+    function showStage(stage) {
+        processingStatus.textContent = stageLabels[stage] || 'Generating your story...';
+    }
+
+    // Append editor deltas as they arrive so the story appears while it is written
+    function appendText(text) {
+        streamingStory.textContent += text;
+        streamingStory.scrollTop = streamingStory.scrollHeight;
+    }
+
+    function showCover(coverImageUrl) {
+        coverPreview.src = coverImageUrl;
+        coverPreview.style.display = 'block';
+    }
+
+    function resetPreview() {
+        streamingStory.textContent = '';
+        coverPreview.removeAttribute('src');
+        coverPreview.style.display = 'none';
+    }
+
+    function showError() {
+        processingMessage.style.display = 'none';
+        resultsDiv.style.display = 'block';
+        compositeStoryP.textContent = 'Error generating story. Please try again.';
+    }
+
+    function showBook(result) {
+        processingMessage.style.display = 'none';
+        resultsDiv.style.display = 'block';
+
+        // Lean results link to the stored book, which the browser caches and revalidates
+        let url = result.story_url;
+        if (!url) {
+            // Create a blob from the HTML content; the base tag lets stored /static images resolve
+            const html = result.html_content.replace('<head>', `<head><base href="${window.location.origin}/">`);
+            const blob = new Blob([html], { type: 'text/html' });
+            url = URL.createObjectURL(blob);
+        }
+
+        // Display the story in an iframe
+        const iframe = document.createElement('iframe');
+        iframe.src = url;
+        iframe.style.width = '100%';
+        iframe.style.height = '600px';
+        iframe.style.border = '1px solid #ccc';
+        compositeStoryP.innerHTML = '';
+        compositeStoryP.appendChild(iframe);
+
+        // Add download button; stored books download as the self-contained HTML export,
+        // with the stylesheet and pictures inlined so the file works offline
+        const downloadUrl = result.story_id ? `/stories/${result.story_id}/export/html` : url;
+        const downloadBtn = document.createElement('button');
+        downloadBtn.textContent = 'Download Story';
+        downloadBtn.onclick = () => {
+            const a = document.createElement('a');
+            a.href = downloadUrl;
+            a.download = 'my-kids-story.html';
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+        };
+        compositeStoryP.appendChild(downloadBtn);
+
+        // Stored books can also be downloaded as PDF or EPUB, rendered on the server
+        if (result.story_id) {
+            [['pdf', 'Download PDF'], ['epub', 'Download EPUB']].forEach(([format, label]) => {
+                const link = document.createElement('a');
+                link.href = `/stories/${result.story_id}/export/${format}`;
+                link.textContent = label;
+                link.className = 'export-link';
+                compositeStoryP.appendChild(link);
+            });
+        }
+    }
+
+    // Apply a job snapshot from GET /jobs/{id}; returns true once the job is finished
+    function applyJob(job) {
+        if (job.status === 'succeeded') {
+            showBook(job.result);
+            return true;
+        }
+        if (job.status === 'failed') {
+            showError();
+            return true;
+        }
+        showStage(job.stage || job.status);
+        return false;
+    }
+
+    function pollJob(statusUrl) {
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (!applyJob(job)) {
+                    setTimeout(() => pollJob(statusUrl), 2000);
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                showError();
+            });
+    }
+
+    function followJob(job) {
+        if (!window.EventSource) {
+            pollJob(job.status_url);
+            return;
+        }
+
+        const source = new EventSource(job.events_url);
+        let finished = false;
+        source.addEventListener('status', event => {
+            finished = applyJob(JSON.parse(event.data));
+            if (finished) {
+                source.close();
+            }
+        });
+        source.addEventListener('stage', event => {
+            showStage(JSON.parse(event.data).stage);
+        });
+        source.addEventListener('token', event => {
+            appendText(JSON.parse(event.data).text);
+        });
+        source.addEventListener('cover', event => {
+            showCover(JSON.parse(event.data).cover_image_url);
+        });
+        source.addEventListener('done', event => {
+            finished = true;
+            source.close();
+            showBook(JSON.parse(event.data).result);
+        });
+        source.addEventListener('error', event => {
+            source.close();
+            if (event.data) {
+                finished = true;
+                showError();
+            } else if (!finished) {
+                // Connection dropped rather than the job failing; fall back to polling
+                pollJob(job.status_url);
+            }
+        });
+    }
 
     form.addEventListener('submit', function(event) {
         event.preventDefault();
         processingMessage.style.display = 'block';
         resultsDiv.style.display = 'none';
+        resetPreview();
+        showStage('queued');
 
         const formData = new FormData(form);
+        // Ask for the story id and URLs only; the book itself is loaded from /stories/{id}
+        formData.append('lean', 'true');
 
         fetch(form.action, {
             method: 'POST',
@@ -17,44 +177,15 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(response => response.json())
         .then(data => {
-            processingMessage.style.display = 'none';
-            resultsDiv.style.display = 'block';
-
-            if (data.status === 'success') {
-                // Create a blob from the HTML content
-                const blob = new Blob([data.html_content], { type: 'text/html' });
-                const url = URL.createObjectURL(blob);
-
-                // Display the story in an iframe
-                const iframe = document.createElement('iframe');
-                iframe.src = url;
-                iframe.style.width = '100%';
-                iframe.style.height = '600px';
-                iframe.style.border = '1px solid #ccc';
-                compositeStoryP.innerHTML = '';
-                compositeStoryP.appendChild(iframe);
-
-                // Add download button
-                const downloadBtn = document.createElement('button');
-                downloadBtn.textContent = 'Download Story';
-                downloadBtn.onclick = () => {
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = 'my-kids-story.html';
-                    document.body.appendChild(a);
-                    a.click();
-                    document.body.removeChild(a);
-                };
-                compositeStoryP.appendChild(downloadBtn);
+            if (data.status === 'queued') {
+                followJob(data);
             } else {
-                compositeStoryP.textContent = 'Error generating story. Please try again.';
+                showError();
             }
         })
         .catch(error => {
             console.error('Error:', error);
-            processingMessage.style.display = 'none';
-            resultsDiv.style.display = 'block';
-            compositeStoryP.textContent = 'Error generating story. Please try again.';
+            showError();
         });
     });
-});
\ No newline at end of file
+});
@@ -3,9 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import asyncio
 import logging
-from agents.editor_agent import EditorAgent
-from agents.illustrator_agent import IllustratorAgent
-from agents.story_processor import StoryProcessor
+from agents.registry import get_default_registry
 
 logger = logging.getLogger('kidsbook')
 
@@ -26,10 +24,11 @@ async def create_kids_book(request):
             logger.warning("No story provided in the request")
             return JsonResponse({'error': 'No story provided'}, status=400)
 
-        logger.info("Initializing agents")
-        editor = EditorAgent()
-        illustrator = IllustratorAgent()
-        story_processor = StoryProcessor()
+        logger.info("Fetching agents from the shared registry")
+        registry = get_default_registry()
+        editor = registry.editor
+        illustrator = registry.illustrator
+        story_processor = registry.story_processor
 
         # Create a timeout for the entire operation
         async with asyncio.timeout(300):  # 5 minutes timeout
@@ -47,18 +46,24 @@ async def create_kids_book(request):
                 logger.debug(f"Illustrator prompt: {illustrator_prompt}")
 
                 logger.info("Calling illustrator.generate_illustrations()")
-                illustrations = await illustrator.generate_illustrations(illustrator_prompt)
+                pages = editor_result.get('pages') or story_processor.split_pages(final_story)
+                cover_image_url, illustrations = await asyncio.gather(
+                    illustrator.generate_cover_image(final_story),
+                    illustrator.generate_illustrations(pages)
+                )
                 logger.info("Illustrator returned its result")
-                if not illustrations:
-                    logger.error("Illustrator returned no illustrations")
+                if not cover_image_url:
+                    logger.error("Illustrator returned no cover image")
                     return JsonResponse({'error': 'Illustration generation failed'}, status=500)
 
                 logger.info("Calling story_processor.process() in thread pool")
                 composite_story = await asyncio.to_thread(
                     story_processor.process,
                     final_story=final_story,
+                    cover_image_url=cover_image_url,
                     illustrations=illustrations,
-                    illustrator_prompt=illustrator_prompt
+                    illustrator_prompt=illustrator_prompt,
+                    title=editor_result.get('title')
                 )
                 logger.info("StoryProcessor returned composite story")
 